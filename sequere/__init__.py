@@ -5,6 +5,18 @@ __version__ = '.'.join(map(str, version))
 from .registry import register, autodiscover
 
 
-__all__ = ['register', 'autodiscover']
+__all__ = ['register', 'autodiscover', 'annotate_follow_state', 'annotate_counts']
 
 default_app_config = 'sequere.apps.SequereConfig'
+
+
+def annotate_follow_state(qs, viewer, *args, **kwargs):
+    from .models import annotate_follow_state
+
+    return annotate_follow_state(qs, viewer, *args, **kwargs)
+
+
+def annotate_counts(qs, *args, **kwargs):
+    from .models import annotate_counts
+
+    return annotate_counts(qs, *args, **kwargs)
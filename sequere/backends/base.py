@@ -20,5 +20,17 @@ class BaseBackend(object):
     def get_followers_count(self, instance):
         raise NotImplemented
 
+    def get_followings_counts(self, instances, identifier=None):
+        raise NotImplementedError
+
+    def get_followers_counts(self, instances, identifier=None):
+        raise NotImplementedError
+
+    def annotate_follow_state(self, qs, viewer, name='is_followed_by_viewer'):
+        raise NotImplementedError
+
+    def annotate_counts(self, qs, kinds=None, identifier=None):
+        raise NotImplementedError
+
     def clear(self):
         raise NotImplemented
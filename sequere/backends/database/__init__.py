@@ -1,5 +1,11 @@
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
+
 from django.core.exceptions import ImproperlyConfigured
-from django.db.models import Q
+from django.db import connections
+from django.db.models import Q, Count
 
 from sequere.backends.base import BaseBackend
 from sequere.registry import registry
@@ -9,6 +15,15 @@ from .query import DatabaseQuerySetTransformer
 from .models import Follow
 
 
+# correlated subqueries for annotate_follow_state / annotate_counts, keyed
+# by the column pair holding the annotated row: (identifier, object_id)
+COUNT_SUBQUERIES = {
+    'followers': ('to_identifier', 'to_object_id', ''),
+    'followings': ('from_identifier', 'from_object_id', ''),
+    'friends': ('from_identifier', 'from_object_id', ' AND sequere_f.is_mutual = %s'),
+}
+
+
 class DatabaseBackend(BaseBackend):
     model = Follow
 
@@ -18,80 +33,44 @@ class DatabaseBackend(BaseBackend):
                 "The sequere.backends.database app isn't installed "
                 "correctly. Make sure it's in your INSTALLED_APPS setting.")
 
-    def _params(self, from_instance=None, to_instance=None):
-        params = {}
-
-        if from_instance:
-            from_identifier = registry.get_identifier(from_instance)
-
-            params.update({
-                'from_identifier': from_identifier,
-                'from_object_id': from_instance.pk,
-            })
-
-        if to_instance:
-            to_identifier = registry.get_identifier(to_instance)
-
-            params.update({
-                'to_identifier': to_identifier,
-                'to_object_id': to_instance.pk
-            })
-
-        return params
-
     def follow(self, from_instance, to_instance):
-        new, created = self.model.objects.get_or_create(**self._params(from_instance=from_instance,
-                                                                       to_instance=to_instance))
+        new, created = self.model.objects.create_follow(from_instance, to_instance)
 
         if created:
             followed.send(sender=self.model,
                           from_instance=from_instance,
                           to_instance=to_instance)
 
-        if self.is_following(to_instance, from_instance):
-            self.model.objects.filter(
-                Q(**self._params(from_instance=from_instance,
-                                 to_instance=to_instance))
-                |
-                Q(**self._params(to_instance=from_instance,
-                                 from_instance=to_instance))).update(is_mutual=True)
-
         return new
 
     def unfollow(self, from_instance, to_instance):
-        if self.is_following(to_instance, from_instance):
-            self.model.objects.from_instance(to_instance).to_instance(from_instance).update(is_mutual=False)
-
-        qs = self.model.objects.from_instance(from_instance).to_instance(to_instance)
-
-        count = qs.count()
-
-        qs.delete()
+        count = self.model.objects.delete_follow(from_instance, to_instance)
 
         if count:
             unfollowed.send(sender=self.model,
                             from_instance=from_instance,
                             to_instance=to_instance)
 
+    def retrieve_instances(self, qs, count, desc, identifier_key, object_id_key):
+        transformer = DatabaseQuerySetTransformer(qs, count)
+
+        transformer.aggregate_by(identifier_key)
+        transformer.pivot_by(object_id_key)
+        transformer.order_by('-created_at' if desc else 'created_at')
+
+        return transformer
+
     def get_followers(self, instance, desc=True, identifier=None):
         qs = self.model.objects.to_instance(instance)
 
         if identifier:
             qs = qs.filter(from_identifier=identifier)
 
-        order_by = '-created_at' if desc else 'created_at'
-
-        qs.order_by(order_by)
-
-        count = self.get_followers_count(instance,
-                                         identifier=identifier)
-
-        transformer = DatabaseQuerySetTransformer(qs, count)
-        transformer.aggregate_by('from_identifier')
-        transformer.pivot_by('from_object_id')
-        transformer.order_by(order_by)
-
-        return transformer
+        return self.retrieve_instances(qs,
+                                       self.get_followers_count(instance, identifier=identifier),
+                                       desc,
+                                       'from_identifier',
+                                       'from_object_id')
 
     def get_followings(self, instance, desc=True, identifier=None):
         qs = self.model.objects.from_instance(instance)
@@ -99,20 +78,11 @@ class DatabaseBackend(BaseBackend):
         if identifier:
             qs = qs.filter(to_identifier=identifier)
 
-        order_by = '-created_at' if desc else 'created_at'
-
-        qs.order_by(order_by)
-
-        count = self.get_followings_count(instance,
-                                          identifier=identifier)
-
-        transformer = DatabaseQuerySetTransformer(qs, count)
-
-        transformer.aggregate_by('to_identifier')
-        transformer.pivot_by('to_object_id')
-        transformer.order_by(order_by)
-
-        return transformer
+        return self.retrieve_instances(qs,
+                                       self.get_followings_count(instance, identifier=identifier),
+                                       desc,
+                                       'to_identifier',
+                                       'to_object_id')
 
     def is_following(self, from_instance, to_instance):
         return self.model.objects.from_instance(from_instance).to_instance(to_instance).exists()
@@ -131,20 +101,11 @@ class DatabaseBackend(BaseBackend):
         if identifier:
             qs = qs.filter(to_identifier=identifier)
 
-        order_by = '-created_at' if desc else 'created_at'
-
-        qs.order_by(order_by)
-
-        count = self.get_followings_count(instance,
-                                          identifier=identifier)
-
-        transformer = DatabaseQuerySetTransformer(qs, count)
-
-        transformer.aggregate_by('to_identifier')
-        transformer.pivot_by('to_object_id')
-        transformer.order_by(order_by)
-
-        return transformer
+        return self.retrieve_instances(qs,
+                                       self.get_friends_count(instance, identifier=identifier),
+                                       desc,
+                                       'to_identifier',
+                                       'to_object_id')
 
     def get_friends_count(self, instance, identifier=None):
         qs = self.model.objects.from_instance(instance).filter(is_mutual=True)
@@ -161,3 +122,108 @@ class DatabaseBackend(BaseBackend):
             qs = qs.filter(from_identifier=identifier)
 
         return qs.count()
+
+    def _get_counts(self, qs, instances, identifier_field, object_id_field, identifier=None):
+        pairs = [(registry.get_identifier(instance), instance.pk) for instance in instances]
+
+        lookup = Q()
+
+        for pair in set(pairs):
+            lookup |= Q(**dict(zip((identifier_field, object_id_field), pair)))
+
+        qs = qs.filter(lookup)
+
+        if identifier:
+            other_field = 'from_identifier' if identifier_field == 'to_identifier' else 'to_identifier'
+
+            qs = qs.filter(**{other_field: identifier})
+
+        rows = qs.order_by().values(identifier_field, object_id_field).annotate(count=Count('id'))
+
+        counts = dict(((row[identifier_field], row[object_id_field]), row['count'])
+                      for row in rows)
+
+        return dict((instance, counts.get(pair, 0))
+                    for instance, pair in zip(instances, pairs))
+
+    def get_followings_counts(self, instances, identifier=None):
+        """
+        Returns a dict mapping each of ``instances`` to its followings count
+        using a single GROUP BY query.
+        """
+        return self._get_counts(self.model.objects.all(), instances,
+                                'from_identifier', 'from_object_id',
+                                identifier=identifier)
+
+    def get_followers_counts(self, instances, identifier=None):
+        """
+        Returns a dict mapping each of ``instances`` to its followers count
+        using a single GROUP BY query.
+        """
+        return self._get_counts(self.model.objects.all(), instances,
+                                'to_identifier', 'to_object_id',
+                                identifier=identifier)
+
+    def _get_pk_column(self, qs):
+        quote_name = connections[qs.db].ops.quote_name
+
+        return '%s.%s' % (quote_name(qs.model._meta.db_table),
+                          quote_name(qs.model._meta.pk.column))
+
+    def annotate_follow_state(self, qs, viewer, name='is_followed_by_viewer'):
+        """
+        Adds a ``name`` column to ``qs`` telling whether ``viewer`` follows
+        each row, computed by the database in the same query.
+        """
+        if viewer is None or viewer.pk is None:
+            return qs.extra(select={name: '0'})
+
+        sql = ('CASE WHEN EXISTS (SELECT 1 FROM %s sequere_f '
+               'WHERE sequere_f.from_identifier = %%s AND sequere_f.from_object_id = %%s '
+               'AND sequere_f.to_identifier = %%s AND sequere_f.to_object_id = %s) '
+               'THEN 1 ELSE 0 END') % (connections[qs.db].ops.quote_name(self.model._meta.db_table),
+                                       self._get_pk_column(qs))
+
+        return qs.extra(select={name: sql},
+                        select_params=(registry.get_identifier(viewer),
+                                       viewer.pk,
+                                       registry.get_identifier(qs.model)))
+
+    def annotate_counts(self, qs, kinds=None, identifier=None):
+        """
+        Adds a ``<kind>_count`` column to ``qs`` for each of ``kinds``
+        (``followers``, ``followings`` or ``friends``), optionally restricted
+        to the resources of ``identifier`` on the other side of the edge.
+        """
+        kinds = kinds or ('followers', 'followings', )
+
+        table = connections[qs.db].ops.quote_name(self.model._meta.db_table)
+        pk_column = self._get_pk_column(qs)
+
+        select = OrderedDict()
+        select_params = []
+
+        for kind in kinds:
+            identifier_field, object_id_field, extra = COUNT_SUBQUERIES[kind]
+
+            sql = ('SELECT COUNT(*) FROM %s sequere_f '
+                   'WHERE sequere_f.%s = %%s AND sequere_f.%s = %s%s') % (table,
+                                                                        identifier_field,
+                                                                        object_id_field,
+                                                                        pk_column,
+                                                                        extra)
+
+            select_params.append(registry.get_identifier(qs.model))
+
+            if extra:
+                select_params.append(True)
+
+            if identifier:
+                other_field = 'from_identifier' if identifier_field == 'to_identifier' else 'to_identifier'
+
+                sql += ' AND sequere_f.%s = %%s' % other_field
+                select_params.append(identifier)
+
+            select['%s_count' % kind] = '(%s)' % sql
+
+        return qs.extra(select=select, select_params=select_params)
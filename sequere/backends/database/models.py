@@ -1,12 +1,120 @@
-from django.db import models
+from collections import defaultdict
+from itertools import islice
+
+from django.db import models, connections, router
+from django.db.models import signals
 from django.utils.encoding import python_2_unicode_compatible
 from django.db.models.query import QuerySet
 from django.utils.functional import cached_property
+from django.utils import timezone
 
 from sequere.registry import registry
+from sequere.helpers import chunks
+
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    from django.db.transaction import commit_on_success as atomic
+
+
+INSERT_FOLLOW_SQL = '''
+WITH existing AS (
+    SELECT id, created_at, is_mutual FROM %(table)s
+    WHERE from_identifier = %%s AND from_object_id = %%s
+    AND to_identifier = %%s AND to_object_id = %%s
+), inserted AS (
+    INSERT INTO %(table)s (created_at, from_identifier, from_object_id, to_identifier, to_object_id, is_mutual)
+    SELECT %%s, %%s, %%s, %%s, %%s, EXISTS (
+        SELECT 1 FROM %(table)s
+        WHERE from_identifier = %%s AND from_object_id = %%s
+        AND to_identifier = %%s AND to_object_id = %%s
+    )
+    WHERE NOT EXISTS (SELECT 1 FROM existing)
+    RETURNING id, created_at, is_mutual
+)
+SELECT id, created_at, is_mutual, TRUE FROM inserted
+UNION ALL
+SELECT id, created_at, is_mutual, FALSE FROM existing
+'''
+
+DELETE_FOLLOW_SQL = '''
+WITH deleted AS (
+    DELETE FROM %(table)s
+    WHERE from_identifier = %%s AND from_object_id = %%s
+    AND to_identifier = %%s AND to_object_id = %%s
+    RETURNING id
+), reverted AS (
+    UPDATE %(table)s SET is_mutual = FALSE
+    WHERE from_identifier = %%s AND from_object_id = %%s
+    AND to_identifier = %%s AND to_object_id = %%s
+    AND is_mutual AND EXISTS (SELECT 1 FROM deleted)
+)
+SELECT COUNT(*) FROM deleted
+'''
 
 
 class FollowQuerySet(QuerySet):
+    prefetch_chunk_size = None
+
+    def prefetch_instances(self, chunk_size=1000):
+        """
+        Fills ``from_instance`` and ``to_instance`` of the fetched rows with
+        one ``pk__in`` query per identifier and per chunk of ``chunk_size`` rows.
+        """
+        return self._clone(prefetch_chunk_size=chunk_size)
+
+    def _clone(self, *args, **kwargs):
+        # the custom attributes are not carried over by ``QuerySet._clone``
+        kwargs.setdefault('prefetch_chunk_size', self.prefetch_chunk_size)
+
+        return super(FollowQuerySet, self)._clone(*args, **kwargs)
+
+    def iterator(self):
+        iterator = super(FollowQuerySet, self).iterator()
+
+        if not self.prefetch_chunk_size:
+            for obj in iterator:
+                yield obj
+
+            return
+
+        while True:
+            rows = list(islice(iterator, self.prefetch_chunk_size))
+
+            if not rows:
+                break
+
+            self._fill_instances(rows)
+
+            for obj in rows:
+                yield obj
+
+    def _fill_instances(self, rows):
+        identifier_ids = defaultdict(set)
+
+        for row in rows:
+            identifier_ids[row.from_identifier].add(row.from_object_id)
+            identifier_ids[row.to_identifier].add(row.to_object_id)
+
+        instances = {}
+
+        for identifier, ids in identifier_ids.items():
+            model = registry.identifiers.get(identifier)
+
+            ids = list(ids)
+
+            for chunk in chunks(ids, self.prefetch_chunk_size):
+                for result in model.objects.filter(pk__in=chunk):
+                    instances[(identifier, result.pk)] = result
+
+        # cached_property reads its value from the instance __dict__
+        for row in rows:
+            for name in ('from', 'to'):
+                key = (getattr(row, '%s_identifier' % name), getattr(row, '%s_object_id' % name))
+
+                if key in instances:
+                    row.__dict__['%s_instance' % name] = instances[key]
+
     def from_instance(self, instance):
         from_identifier = registry.get_identifier(instance)
 
@@ -22,7 +130,7 @@ class FollowQuerySet(QuerySet):
 
 class FollowManager(models.Manager):
     def get_query_set(self):
-        return FollowQuerySet(self.model)
+        return FollowQuerySet(self.model, using=self._db)
 
     def from_instance(self, instance):
         return self.get_query_set().from_instance(instance)
@@ -30,6 +138,125 @@ class FollowManager(models.Manager):
     def to_instance(self, instance):
         return self.get_query_set().to_instance(instance)
 
+    def prefetch_instances(self, *args, **kwargs):
+        return self.get_query_set().prefetch_instances(*args, **kwargs)
+
+    def _edge(self, from_instance, to_instance):
+        return [registry.get_identifier(from_instance), from_instance.pk,
+                registry.get_identifier(to_instance), to_instance.pk]
+
+    def _params(self, from_instance, to_instance):
+        return dict(zip(('from_identifier', 'from_object_id',
+                         'to_identifier', 'to_object_id'),
+                        self._edge(from_instance, to_instance)))
+
+    def _has_listeners(self, *model_signals):
+        return any(signal.has_listeners(self.model) for signal in model_signals)
+
+    def create_follow(self, from_instance, to_instance):
+        """
+        Creates the edge ``from_instance -> to_instance`` and flags both
+        directions as mutual when the reverse edge exists.
+
+        Returns a ``(follow, created)`` tuple like ``get_or_create``.
+
+        The single statement used on PostgreSQL does not send the model
+        signals, the ORM is used instead as soon as they have receivers.
+        """
+        using = self._db or router.db_for_write(self.model)
+        connection = connections[using]
+
+        with atomic(using=using):
+            if connection.vendor == 'postgresql' and not self._has_listeners(signals.pre_save, signals.post_save):
+                return self._create_follow_returning(connection, from_instance, to_instance)
+
+            return self._create_follow(using, from_instance, to_instance)
+
+    def _create_follow_returning(self, connection, from_instance, to_instance):
+        edge = self._edge(from_instance, to_instance)
+        reverse = self._edge(to_instance, from_instance)
+
+        created_at = self.model._meta.get_field('created_at').get_db_prep_value(timezone.now(),
+                                                                               connection)
+
+        cursor = connection.cursor()
+        cursor.execute(INSERT_FOLLOW_SQL % {'table': connection.ops.quote_name(self.model._meta.db_table)},
+                       edge + [created_at] + edge + reverse)
+
+        pk, created_at, is_mutual, created = cursor.fetchone()
+
+        if created and is_mutual:
+            (self.get_query_set().using(connection.alias)
+             .filter(**self._params(to_instance, from_instance))
+             .update(is_mutual=True))
+
+        instance = self.model(pk=pk,
+                              created_at=created_at,
+                              is_mutual=is_mutual,
+                              **self._params(from_instance, to_instance))
+
+        return instance, created
+
+    def _create_follow(self, using, from_instance, to_instance):
+        params = self._params(from_instance, to_instance)
+
+        qs = self.get_query_set().using(using)
+
+        try:
+            return qs.get(**params), False
+        except self.model.DoesNotExist:
+            pass
+
+        # the UPDATE row count tells whether the reverse edge exists
+        is_mutual = qs.filter(**self._params(to_instance, from_instance)).update(is_mutual=True) > 0
+
+        return qs.create(is_mutual=is_mutual, **params), True
+
+    def delete_follow(self, from_instance, to_instance):
+        """
+        Deletes the edge ``from_instance -> to_instance``, resets the mutual
+        flag of the reverse edge and returns the number of deleted rows.
+
+        The rows are deleted with raw SQL which does not send the model
+        signals, the ORM is used instead as soon as they have receivers.
+        """
+        using = self._db or router.db_for_write(self.model)
+        connection = connections[using]
+
+        with atomic(using=using):
+            if connection.vendor == 'postgresql' and not self._has_listeners(signals.pre_delete, signals.post_delete):
+                cursor = connection.cursor()
+                cursor.execute(DELETE_FOLLOW_SQL % {'table': connection.ops.quote_name(self.model._meta.db_table)},
+                               self._edge(from_instance, to_instance) + self._edge(to_instance, from_instance))
+
+                return cursor.fetchone()[0]
+
+            return self._delete_follow(using, from_instance, to_instance)
+
+    def _delete_follow(self, using, from_instance, to_instance):
+        if self._has_listeners(signals.pre_delete, signals.post_delete):
+            qs = self.get_query_set().using(using).filter(**self._params(from_instance, to_instance))
+
+            count = qs.count()
+
+            qs.delete()
+        else:
+            table = connections[using].ops.quote_name(self.model._meta.db_table)
+
+            cursor = connections[using].cursor()
+            cursor.execute('DELETE FROM %s WHERE from_identifier = %%s AND from_object_id = %%s '
+                           'AND to_identifier = %%s AND to_object_id = %%s' % table,
+                           self._edge(from_instance, to_instance))
+
+            count = cursor.rowcount
+
+        if count:
+            (self.get_query_set().using(using)
+             .filter(is_mutual=True, **self._params(to_instance, from_instance))
+             .update(is_mutual=False))
+
+        return count
+
 
 @python_2_unicode_compatible
 class Follow(models.Model):
@@ -48,6 +275,10 @@ class Follow(models.Model):
     class Meta:
         ordering = ['-created_at', ]
         app_label = 'sequere'
+        index_together = [
+            ['from_identifier', 'from_object_id', 'created_at'],
+            ['to_identifier', 'to_object_id', 'created_at'],
+        ]
 
     def __str__(self):
         return '[%s: %d] -> [%s: %d]' % (self.from_identifier,
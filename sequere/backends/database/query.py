@@ -1,5 +1,6 @@
 from collections import defaultdict
-from operator import itemgetter
+
+from django.db.models import Q
 
 from sequere.query import QuerySetTransformer
 from sequere.registry import registry
@@ -9,10 +10,12 @@ class DatabaseQuerySetTransformer(QuerySetTransformer):
     def __init__(self, qs, count):
         super(DatabaseQuerySetTransformer, self).__init__(qs, count)
 
-        self.keys = []
+        self.keys = ['id', ]
+        self.ordering = []
+        self.cursor = None
+        self.last_cursor = None
 
     def order_by(self, key):
-        self.order_by = key
         self.desc = False
         self.sorting_key = key
 
@@ -22,6 +25,10 @@ class DatabaseQuerySetTransformer(QuerySetTransformer):
 
         self.keys.append(self.sorting_key)
 
+        # the primary key breaks ties so the ordering is total and keyset
+        # cursors never skip or repeat rows sharing the same date
+        self.ordering = [key, '-id' if self.desc else 'id']
+
         return self
 
     def aggregate_by(self, key):
@@ -38,27 +45,47 @@ class DatabaseQuerySetTransformer(QuerySetTransformer):
 
         return self
 
+    def after(self, cursor):
+        """
+        Restricts the results to the rows following ``cursor``, a
+        ``(created_at, id)`` tuple taken from ``last_cursor`` of a previous page.
+        """
+        self.cursor = cursor
+
+        return self
+
+    def _cursor_filter(self):
+        value, pk = self.cursor
+
+        lookup = 'lt' if self.desc else 'gt'
+
+        return (Q(**{'%s__%s' % (self.sorting_key, lookup): value}) |
+                Q(**{self.sorting_key: value, 'id__%s' % lookup: pk}))
+
     def transform(self, qs):
-        values = qs[self.start:self.stop].values(*self.keys)
+        qs = qs.order_by(*self.ordering)
 
-        identifier_ids = defaultdict(list)
+        if self.cursor is not None:
+            qs = qs.filter(self._cursor_filter())
 
-        orders = {}
+        values = list(qs[self.start:self.stop].values(*self.keys))
+
+        identifier_ids = defaultdict(list)
 
         for value in values:
             identifier_ids[value[self.aggregate_key]].append(value[self.pivot_key])
-            orders[value[self.pivot_key]] = value[self.sorting_key]
 
-        for identifier, ids in identifier_ids.iteritems():
-            model = registry.identifiers.get(identifier)
-
-            results = model.objects.filter(pk__in=ids)
+        instances = {}
 
-            for result in results:
-                created = orders[result.pk]
+        for identifier, ids in identifier_ids.items():
+            model = registry.identifiers.get(identifier)
 
-                del orders[result.pk]
+            for result in model.objects.filter(pk__in=ids):
+                instances[(identifier, result.pk)] = result
 
-                orders[result] = created
+        if values:
+            self.last_cursor = (values[-1][self.sorting_key], values[-1]['id'])
 
-        return sorted(orders.items(), key=itemgetter(1), reverse=self.desc)
+        return [(instances[(value[self.aggregate_key], value[self.pivot_key])], value[self.sorting_key])
+                for value in values
+                if (value[self.aggregate_key], value[self.pivot_key]) in instances]
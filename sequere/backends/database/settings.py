@@ -0,0 +1,5 @@
+from django.conf import settings
+
+SHARDS = getattr(settings, 'SEQUERE_DATABASE_SHARDS', [])
+
+SHARD_WORKERS = getattr(settings, 'SEQUERE_DATABASE_SHARD_WORKERS', len(SHARDS))
@@ -0,0 +1,288 @@
+import hashlib
+
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+from sequere.registry import registry
+from sequere.signals import followed, unfollowed
+
+from . import DatabaseBackend, COUNT_SUBQUERIES
+from . import settings
+
+
+def get_shard(identifier, object_id, shards):
+    """
+    Returns the database alias holding the edges of the resource
+    ``(identifier, object_id)``, stable across processes and restarts.
+    """
+    digest = hashlib.md5(('%s:%s' % (identifier, object_id)).encode('utf-8')).hexdigest()
+
+    return shards[int(digest[:8], 16) % len(shards)]
+
+
+def _run(args):
+    func, using, items = args
+
+    try:
+        return func(using, items)
+    finally:
+        connections[using].close()
+
+
+class ShardedDatabaseBackend(DatabaseBackend):
+    """
+    Partitions the Follow table across the ``SEQUERE_DATABASE_SHARDS``
+    database aliases.
+
+    Each edge is stored on the shard of its source, which serves the
+    followings of the source, and on the shard of its target, which serves
+    the followers of the target, so every single resource read touches
+    exactly one shard.
+    """
+    def __init__(self, *args, **kwargs):
+        super(ShardedDatabaseBackend, self).__init__(*args, **kwargs)
+
+        if not settings.SHARDS:
+            raise ImproperlyConfigured(
+                "The sharded database backend requires SEQUERE_DATABASE_SHARDS "
+                "to list the database aliases to use.")
+
+        self.shards = list(settings.SHARDS)
+
+    def get_shard(self, instance):
+        return get_shard(registry.get_identifier(instance), instance.pk, self.shards)
+
+    def get_edge_shards(self, from_instance, to_instance):
+        shards = [self.get_shard(from_instance)]
+
+        to_shard = self.get_shard(to_instance)
+
+        # a single row serves both directions when they share a shard
+        if to_shard not in shards:
+            shards.append(to_shard)
+
+        return shards
+
+    def objects(self, instance):
+        return self.model.objects.db_manager(self.get_shard(instance))
+
+    def follow(self, from_instance, to_instance):
+        shards = self.get_edge_shards(from_instance, to_instance)
+
+        results = []
+
+        try:
+            for using in shards:
+                results.append(self.model.objects.db_manager(using).create_follow(from_instance, to_instance))
+        except Exception:
+            # the rows written are taken back so the edge is never one-sided
+            for using, (follow, created) in zip(shards, results):
+                if created:
+                    self.model.objects.db_manager(using).delete_follow(from_instance, to_instance)
+
+            raise
+
+        new, created = results[0]
+
+        if created:
+            followed.send(sender=self.model,
+                          from_instance=from_instance,
+                          to_instance=to_instance)
+
+        return new
+
+    def unfollow(self, from_instance, to_instance):
+        shards = self.get_edge_shards(from_instance, to_instance)
+
+        counts = []
+
+        try:
+            for using in shards:
+                counts.append(self.model.objects.db_manager(using).delete_follow(from_instance, to_instance))
+        except Exception:
+            for using, count in zip(shards, counts):
+                if count:
+                    self.model.objects.db_manager(using).create_follow(from_instance, to_instance)
+
+            raise
+
+        if counts[0]:
+            unfollowed.send(sender=self.model,
+                            from_instance=from_instance,
+                            to_instance=to_instance)
+
+    def get_followers(self, instance, desc=True, identifier=None):
+        qs = self.objects(instance).to_instance(instance)
+
+        if identifier:
+            qs = qs.filter(from_identifier=identifier)
+
+        return self.retrieve_instances(qs,
+                                       self.get_followers_count(instance, identifier=identifier),
+                                       desc,
+                                       'from_identifier',
+                                       'from_object_id')
+
+    def get_followings(self, instance, desc=True, identifier=None):
+        qs = self.objects(instance).from_instance(instance)
+
+        if identifier:
+            qs = qs.filter(to_identifier=identifier)
+
+        return self.retrieve_instances(qs,
+                                       self.get_followings_count(instance, identifier=identifier),
+                                       desc,
+                                       'to_identifier',
+                                       'to_object_id')
+
+    def get_friends(self, instance, identifier=None, desc=True):
+        qs = self.objects(instance).from_instance(instance).filter(is_mutual=True)
+
+        if identifier:
+            qs = qs.filter(to_identifier=identifier)
+
+        return self.retrieve_instances(qs,
+                                       self.get_friends_count(instance, identifier=identifier),
+                                       desc,
+                                       'to_identifier',
+                                       'to_object_id')
+
+    def is_following(self, from_instance, to_instance):
+        return self.objects(from_instance).from_instance(from_instance).to_instance(to_instance).exists()
+
+    def get_followings_count(self, instance, identifier=None):
+        qs = self.objects(instance).from_instance(instance)
+
+        if identifier:
+            qs = qs.filter(to_identifier=identifier)
+
+        return qs.count()
+
+    def get_friends_count(self, instance, identifier=None):
+        qs = self.objects(instance).from_instance(instance).filter(is_mutual=True)
+
+        if identifier:
+            qs = qs.filter(to_identifier=identifier)
+
+        return qs.count()
+
+    def get_followers_count(self, instance, identifier=None):
+        qs = self.objects(instance).to_instance(instance)
+
+        if identifier:
+            qs = qs.filter(from_identifier=identifier)
+
+        return qs.count()
+
+    def fan_out(self, func, instances):
+        """
+        Calls ``func(using, instances)`` once per shard owning some of
+        ``instances``, concurrently when several shards are involved, and
+        merges the returned dicts.
+        """
+        groups = defaultdict(list)
+
+        for instance in instances:
+            groups[self.get_shard(instance)].append(instance)
+
+        jobs = [(func, using, items) for using, items in groups.items()]
+
+        if len(jobs) > 1 and settings.SHARD_WORKERS > 1:
+            pool = ThreadPool(min(len(jobs), settings.SHARD_WORKERS))
+
+            try:
+                results = pool.map(_run, jobs)
+            finally:
+                pool.close()
+        else:
+            results = [job(using, items) for job, using, items in jobs]
+
+        merged = {}
+
+        for result in results:
+            merged.update(result)
+
+        return merged
+
+    def get_followings_counts(self, instances, identifier=None):
+        return self.fan_out(lambda using, items: self._get_counts(self.model.objects.using(using), items,
+                                                                  'from_identifier', 'from_object_id',
+                                                                  identifier=identifier),
+                            instances)
+
+    def get_followers_counts(self, instances, identifier=None):
+        return self.fan_out(lambda using, items: self._get_counts(self.model.objects.using(using), items,
+                                                                  'to_identifier', 'to_object_id',
+                                                                  identifier=identifier),
+                            instances)
+
+    def _annotate_values(self, qs, name, values):
+        """
+        Adds a ``name`` column to ``qs`` holding the value of ``values``
+        mapping the primary keys of its rows, ``0`` for the rows missing.
+        """
+        if not values:
+            return qs.extra(select={name: '0'})
+
+        sql = 'CASE %s %s ELSE 0 END' % (self._get_pk_column(qs),
+                                         ' '.join(['WHEN %s THEN %s'] * len(values)))
+
+        select_params = []
+
+        for pk, value in values.items():
+            select_params += [pk, value]
+
+        return qs.extra(select={name: sql}, select_params=select_params)
+
+    def annotate_follow_state(self, qs, viewer, name='is_followed_by_viewer'):
+        """
+        Adds a ``name`` column to ``qs`` telling whether ``viewer`` follows
+        each row, the rows followed being read first from the shard of
+        ``viewer`` since the follow rows do not live in the database of ``qs``.
+        """
+        if viewer is None or viewer.pk is None:
+            return qs.extra(select={name: '0'})
+
+        object_ids = (self.objects(viewer).from_instance(viewer)
+                      .filter(to_identifier=registry.get_identifier(qs.model))
+                      .values_list('to_object_id', flat=True))
+
+        field = qs.model._meta.pk
+
+        return self._annotate_values(qs, name, dict((field.to_python(object_id), 1) for object_id in object_ids))
+
+    def annotate_counts(self, qs, kinds=None, identifier=None):
+        """
+        Adds a ``<kind>_count`` column to ``qs`` for each of ``kinds``
+        (``followers``, ``followings`` or ``friends``), optionally restricted
+        to the resources of ``identifier`` on the other side of the edge.
+
+        The counts are read from the shards of the rows of ``qs``, which is
+        evaluated first, and inlined in its query.
+        """
+        kinds = kinds or ('followers', 'followings', )
+
+        instances = [qs.model(pk=pk) for pk in qs.values_list('pk', flat=True)]
+
+        for kind in kinds:
+            identifier_field, object_id_field, extra = COUNT_SUBQUERIES[kind]
+
+            def get_counts(using, items, identifier_field=identifier_field, object_id_field=object_id_field,
+                           mutual=bool(extra)):
+                follows = self.model.objects.using(using)
+
+                if mutual:
+                    follows = follows.filter(is_mutual=True)
+
+                return self._get_counts(follows, items, identifier_field, object_id_field,
+                                        identifier=identifier)
+
+            counts = self.fan_out(get_counts, instances)
+
+            qs = self._annotate_values(qs, '%s_count' % kind,
+                                       dict((instance.pk, count) for instance, count in counts.items() if count))
+
+        return qs
@@ -176,6 +176,71 @@ class RedisBackend(BaseBackend):
                                        self.get_followings_count(instance, identifier=identifier),
                                        desc=desc)
 
+    def iter_followers_uids(self, uid, batch_size=500, identifier=None, start=0, stop=None):
+        """
+        Yields lists of ``(identifier, uid)`` of the followers of the resource
+        ``uid``, read straight from the per identifier followers sets.
+
+        ``start`` and ``stop`` restrict the ranks read in each set, they are
+        meant to be used with a single ``identifier``.
+        """
+        identifiers = [identifier] if identifier else registry.identifiers.keys()
+
+        for identifier in identifiers:
+            key = manager.add_prefix(get_key('uid', uid, 'followers', identifier))
+
+            offset = start
+
+            while stop is None or offset < stop:
+                end = offset + batch_size
+
+                if stop is not None:
+                    end = min(end, stop)
+
+                uids = client.zrange(key, offset, end - 1)
+
+                if not uids:
+                    break
+
+                yield [(identifier, follower_uid) for follower_uid in uids]
+
+                offset = end
+
+    def get_followings_uids(self, uid):
+        """
+        Returns the uids of the resources followed by the resource ``uid``.
+        """
+        return client.zrange(manager.add_prefix(get_key('uid', uid, 'followings')), 0, -1)
+
+    def filter_followings_uids(self, uid, uids):
+        """
+        Returns the uids among ``uids`` the resource ``uid`` is following.
+        """
+        uids = list(uids)
+
+        key = manager.add_prefix(get_key('uid', uid, 'followings'))
+
+        with client.pipeline() as pipe:
+            for following_uid in uids:
+                pipe.zscore(key, following_uid)
+
+            return [following_uid
+                    for following_uid, score in zip(uids, pipe.execute())
+                    if score is not None]
+
+    def get_followers_uids_counts(self, uid):
+        """
+        Returns a dict mapping each identifier to the number of followers of
+        the resource ``uid`` with this identifier.
+        """
+        identifiers = list(registry.identifiers.keys())
+
+        with client.pipeline() as pipe:
+            for identifier in identifiers:
+                pipe.zcard(manager.add_prefix(get_key('uid', uid, 'followers', identifier)))
+
+            return dict(zip(identifiers, pipe.execute()))
+
     def is_following(self, from_instance, to_instance):
         return self._is_following(from_instance, to_instance) is not None
 
@@ -212,6 +277,22 @@ class RedisBackend(BaseBackend):
 
         return 0
 
+    def _get_counts(self, instances, name, identifier=None):
+        with client.pipeline() as pipe:
+            for instance in instances:
+                pipe.get(manager.add_prefix(get_key('uid', manager.make_uid(instance), name, identifier, 'count')))
+
+            results = pipe.execute()
+
+        return dict((instance, int(result or 0))
+                    for instance, result in zip(instances, results))
+
+    def get_followings_counts(self, instances, identifier=None):
+        return self._get_counts(instances, 'followings', identifier=identifier)
+
+    def get_followers_counts(self, instances, identifier=None):
+        return self._get_counts(instances, 'followers', identifier=identifier)
+
     def _get_friends_count(self, instance, identifier=None):
         cache_key = get_key('uid', manager.make_uid(instance), 'friends', identifier, 'count')
 
@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 from django.utils.functional import memoize, cached_property
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils import six
@@ -8,6 +10,7 @@ from sequere.utils import to_timestamp, from_timestamp
 from sequere.registry import registry
 from sequere.backends.redis.connection import manager as backend
 
+from . import settings
 from .exceptions import ActionDoesNotExist
 
 
@@ -24,6 +27,16 @@ get_actions = memoize(_get_actions, {}, 0)
 class Action(object):
     verb = None
 
+    # the secondary indexes materialized on write, among target, verb,
+    # public and counts, defaults to SEQUERE_TIMELINE_INDEXES
+    indexes = None
+
+    # groups the actions fanned out to the followers by target and by
+    # buckets of ``aggregate_interval`` seconds, keeping the
+    # ``aggregate_actors`` most recent actors of each group
+    aggregate_interval = None
+    aggregate_actors = 3
+
     def __init__(self, actor, target=None, date=None, **kwargs):
         self.actor = actor
         self.target = target
@@ -31,10 +44,19 @@ class Action(object):
         self.date = date or datetime.now()
         self.uid = None
         self.data = None
+        self.actors = [actor] if actor is not None else []
+        self.actors_count = len(self.actors)
 
         for k, v in kwargs.items():
             setattr(self, k, v)
 
+    @classmethod
+    def get_indexes(cls):
+        if cls.indexes is not None:
+            return cls.indexes
+
+        return settings.TIMELINE_INDEXES
+
     @cached_property
     def actor_uid(self):
         return backend.make_uid(self.actor)
@@ -79,7 +101,83 @@ class Action(object):
         return force_str('<%s: %s>' % (self.__class__.__name__, u))
 
     @classmethod
-    def from_data(cls, data):
+    def from_data_list(cls, data_list):
+        """
+        Builds the actions of ``data_list`` resolving all their actors and
+        targets at once, with one pipeline and one query per identifier.
+        """
+        uids = []
+
+        for data in data_list:
+            for attr_name in ('actor', 'target', ):
+                uid = data.get(attr_name, None)
+
+                if uid and uid not in uids:
+                    uids.append(uid)
+
+        instances = {}
+
+        if uids:
+            instances = dict(zip(uids, backend.get_from_uid_list(uids)))
+
+        return [cls.from_data(data, instances=instances)
+                for data in data_list]
+
+    @classmethod
+    def from_payload_list(cls, payloads):
+        """
+        Builds the actions of the unpacked ``payloads`` which carry the
+        identifiers and the ids of their actors and targets, with one query
+        per identifier.
+        """
+        object_ids = defaultdict(set)
+
+        for payload in payloads:
+            for attr_name in ('actor', 'target', ):
+                if payload[attr_name]:
+                    uid, identifier, object_id = payload[attr_name]
+
+                    object_ids[identifier].add(object_id)
+
+        instances = {}
+
+        for identifier, ids in object_ids.items():
+            klass = registry.identifiers.get(identifier)
+
+            for result in klass.objects.filter(pk__in=ids):
+                instances[(identifier, result.pk)] = result
+
+        actions = get_actions()
+
+        results = []
+
+        for payload in payloads:
+            action_class = actions.get(payload['verb'], None)
+
+            if action_class is None:
+                raise ActionDoesNotExist('Action %s does not exist' % payload['verb'])
+
+            kwargs = {
+                'uid': payload['uid'],
+                'date': from_timestamp(float(payload['timestamp'])),
+                'kwargs': payload['kwargs'] or {},
+            }
+
+            for attr_name in ('actor', 'target', ):
+                kwargs[attr_name] = None
+
+                if payload[attr_name]:
+                    uid, identifier, object_id = payload[attr_name]
+
+                    kwargs[attr_name] = instances.get((identifier, object_id))
+                    kwargs['%s_uid' % attr_name] = uid
+
+            results.append(action_class(**kwargs))
+
+        return results
+
+    @classmethod
+    def from_data(cls, data, instances=None):
         verb = data['verb']
 
         actions = get_actions()
@@ -91,10 +189,16 @@ class Action(object):
 
         for attr_name in ('actor', 'target', ):
             if data.get(attr_name, None):
-                data[attr_name] = backend.get_from_uid(data[attr_name])
+                if instances is not None:
+                    data[attr_name] = instances.get(data[attr_name])
+                else:
+                    data[attr_name] = backend.get_from_uid(data[attr_name])
             else:
                 data[attr_name] = None
 
         data['date'] = from_timestamp(float(data.pop('timestamp')))
 
+        # bookkeeping of the garbage collection
+        data.pop('refs', None)
+
         return action_class(**data)
@@ -0,0 +1,85 @@
+import time
+
+from . import settings
+from .wrappers import Batch
+
+
+# the last seen time of a resource is written at most once per interval
+SEEN_INTERVAL = 60
+
+
+def get_seen_key():
+    from .connection import storage
+
+    return storage.add_prefix('seen')
+
+
+def is_enabled():
+    return bool(settings.TIMELINE_DORMANT_AFTER)
+
+
+def is_dormant(seen_at, now=None):
+    """
+    Tells whether a resource last seen at ``seen_at`` has been inactive for
+    more than ``SEQUERE_TIMELINE_DORMANT_AFTER`` seconds, a resource never
+    seen is dormant.
+    """
+    if seen_at is None:
+        return True
+
+    return seen_at < (now or time.time()) - settings.TIMELINE_DORMANT_AFTER
+
+
+def get_seen_at(client, uid):
+    result = client.zscore(get_seen_key(), '%s' % uid)
+
+    if result is None:
+        return None
+
+    return float(result)
+
+
+def touch(client, uid, seen_at=None):
+    """
+    Records the activity of the resource ``uid`` last seen at ``seen_at``.
+    """
+    now = time.time()
+
+    if seen_at is not None and now - seen_at < SEEN_INTERVAL:
+        return
+
+    client.zadd(get_seen_key(), **{
+        '%s' % uid: int(now)
+    })
+
+
+def get_many_seen_at(client, uids):
+    """
+    Returns the last seen times of ``uids`` read in a single pipeline,
+    ``None`` for the resources never seen.
+    """
+    if not uids:
+        return []
+
+    key = get_seen_key()
+
+    batch = Batch()
+
+    indexes = [batch.zscore(key, '%s' % uid) for uid in uids]
+
+    results = client.execute_batch(batch)
+
+    return [float(results[index]) if results[index] else None for index in indexes]
+
+
+def filter_active(client, uids):
+    """
+    Returns the pairs of ``uids``, ``(identifier, uid)`` or any other value
+    followed by a uid, whose uid is not dormant.
+    """
+    now = time.time()
+
+    seen_ats = get_many_seen_at(client, [uid for value, uid in uids])
+
+    return [(value, uid) for (value, uid), seen_at in zip(uids, seen_ats)
+            if not is_dormant(seen_at, now=now)]
@@ -0,0 +1,211 @@
+from sequere.registry import registry
+from sequere.backends.redis.connection import manager
+from sequere.backends.redis.utils import get_key
+
+from .action import get_actions
+from .payloads import store_action, is_packed, pack, replace_actor
+from .wrappers import Batch
+
+
+def is_aggregated(action):
+    return bool(action.aggregate_interval)
+
+
+def has_aggregates():
+    """
+    Tells whether any registered action is aggregated.
+    """
+    return any(is_aggregated(action_class) for action_class in get_actions().values())
+
+
+def get_bucket(action):
+    return int(action.timestamp // action.aggregate_interval)
+
+
+def get_group_key(storage, action):
+    """
+    Returns the key storing the uid of the aggregate of the group of
+    ``action``, its verb, its target and its time bucket.
+    """
+    return storage.add_prefix(get_key('aggregate', action.verb, action.target_uid or 'none', get_bucket(action)))
+
+
+def get_actors_keys(key):
+    """
+    Returns the keys of the recent actors and of the actors count of the
+    aggregate stored at ``key``.
+    """
+    return get_key(key, 'actors'), get_key(key, 'actors', 'count')
+
+
+def aggregate(storage, client, action):
+    """
+    Records ``action`` in the aggregate entry of its group, stored on the
+    first action of the group, and returns the data of the aggregate to
+    fan out in place of ``action``.
+
+    The actors are counted once per group whichever followers see the
+    aggregate, an actor acting again is not counted twice unless it has
+    been pushed out of the recent actors since.
+    """
+    group_key = get_group_key(storage, action)
+
+    entry = action.__class__(actor=action.actor,
+                             target=action.target,
+                             date=action.date,
+                             kwargs=action.kwargs)
+
+    data = entry.format_data()
+
+    uid = client.get(group_key)
+
+    if uid is None:
+        uid = store_action(storage, entry, data)
+
+        if client.setnx(group_key, uid):
+            client.expire(group_key, action.aggregate_interval)
+        else:
+            # another action of the group created the aggregate meanwhile
+            client.delete(storage.add_prefix(get_key('uid', uid)))
+
+            uid = client.get(group_key)
+
+    data['uid'] = uid
+
+    key = storage.add_prefix(get_key('uid', uid))
+
+    actors_key, count_key = get_actors_keys(key)
+
+    batch = Batch()
+
+    # the aggregate shows its most recent actor
+    if is_packed():
+        batch.set(key, pack(entry))
+    else:
+        batch.hmset(key, {
+            'actor': data['actor'],
+            'timestamp': data['timestamp'],
+        })
+
+    added = batch.zadd(actors_key, **{
+        '%s' % data['actor']: data['timestamp']
+    })
+
+    batch.zremrangebyrank(actors_key, 0, -(action.aggregate_actors + 1))
+
+    if int(client.execute_batch(batch)[added]):
+        client.incr(count_key)
+
+    return data
+
+
+def set_actor(client, key, actor_uid, timestamp):
+    """
+    Shows the aggregate stored at ``key`` as done by ``actor_uid`` at
+    ``timestamp``.
+    """
+    if not is_packed():
+        client.hmset(key, {
+            'actor': actor_uid,
+            'timestamp': timestamp,
+        })
+
+        return
+
+    value = client.get(key)
+
+    if not value:
+        return
+
+    data = manager.get_data_from_uid(actor_uid)
+
+    # the packed ids are typed like the primary keys they are matched with
+    object_id = registry.identifiers.get(data['identifier'])._meta.pk.to_python(data['object_id'])
+
+    client.set(key, replace_actor(value, ['%s' % actor_uid, data['identifier'], object_id], timestamp))
+
+
+def remove_actor(storage, client, action):
+    """
+    Removes the actor of ``action`` from the aggregate of its group while
+    the group is open and returns the uid of the aggregate when no actor is
+    left in it, ``None`` otherwise.
+
+    The aggregate shows its most recent remaining actor afterwards.
+    """
+    group_key = get_group_key(storage, action)
+
+    uid = client.get(group_key)
+
+    if uid is None:
+        return None
+
+    key = storage.add_prefix(get_key('uid', uid))
+
+    actors_key, count_key = get_actors_keys(key)
+
+    batch = Batch()
+
+    # the actors pushed out of the recent actors are still counted
+    batch.zrem(actors_key, '%s' % action.actor_uid)
+
+    count = batch.decr(count_key)
+    latest = batch.zrevrange(actors_key, 0, 0, withscores=True)
+
+    results = client.execute_batch(batch)
+
+    if int(results[count]) <= 0:
+        client.delete(group_key)
+
+        return uid
+
+    if results[latest]:
+        actor_uid, timestamp = results[latest][0]
+
+        set_actor(client, key, actor_uid, timestamp)
+
+    return None
+
+
+def load_aggregates(client, prefix, actions):
+    """
+    Sets the recent actors and the actors count of the aggregated
+    ``actions``, the actions which were stored as is keep their own actor.
+    """
+    actions = [action for action in actions if is_aggregated(action)]
+
+    if not actions:
+        return
+
+    batch = Batch()
+
+    indexes = []
+
+    for action in actions:
+        actors_key, count_key = get_actors_keys(get_key(prefix, 'uid', action.uid))
+
+        indexes.append((batch.zrevrange(actors_key, 0, action.aggregate_actors - 1),
+                        batch.get(count_key)))
+
+    results = client.execute_batch(batch)
+
+    results = [(results[actors], results[count]) for actors, count in indexes]
+
+    uids = []
+
+    for actors_uids, count in results:
+        for uid in actors_uids:
+            if uid not in uids:
+                uids.append(uid)
+
+    instances = {}
+
+    if uids:
+        instances = dict(zip(uids, manager.get_from_uid_list(uids)))
+
+    for action, (actors_uids, count) in zip(actions, results):
+        if not actors_uids:
+            continue
+
+        action.actors = [instances[uid] for uid in actors_uids if instances.get(uid) is not None]
+        action.actors_count = int(count or len(actors_uids))
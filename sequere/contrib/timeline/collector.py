@@ -0,0 +1,177 @@
+import time
+from collections import defaultdict
+
+from sequere.backends.redis.utils import get_key
+
+from . import settings
+from .payloads import is_packed
+from .aggregation import has_aggregates, get_actors_keys
+
+
+# deletes the action hash ``KEYS[1]`` when no timeline references it
+# anymore and returns the memory reclaimed, ``-1`` when it is kept
+COLLECT_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'identifier') == 1 then
+    return -1
+end
+
+local refs = redis.call('HGET', KEYS[1], 'refs')
+
+if not refs or tonumber(refs) > 0 then
+    return -1
+end
+
+local size = redis.call('MEMORY', 'USAGE', KEYS[1]) or 0
+
+redis.call('DEL', KEYS[1])
+
+return size
+"""
+
+# same for the reference count ``KEYS[1]`` of a packed action, its payload
+# may be stored on another connection and is deleted afterwards
+COLLECT_REFERENCES_SCRIPT = """
+local refs = redis.call('GET', KEYS[1])
+
+if not refs or tonumber(refs) > 0 then
+    return -1
+end
+
+local size = redis.call('MEMORY', 'USAGE', KEYS[1]) or 0
+
+redis.call('DEL', KEYS[1])
+
+return size
+"""
+
+
+def iter_action_keys(connection, prefix, batch_size, suffix=None):
+    """
+    Yields lists of at most ``batch_size`` action keys, ending with
+    ``suffix`` when given, stored in ``connection``.
+    """
+    keys = []
+
+    for key in connection.scan_iter(match=get_key(prefix, '*', suffix), count=batch_size):
+        uid = key[len(prefix):].strip(':')
+
+        if suffix is not None:
+            uid = uid[:-len(suffix)].strip(':')
+
+        if not uid.isdigit():
+            continue
+
+        keys.append(key)
+
+        if len(keys) >= batch_size:
+            yield keys
+
+            keys = []
+
+    if keys:
+        yield keys
+
+
+def collect(batch_size=None, interval=None):
+    """
+    Deletes the action hashes which are not referenced by any timeline
+    anymore, ``batch_size`` keys per round trip with a pause of ``interval``
+    seconds between two batches, and returns the number of actions deleted
+    and the memory reclaimed in bytes.
+
+    Actions stored before the references were tracked have no reference
+    count and are never collected, neither are the hashes left behind by a
+    switch to packed payloads until they are read and migrated.
+
+    The recent actors of the aggregates are deleted along with them.
+    """
+    from .connection import storage, client
+
+    batch_size = batch_size or settings.TIMELINE_COLLECT_BATCH_SIZE
+
+    if interval is None:
+        interval = settings.TIMELINE_COLLECT_INTERVAL
+
+    prefix = storage.add_prefix('uid')
+
+    count = 0
+    size = 0
+
+    packed = is_packed()
+
+    suffix = 'refs' if packed else None
+
+    aggregates = has_aggregates()
+
+    # every key is scanned on the connection storing it, which keeps the
+    # script single key on a cluster
+    for connection in client.connections():
+        script = connection.register_script(COLLECT_REFERENCES_SCRIPT if packed else COLLECT_SCRIPT)
+
+        for keys in iter_action_keys(connection, prefix, batch_size, suffix=suffix):
+            pipe = connection.pipeline(transaction=False)
+
+            for key in keys:
+                script(keys=[key], client=pipe)
+
+            collected = []
+
+            for key, result in zip(keys, pipe.execute()):
+                if result >= 0:
+                    collected.append(key)
+
+                    count += 1
+                    size += result
+
+            if packed:
+                collected = [key[:-len(suffix)].rstrip(':') for key in collected]
+
+                if collected:
+                    size += delete_payloads(client, collected)
+
+            if aggregates and collected:
+                size += delete_payloads(client, [actors_key
+                                                 for key in collected
+                                                 for actors_key in get_actors_keys(key)])
+
+            if interval:
+                time.sleep(interval)
+
+    return count, size
+
+
+def delete_payloads(client, keys):
+    """
+    Deletes the packed payloads ``keys``, or any other keys stored next to
+    an action, and returns the memory reclaimed.
+    """
+    connection_keys = defaultdict(list)
+
+    for key in keys:
+        connection_keys[client.connection_for(key)].append(key)
+
+    size = 0
+
+    for connection, keys in connection_keys.items():
+        pipe = connection.pipeline(transaction=False)
+
+        for key in keys:
+            pipe.execute_command('MEMORY', 'USAGE', key)
+
+        pipe.delete(*keys)
+
+        size += sum(result or 0 for result in pipe.execute()[:-1])
+
+    return size
+
+
+def delete_action(uid):
+    """
+    Deletes the action ``uid`` whatever its references, along with its
+    reference count and its recent actors, and returns the memory reclaimed.
+    """
+    from .connection import storage, client
+
+    key = storage.add_prefix(get_key('uid', uid))
+
+    return delete_payloads(client, [key, get_key(key, 'refs')] + list(get_actors_keys(key)))
@@ -0,0 +1,472 @@
+import time
+
+from celery.utils import uuid
+
+from sequere.backends import get_backend
+from sequere.backends.redis import RedisBackend
+from sequere.backends.redis.connection import manager
+from sequere.backends.redis.utils import get_key
+from sequere.registry import registry
+from sequere.http import json
+
+from . import settings
+from .timeline import get_timeline_keys, add_to_keys, add_many_to_keys, remove_from_keys, load_summaries
+from .action import get_actions
+from .retention import get_retention
+from .references import apply_changes
+from .activity import is_enabled, filter_active
+from .scores import get_score
+from .wrappers import Batch
+
+
+def iter_followers_uids(uid, batch_size, identifier=None, start=0, stop=None):
+    """
+    Yields lists of ``(identifier, uid)`` of the followers of the resource
+    ``uid``.
+
+    The Redis backend streams them from its sorted sets, other backends
+    have to hydrate the followers to resolve their uids.
+    """
+    backend = get_backend()()
+
+    if isinstance(backend, RedisBackend):
+        for batch in backend.iter_followers_uids(uid,
+                                                 batch_size=batch_size,
+                                                 identifier=identifier,
+                                                 start=start,
+                                                 stop=stop):
+            yield batch
+
+        return
+
+    instance = manager.get_from_uid(uid)
+
+    if instance is None:
+        return
+
+    followers = backend.get_followers(instance)
+
+    if stop is None:
+        stop = followers.count()
+
+    for offset in range(start, stop, batch_size):
+        yield [(registry.get_identifier(obj), manager.make_uid(obj))
+               for obj, timestamp in followers[offset:min(offset + batch_size, stop)]]
+
+
+def get_partitions(uid, size):
+    """
+    Splits the followers of the resource ``uid`` in ``(identifier, start, stop)``
+    rank ranges of at most ``size`` followers.
+    """
+    backend = get_backend()()
+
+    if isinstance(backend, RedisBackend):
+        counts = backend.get_followers_uids_counts(uid)
+    else:
+        instance = manager.get_from_uid(uid)
+
+        counts = {None: backend.get_followers_count(instance) if instance else 0}
+
+    return [(identifier, start, min(start + size, count))
+            for identifier, count in sorted(counts.items())
+            for start in range(0, count, size)]
+
+
+def get_fanout_queue(followers_count):
+    """
+    Returns the celery queue of the fan-out of an action to
+    ``followers_count`` followers from ``SEQUERE_TIMELINE_FANOUT_QUEUES``,
+    ``None`` for the default queue.
+    """
+    queue = None
+
+    for threshold, name in sorted(settings.TIMELINE_FANOUT_QUEUES or ()):
+        if followers_count >= threshold:
+            queue = name
+
+    return queue
+
+
+class FanoutQueue(object):
+    """
+    Routes the fan-out tasks to the celery queue ``name`` and measures its
+    lag from the time the tasks waiting in it were due.
+    """
+    expire = 60 * 60 * 24
+
+    def __init__(self, name=None):
+        from .connection import storage, client
+
+        self.name = name
+        self.client = client
+        self.key = storage.add_prefix(get_key('queue', name or 'default'))
+
+    def get_lag(self):
+        now = time.time()
+
+        # the tasks lost by the workers would hold the lag forever
+        self.client.zremrangebyscore(self.key, '-inf', now - self.expire)
+
+        oldest = self.client.zrangebyscore(self.key, '-inf', now, start=0, num=1, withscores=True)
+
+        if not oldest:
+            return 0
+
+        return now - oldest[0][1]
+
+    def get_countdown(self):
+        """
+        Returns the delay of a new large fan-out, the lag of the queue once
+        it exceeds ``SEQUERE_TIMELINE_FANOUT_MAX_LAG``.
+        """
+        max_lag = settings.TIMELINE_FANOUT_MAX_LAG
+
+        if not max_lag:
+            return 0
+
+        lag = self.get_lag()
+
+        if lag > max_lag:
+            return lag
+
+        return 0
+
+    def signature(self, task, args, kwargs=None, countdown=0):
+        """
+        Returns the signature of ``task`` routed to the queue, tracked to
+        measure its lag when a maximum lag is configured.
+        """
+        options = {}
+
+        if self.name:
+            options['queue'] = self.name
+
+        if countdown:
+            options['countdown'] = countdown
+
+        if settings.TIMELINE_FANOUT_MAX_LAG:
+            options['task_id'] = uuid()
+
+            self.client.zadd(self.key, **{
+                options['task_id']: time.time() + countdown
+            })
+
+        return task.s(*args, **dict(kwargs or {}, queue=self.name)).set(**options)
+
+    def untrack(self, task_id):
+        if task_id and settings.TIMELINE_FANOUT_MAX_LAG:
+            self.client.zrem(self.key, task_id)
+
+
+class FanoutProgress(object):
+    """
+    Remembers the rank reached by a partition so a retried partition
+    resumes where the previous attempt stopped.
+    """
+    expire = 60 * 60 * 24
+
+    def __init__(self, uid, identifier, start, name='fanout'):
+        from .connection import storage, client
+
+        self.client = client
+        self.key = storage.add_prefix(get_key(name, uid, identifier, start))
+
+    def get(self):
+        result = self.client.get(self.key)
+
+        if result:
+            return int(result)
+
+        return None
+
+    def update(self, offset):
+        with self.client.map() as pipe:
+            pipe.set(self.key, offset)
+            pipe.expire(self.key, self.expire)
+
+    def clear(self):
+        self.client.delete(self.key)
+
+
+class FanoutCountdown(object):
+    """
+    Counts the partitions of a fan-out which are not done yet so the last
+    one can finish the job.
+    """
+    expire = 60 * 60 * 24
+
+    def __init__(self, uid, name='fanout'):
+        from .connection import storage, client
+
+        self.client = client
+        self.key = storage.add_prefix(get_key(name, uid, 'pending'))
+
+    def start(self, count):
+        with self.client.map() as pipe:
+            pipe.set(self.key, count)
+            pipe.expire(self.key, self.expire)
+
+    def done(self):
+        """
+        Tells whether the partition calling it was the last one running.
+        """
+        if int(self.client.decr(self.key)) > 0:
+            return False
+
+        self.client.delete(self.key)
+
+        return True
+
+
+class FanoutBuffer(object):
+    """
+    Buffers the actions of a resource waiting to be fanned out together.
+    """
+    def __init__(self, uid):
+        from .connection import storage, client
+
+        self.client = client
+        self.key = storage.add_prefix(get_key('buffer', uid))
+
+    def push(self, data, dispatch=True):
+        """
+        Appends the stored action ``data`` and tells whether the buffer was
+        empty, in which case the caller schedules its fan-out.
+        """
+        return int(self.client.rpush(self.key, json.dumps([data, dispatch]))) == 1
+
+    def pop_all(self):
+        """
+        Empties the buffer and returns the ``(data, dispatch)`` of its actions.
+        """
+        # a single connection keeps the read and the delete atomic
+        pipe = self.client.connection_for(self.key).pipeline()
+        pipe.lrange(self.key, 0, -1)
+        pipe.delete(self.key)
+
+        values, deleted = pipe.execute()
+
+        return [tuple(json.loads(value)) for value in values]
+
+
+def fanout(uid, data, **kwargs):
+    """
+    Pushes the stored action ``data`` to the private timelines of the
+    followers of the resource ``uid``, see ``fanout_many``.
+    """
+    return fanout_many(uid, [data], **kwargs)
+
+
+def fanout_many(uid, data_list, batch_size=None, identifier=None, start=0, stop=None, progress=None,
+                remove=False):
+    """
+    Pushes the stored actions ``data_list`` of the resource ``uid`` to the
+    private timelines of its followers, or removes them from them, in a
+    single pass over the followers with ``batch_size`` timelines per
+    pipeline, and returns the number of timelines written.
+
+    The followers dormant for more than ``SEQUERE_TIMELINE_DORMANT_AFTER``
+    seconds are skipped, their timelines are rebuilt on their return.
+    """
+    from .connection import storage, client
+
+    batch_size = batch_size or settings.TIMELINE_FANOUT_BATCH_SIZE
+
+    prefix = storage.add_prefix('uid')
+
+    actions = get_actions()
+
+    target_identifiers = {}
+
+    for data in data_list:
+        target_uid = data.get('target') or None
+
+        if target_uid is not None and target_uid not in target_identifiers:
+            target_identifiers[target_uid] = manager.get_data_from_uid(target_uid)['identifier']
+
+    entries = []
+
+    for data in data_list:
+        action_class = actions.get(data['verb'])
+
+        target_uid = data.get('target') or None
+
+        entries.append((data,
+                        target_uid,
+                        target_identifiers.get(target_uid),
+                        action_class.get_indexes() if action_class else settings.TIMELINE_INDEXES))
+
+    retentions = {}
+
+    # the removals still reach the dormant timelines which kept the actions
+    skip_dormant = is_enabled() and not remove
+
+    count = 0
+    offset = start
+
+    for uids in iter_followers_uids(uid, batch_size, identifier=identifier, start=start, stop=stop):
+        batch = Batch()
+        references = []
+        trims = []
+
+        offset += len(uids)
+
+        if skip_dormant:
+            uids = filter_active(client, uids)
+
+        for identifier, follower_uid in uids:
+            if '%s' % follower_uid == '%s' % uid:
+                continue
+
+            timeline_entries = []
+
+            for data, target_uid, target_identifier, indexes in entries:
+                keys = get_timeline_keys(prefix, follower_uid, identifier, data['actor'],
+                                         target_uid=target_uid,
+                                         target_identifier=target_identifier,
+                                         indexes=indexes)
+
+                if remove:
+                    references += remove_from_keys(batch, keys, data['uid'], data['verb'], indexes=indexes)
+                else:
+                    timeline_entries.append((keys, data['uid'], data['verb'],
+                                             get_score(data['timestamp'], data['uid']),
+                                             indexes))
+
+            if timeline_entries:
+                if identifier not in retentions:
+                    retentions[identifier] = get_retention(identifier)
+
+                max_length, max_age = retentions[identifier]
+
+                added, trimmed = add_many_to_keys(batch, timeline_entries,
+                                                  max_length=max_length,
+                                                  max_age=max_age)
+
+                references += added
+                trims += trimmed
+
+            count += 1
+
+        if len(batch):
+            apply_changes(client, client.execute_batch(batch), trims=trims, references=references)
+
+        if progress is not None:
+            progress.update(offset)
+
+    return count
+
+
+def fanout_slice(uid, data_list, identifier, start, stop, progress=None, remove=False):
+    """
+    Fans out ``data_list`` to the followers of the resource ``uid`` from
+    rank ``start`` to ``stop`` for at most ``SEQUERE_TIMELINE_FANOUT_TIME_SLICE``
+    seconds and returns the rank reached.
+    """
+    time_slice = settings.TIMELINE_FANOUT_TIME_SLICE
+
+    if not time_slice:
+        fanout_many(uid, data_list, identifier=identifier, start=start, stop=stop, progress=progress, remove=remove)
+
+        return stop
+
+    batch_size = settings.TIMELINE_FANOUT_BATCH_SIZE
+
+    deadline = time.time() + time_slice
+
+    offset = start
+
+    # a slice writes at least one batch so the fan-out always progresses
+    while offset < stop:
+        fanout_many(uid, data_list,
+                    identifier=identifier,
+                    start=offset,
+                    stop=min(offset + batch_size, stop),
+                    progress=progress,
+                    remove=remove)
+
+        offset = min(offset + batch_size, stop)
+
+        if time.time() >= deadline:
+            break
+
+    return offset
+
+
+def populate(from_uid, to_uid, remove=False, limit=None, batch_size=None, since=None):
+    """
+    Copies the most recent actions of the public timeline of the resource
+    ``from_uid``, newer than the timestamp ``since`` when given, to the
+    private timeline of the resource ``to_uid``, or removes them from it,
+    reusing the stored actions, and returns the number of actions handled.
+    """
+    from . import Timeline
+    from .connection import storage, client
+
+    limit = limit or settings.TIMELINE_BACKFILL_LIMIT
+    batch_size = batch_size or settings.TIMELINE_FANOUT_BATCH_SIZE
+
+    instance = manager.get_from_uid(from_uid)
+
+    if instance is None:
+        return 0
+
+    key = Timeline(instance)._resolve_key('public')
+
+    if since is None:
+        members = client.zrevrange(key, 0, (limit or 0) - 1, withscores=True)
+    else:
+        members = client.zrevrangebyscore(key, '+inf', since, start=0, num=limit, withscores=True)
+
+    identifier = manager.get_data_from_uid(to_uid)['identifier']
+
+    max_length, max_age = get_retention(identifier)
+
+    prefix = storage.add_prefix('uid')
+
+    actions = get_actions()
+
+    count = 0
+
+    for offset in range(0, len(members), batch_size):
+        scores = members[offset:offset + batch_size]
+
+        summaries = load_summaries(client, storage.prefix, [uid for uid, score in scores])
+
+        batch = Batch()
+        references = []
+        trims = []
+
+        for (uid, score), summary in zip(scores, summaries):
+            if summary is None:
+                continue
+
+            verb, actor_uid, target_uid, target_identifier = summary
+
+            action_class = actions.get(verb)
+
+            indexes = action_class.get_indexes() if action_class else settings.TIMELINE_INDEXES
+
+            keys = get_timeline_keys(prefix, to_uid, identifier, actor_uid,
+                                     target_uid=target_uid,
+                                     target_identifier=target_identifier,
+                                     indexes=indexes)
+
+            if remove:
+                references += remove_from_keys(batch, keys, uid, verb, indexes=indexes)
+            else:
+                added, trimmed = add_to_keys(batch, keys, uid, verb, score,
+                                             max_length=max_length,
+                                             max_age=max_age,
+                                             indexes=indexes)
+
+                references += added
+                trims += trimmed
+
+            count += 1
+
+        if len(batch):
+            apply_changes(client, client.execute_batch(batch), trims=trims, references=references)
+
+    return count
@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+
+class Command(NoArgsCommand):
+    help = 'Deletes the actions which are not referenced by any timeline anymore'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size',
+                    action='store',
+                    type='int',
+                    dest='batch_size',
+                    default=None,
+                    help='Number of actions checked per round trip'),
+        make_option('--interval',
+                    action='store',
+                    type='float',
+                    dest='interval',
+                    default=None,
+                    help='Pause in seconds between two batches'),
+    )
+
+    def handle_noargs(self, **options):
+        from sequere.contrib.timeline.collector import collect
+
+        count, size = collect(batch_size=options['batch_size'],
+                              interval=options['interval'])
+
+        self.stdout.write('%d actions collected, %d bytes reclaimed' % (count, size))
@@ -0,0 +1,54 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+
+class Command(NoArgsCommand):
+    help = 'Consumes the fan-outs published to the Redis stream'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--consumer',
+                    action='store',
+                    dest='consumer',
+                    default=None,
+                    help='Name of the consumer in the group, defaults to the host and the pid'),
+        make_option('--concurrency',
+                    action='store',
+                    type='int',
+                    dest='concurrency',
+                    default=None,
+                    help='Number of fan-outs run concurrently'),
+        make_option('--count',
+                    action='store',
+                    type='int',
+                    dest='count',
+                    default=None,
+                    help='Number of fan-outs read per round trip'),
+        make_option('--block',
+                    action='store',
+                    type='int',
+                    dest='block',
+                    default=1000,
+                    help='Milliseconds to wait for new fan-outs'),
+        make_option('--interval',
+                    action='store',
+                    type='float',
+                    dest='interval',
+                    default=60,
+                    help='Seconds between two reports of the metrics'),
+    )
+
+    def handle_noargs(self, **options):
+        from sequere.contrib.timeline.streams import StreamWorker
+
+        worker = StreamWorker(consumer=options['consumer'],
+                              concurrency=options['concurrency'],
+                              count=options['count'],
+                              block=options['block'])
+
+        try:
+            worker.run(interval=options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(worker.format_metrics())
@@ -0,0 +1,23 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+
+class Command(NoArgsCommand):
+    help = 'Rewrites the scores of the timelines stored with a precision of a second'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size',
+                    action='store',
+                    type='int',
+                    dest='batch_size',
+                    default=500,
+                    help='Number of entries rescaled per round trip'),
+    )
+
+    def handle_noargs(self, **options):
+        from sequere.contrib.timeline.scores import rescale
+
+        count = rescale(batch_size=options['batch_size'])
+
+        self.stdout.write('%d entries rescaled' % count)
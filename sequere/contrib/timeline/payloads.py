@@ -0,0 +1,130 @@
+from django.core.exceptions import ImproperlyConfigured
+
+from sequere.registry import registry
+from sequere.backends.redis.utils import get_key
+
+from . import settings
+
+
+# bumped whenever the layout of a packed action changes
+PAYLOAD_VERSION = 1
+
+PAYLOAD_FORMATS = ('hash', 'msgpack', )
+
+
+def is_packed():
+    """
+    Tells whether the actions are stored as packed strings instead of hashes.
+    """
+    payload_format = settings.TIMELINE_PAYLOAD_FORMAT
+
+    if payload_format not in PAYLOAD_FORMATS:
+        raise ImproperlyConfigured('%s is not a valid payload format, choices are: %s' % (
+            payload_format, ', '.join(PAYLOAD_FORMATS)))
+
+    return payload_format == 'msgpack'
+
+
+def get_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImproperlyConfigured(
+            "The msgpack payload format requires msgpack-python to be installed.")
+
+    return msgpack
+
+
+def pack(action):
+    """
+    Encodes ``action`` with the identifiers and the ids of its actor and
+    target so it can be hydrated without resolving their uids.
+    """
+    target = None
+
+    if action.target is not None:
+        target = ['%s' % action.target_uid, registry.get_identifier(action.target), action.target.pk]
+
+    return get_msgpack().packb([
+        PAYLOAD_VERSION,
+        action.verb,
+        action.timestamp,
+        ['%s' % action.actor_uid, registry.get_identifier(action.actor), action.actor.pk],
+        target,
+        action.kwargs,
+    ], use_bin_type=True)
+
+
+def replace_actor(value, actor, timestamp):
+    """
+    Returns the packed action ``value`` shown as done by ``actor``, its
+    ``[uid, identifier, id]``, at ``timestamp``.
+    """
+    msgpack = get_msgpack()
+
+    payload = msgpack.unpackb(value, raw=False)
+
+    payload[2] = timestamp
+    payload[3] = actor
+
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def unpack(uid, value):
+    """
+    Decodes the packed action ``uid`` to the payload given to
+    ``Action.from_payload_list``.
+    """
+    payload = get_msgpack().unpackb(value, raw=False)
+
+    if payload[0] != PAYLOAD_VERSION:
+        raise ValueError('Unsupported payload version %s for action %s' % (payload[0], uid))
+
+    version, verb, timestamp, actor, target, kwargs = payload
+
+    return {
+        'uid': '%s' % uid,
+        'verb': verb,
+        'timestamp': timestamp,
+        'actor': actor,
+        'target': target,
+        'kwargs': kwargs,
+    }
+
+
+def store_action(storage, action, data):
+    """
+    Stores ``action`` and returns its uid, as a packed string or as a hash
+    depending on ``SEQUERE_TIMELINE_PAYLOAD_FORMAT``.
+    """
+    if not is_packed():
+        return storage.make_uid(data)
+
+    uid = storage.client.incr(storage.add_prefix(get_key('global', 'uid')))
+
+    data['uid'] = uid
+
+    storage.client.set(storage.add_prefix(get_key('uid', uid)), pack(action))
+
+    return uid
+
+
+def migrate_actions(client, prefix, actions, references):
+    """
+    Rewrites the hashes of ``actions`` as packed strings and moves their
+    reference counts, ``references`` maps their uids to the ``refs`` field
+    of the hashes.
+
+    Two readers migrating the same action concurrently count its references
+    twice, which only delays its collection.
+    """
+    with client.map() as pipe:
+        for action in actions:
+            key = get_key(prefix, 'uid', action.uid)
+
+            pipe.set(key, pack(action))
+
+            refs = int(references.get('%s' % action.uid) or 0)
+
+            if refs:
+                pipe.incr(get_key(key, 'refs'), refs)
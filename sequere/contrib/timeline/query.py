@@ -1,8 +1,48 @@
+import base64
+from datetime import datetime
+
+import six
+
 from sequere.query import QuerySetTransformer
+from sequere.utils import to_timestamp
 from sequere.contrib.timeline.action import Action
 
 from sequere.backends.redis.utils import get_key
 
+from .payloads import is_packed, unpack, migrate_actions
+from .scores import get_max_score
+
+
+def encode_cursor(score, uid):
+    """
+    Returns the opaque cursor of the timeline entry ``uid`` stored with
+    ``score``.
+    """
+    return base64.urlsafe_b64encode(('%r:%s' % (float(score), uid)).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    score, uid = base64.urlsafe_b64decode(str(cursor)).decode('utf-8').split(':', 1)
+
+    return float(score), uid
+
+
+def to_bound(value):
+    """
+    Converts a datetime, a timestamp or a cursor to a ``(score, uid)``
+    bound, ``uid`` is ``None`` unless ``value`` is a cursor.
+
+    The bound of a datetime or a timestamp is the highest score of its
+    millisecond.
+    """
+    if isinstance(value, six.string_types):
+        return decode_cursor(value)
+
+    if isinstance(value, datetime):
+        value = to_timestamp(value)
+
+    return get_max_score(value), None
+
 
 class TimelineQuerySetTransformer(QuerySetTransformer):
     def __init__(self, client, count, key, prefix=None):
@@ -12,52 +52,260 @@ class TimelineQuerySetTransformer(QuerySetTransformer):
         self.order_by(False)
         self.prefix = prefix or ''
 
+        self.since = None
+        self.until = None
+        self.cursor = None
+        self.first_cursor = None
+        self.last_cursor = None
+
+        self._ties = None
+        self._bounded_count = None
+
     def order_by(self, desc):
         self.desc = desc
 
         if desc:
             self.method = getattr(self.qs, 'zrevrangebyscore')
-
-            self.pieces = self.keys + ['+inf', '-inf']
         else:
             self.method = getattr(self.qs, 'zrangebyscore')
 
-            self.pieces = self.keys + ['-inf', '+inf']
+        return self
+
+    def between(self, since=None, until=None):
+        """
+        Restricts the results to the entries strictly newer than ``since``
+        and not newer than ``until``, both a datetime, a timestamp or a
+        cursor taken from ``first_cursor`` or ``last_cursor`` of a previous page.
+        """
+        self.since = to_bound(since) if since is not None else None
+        self.until = to_bound(until) if until is not None else None
 
         return self
 
+    def after(self, cursor):
+        """
+        Restricts the results to the entries following ``cursor`` in the
+        current ordering, taken from ``last_cursor`` of a previous page.
+        """
+        self.cursor = decode_cursor(cursor) if cursor is not None else None
+
+        return self
+
+    def _get_bounds(self):
+        lower, upper = self.since, self.until
+
+        if self.cursor is not None:
+            if self.desc:
+                upper = self.cursor
+            else:
+                lower = self.cursor
+
+        return lower, upper
+
+    def _is_bounded(self):
+        lower, upper = self._get_bounds()
+
+        return lower is not None or upper is not None
+
+    def _get_pieces(self):
+        lower, upper = self._get_bounds()
+
+        # entries sharing the score of a cursor are fetched apart
+        minimum = '-inf' if lower is None else '(%r' % lower[0]
+
+        maximum = '+inf'
+
+        if upper is not None:
+            maximum = ('%r' if upper[1] is None else '(%r') % upper[0]
+
+        if self.desc:
+            return self.keys + [maximum, minimum]
+
+        return self.keys + [minimum, maximum]
+
+    def _in_bounds(self, uid, score):
+        lower, upper = self._get_bounds()
+
+        if lower is not None:
+            if lower[1] is None and not score > lower[0]:
+                return False
+
+            if lower[1] is not None and not (score, uid) > lower:
+                return False
+
+        if upper is not None:
+            if upper[1] is None and score > upper[0]:
+                return False
+
+            if upper[1] is not None and not (score, uid) < upper:
+                return False
+
+        return True
+
+    def _get_ties(self):
+        """
+        Returns the entries sharing the score of a cursor which come
+        before and after the others in the current ordering.
+        """
+        if self._ties is None:
+            lower, upper = self._get_bounds()
+
+            ties = {}
+
+            for bound in (lower, upper):
+                if bound is not None and bound[1] is not None and bound not in ties:
+                    members = self.qs.zrangebyscore(self.keys[0], bound[0], bound[0], withscores=True)
+
+                    ties[bound] = sorted([(uid, score) for uid, score in members
+                                          if self._in_bounds(uid, score)],
+                                         reverse=self.desc)
+
+            head = ties.get(upper if self.desc else lower, [])
+            tail = [tie for tie in ties.get(lower if self.desc else upper, []) if tie not in head]
+
+            self._ties = head, tail
+
+        return self._ties
+
+    def _get_core_count(self):
+        pieces = self._get_pieces()
+
+        if self.desc:
+            return self.qs.zcount(pieces[0], pieces[2], pieces[1])
+
+        return self.qs.zcount(*pieces)
+
+    def count(self):
+        """
+        Returns the number of entries within the dates and past the cursor
+        of the timeline, not the size of a page sliced from it.
+        """
+        if not self._is_bounded():
+            return self._count
+
+        if self._bounded_count is None:
+            head, tail = self._get_ties()
+
+            self._bounded_count = len(head) + self._get_core_count() + len(tail)
+
+        return self._bounded_count
+
+    def __len__(self):
+        return self.count()
+
     def transform(self, qs):
         start = self.start or 0
         stop = self.stop or -1
 
-        scores = self.method(*self.pieces,
-                             start=start,
-                             num=stop - start,
-                             withscores=True)
+        lower, upper = self._get_bounds()
+
+        if (lower is None or lower[1] is None) and (upper is None or upper[1] is None):
+            scores = self.method(*self._get_pieces(),
+                                 start=start,
+                                 num=stop - start,
+                                 withscores=True)
+        else:
+            scores = self._get_scores_with_ties(start, stop)
+
+        if scores:
+            self.first_cursor = encode_cursor(scores[0][1], scores[0][0])
+            self.last_cursor = encode_cursor(scores[-1][1], scores[-1][0])
 
         return self._transform(scores)
 
+    def _get_scores_with_ties(self, start, stop):
+        head, tail = self._get_ties()
+
+        if stop < 0:
+            stop = self.count()
+
+        scores = head[start:stop]
+
+        core_start = max(0, start - len(head))
+
+        num = stop - start - len(scores)
+
+        if num <= 0:
+            return scores
+
+        core = self.method(*self._get_pieces(),
+                           start=core_start,
+                           num=num,
+                           withscores=True)
+
+        scores += core
+
+        if len(core) < num:
+            core_count = core_start + len(core) if core else self._get_core_count()
+
+            tail_start = max(0, start - len(head) - core_count)
+
+            scores += tail[tail_start:tail_start + num - len(core)]
+
+        return scores
+
     def _transform(self, scores):
+        from .aggregation import load_aggregates
+
+        uids = [uid for uid, score in scores]
+
+        if is_packed():
+            actions = self._load_payloads(uids)
+        else:
+            # the action may have been collected since it was trimmed
+            actions = Action.from_data_list(self._get_data_list(uids))
+
+        load_aggregates(self.qs, self.prefix, actions)
+
+        return actions
+
+    def _load_payloads(self, uids):
+        values = self.qs.get_many([get_key(self.prefix, 'uid', uid) for uid in uids])
+
+        payloads = [unpack(uid, value) for uid, value in zip(uids, values) if value]
+
+        actions = dict((action.uid, action) for action in Action.from_payload_list(payloads))
+
+        # actions stored before the switch to packed payloads are still hashes
+        missing = ['%s' % uid for uid in uids if '%s' % uid not in actions]
+
+        if missing:
+            hashes = self._get_data_list(missing)
+
+            references = dict((data['uid'], data.get('refs')) for data in hashes)
+
+            migrated = Action.from_data_list(hashes)
+
+            migrate_actions(self.qs, self.prefix, migrated, references)
+
+            actions.update(('%s' % action.uid, action) for action in migrated)
+
+        return [actions['%s' % uid] for uid in uids if '%s' % uid in actions]
+
+    def _get_data_list(self, uids):
+        # a reference count applied after the collection of an action
+        # leaves a hash holding only its ``refs``
+        return [dict(data) for data in self._get_hashes(uids) if data and 'uid' in data]
+
+    def _get_hashes(self, uids):
         raise NotImplementedError
 
 
 class RedisTimelineQuerySetTransformer(TimelineQuerySetTransformer):
-    def _transform(self, scores):
+    def _get_hashes(self, uids):
         with self.qs.map() as pipe:
-            for uid, score in scores:
+            for uid in uids:
                 pipe.hgetall(get_key(self.prefix, 'uid', uid))
 
-            return [Action.from_data(data)
-                    for data in pipe.execute()]
+            return pipe.execute()
 
 
 class NydusTimelineQuerySetTransformer(TimelineQuerySetTransformer):
-    def _transform(self, scores):
+    def _get_hashes(self, uids):
         results = []
 
         with self.qs.map() as pipe:
-            for uid, score in scores:
+            for uid in uids:
                 results.append(pipe.hgetall(get_key(self.prefix, 'uid', uid)))
 
-        return [Action.from_data(data)
-                for data in results if data]
+        return results
@@ -0,0 +1,121 @@
+from collections import defaultdict, OrderedDict
+
+from sequere.backends.redis.utils import get_key
+
+from .payloads import is_packed
+
+
+def get_action_key(uid):
+    from .connection import storage
+
+    return storage.add_prefix(get_key('uid', uid))
+
+
+def incr_references(pipe, uid, value):
+    """
+    Records in ``pipe`` the increment of the reference count of the action
+    ``uid``, a field of its hash or a key next to its packed payload.
+    """
+    if is_packed():
+        return pipe.incr(get_key(get_action_key(uid), 'refs'), value)
+
+    return pipe.hincrby(get_action_key(uid), 'refs', value)
+
+
+def add_references(batch, uid, indexes, count_keys=None):
+    """
+    Records in ``batch`` the increment of the reference count of the action
+    ``uid`` by the number of ``ZADD`` recorded at ``indexes``.
+
+    The references are counted upfront so an action being written can never
+    be collected, ``apply_changes`` takes back the members which were
+    already stored, along with the ``count_keys`` incremented for them.
+    """
+    incr_references(batch, uid, len(indexes))
+
+    return (uid, indexes, 1, count_keys or [None] * len(indexes))
+
+
+def add_many_references(batch, members):
+    """
+    Records in ``batch`` the increment of the reference counts of actions
+    added together, ``members`` are the ``(uid, index, count key)`` of the
+    ``ZADD`` recorded for each member, and returns the references to give
+    to ``apply_changes``.
+    """
+    references = OrderedDict()
+
+    for uid, index, count_key in members:
+        indexes, count_keys = references.setdefault('%s' % uid, ([], []))
+
+        indexes.append(index)
+        count_keys.append(count_key)
+
+    for uid, (indexes, count_keys) in references.items():
+        incr_references(batch, uid, len(indexes))
+
+    return [(uid, indexes, 1, count_keys) for uid, (indexes, count_keys) in references.items()]
+
+
+def remove_references(uid, indexes, count_keys=None):
+    """
+    Returns the reference to give to ``apply_changes`` to decrement the
+    reference count of the action ``uid`` by the number of ``ZREM``
+    recorded at ``indexes`` which removed a member, and to restore the
+    ``count_keys`` decremented for the members which were not stored.
+    """
+    return (uid, indexes, -1, count_keys or [None] * len(indexes))
+
+
+def apply_changes(client, results, trims=(), references=()):
+    """
+    Fixes the counters and the reference counts of the actions once a batch
+    has been executed and returns the number of entries trimmed.
+
+    ``trims`` are the ``(count key, members index)`` pairs returned by
+    ``trim_keys``, ``references`` are returned by ``add_references`` and
+    ``remove_references``.
+    """
+    counts = defaultdict(int)
+    refs = defaultdict(int)
+
+    trimmed = 0
+
+    for count_key, index in trims:
+        members = results[index] or []
+
+        trimmed += len(members)
+
+        if count_key is not None:
+            counts[count_key] += len(members)
+
+        for member in members:
+            refs[member] -= 1
+
+    for uid, indexes, delta, count_keys in references:
+        changed = 0
+
+        for index, count_key in zip(indexes, count_keys):
+            if int(results[index] or 0):
+                changed += 1
+            elif count_key is not None:
+                # the counter was updated for a no-op
+                counts[count_key] += delta
+
+        if delta > 0:
+            refs['%s' % uid] -= len(indexes) - changed
+        else:
+            refs['%s' % uid] -= changed
+
+    counts = dict((key, value) for key, value in counts.items() if value)
+    refs = dict((uid, value) for uid, value in refs.items() if value)
+
+    if counts or refs:
+        with client.map() as pipe:
+            for key, value in counts.items():
+                pipe.decr(key, value)
+
+            for uid, value in refs.items():
+                incr_references(pipe, uid, value)
+
+    return trimmed
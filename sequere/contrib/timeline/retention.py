@@ -0,0 +1,135 @@
+from django.utils import timezone as datetime
+
+from sequere.utils import to_timestamp
+from sequere.registry import registry
+from sequere.backends.redis.connection import manager
+from sequere.backends.redis.utils import get_key
+
+from . import settings
+from .wrappers import Batch
+from .references import apply_changes
+
+
+def get_retention(identifier):
+    """
+    Returns the ``(max_length, max_age)`` retention of the timelines of the
+    resources registered with ``identifier``.
+    """
+    sequere = registry.for_model(registry.identifiers.get(identifier))
+
+    return (getattr(sequere, 'timeline_max_length', None) or settings.TIMELINE_MAX_LENGTH,
+            getattr(sequere, 'timeline_max_age', None) or settings.TIMELINE_MAX_AGE)
+
+
+def trim_keys(batch, keys, max_length=None, max_age=None, counts=True):
+    """
+    Records in ``batch`` the commands trimming the sorted sets ``keys`` and
+    returns the ``(count key, members index)`` pairs to give to
+    ``apply_changes``, the count key is ``None`` when ``counts`` are not
+    materialized.
+    """
+    trims = []
+
+    if max_age:
+        min_timestamp = '(%r' % (to_timestamp(datetime.now()) - max_age)
+
+    for key in keys:
+        count_key = get_key(key, 'count') if counts else None
+
+        # the trimmed members are read first to release their references
+        if max_length:
+            trims.append((count_key, batch.zrange(key, 0, -(max_length + 1))))
+
+            batch.zremrangebyrank(key, 0, -(max_length + 1))
+
+        if max_age:
+            trims.append((count_key, batch.zrangebyscore(key, '-inf', min_timestamp)))
+
+            batch.zremrangebyscore(key, '-inf', min_timestamp)
+
+    return trims
+
+
+def parse_key(key, prefix):
+    """
+    Returns the uid of the owner of the timeline sorted set ``key`` or
+    ``None`` when ``key`` is not a timeline sorted set.
+    """
+    segments = key[len(prefix):].strip(':').split(':')
+
+    if len(segments) < 2 or segments[1] not in ('private', 'public'):
+        return None
+
+    # counters and cached reads are not timelines
+    if segments[-1] in ('count', 'filtered', 'version') or 'union' in segments or 'pull' in segments:
+        return None
+
+    return segments[0]
+
+
+def sweep(batch_size=500):
+    """
+    Applies the retention to every timeline sorted set, to catch up on the
+    keys which grew before a retention was configured or which have not
+    been written since, and returns the number of entries removed.
+    """
+    from .connection import storage, client
+
+    prefix = storage.add_prefix('uid')
+
+    identifiers = {}
+    retentions = {}
+
+    keys = []
+    removed = 0
+
+    def flush(keys):
+        batch = Batch()
+
+        types = [(batch.type(key), batch.exists(get_key(key, 'count'))) for key in keys]
+
+        results = client.execute_batch(batch)
+
+        batch = Batch()
+        trims = []
+
+        for key, (index, counts) in zip(keys, types):
+            if results[index] not in ('zset', b'zset'):
+                continue
+
+            uid = parse_key(key, prefix)
+
+            if uid not in identifiers:
+                identifiers[uid] = manager.get_data_from_uid(uid).get('identifier')
+
+            identifier = identifiers[uid]
+
+            if identifier not in retentions:
+                retentions[identifier] = get_retention(identifier) if identifier else (None, None)
+
+            max_length, max_age = retentions[identifier]
+
+            trims += trim_keys(batch, [key],
+                               max_length=max_length,
+                               max_age=max_age,
+                               counts=bool(results[counts]))
+
+        if not trims:
+            return 0
+
+        return apply_changes(client, client.execute_batch(batch), trims=trims)
+
+    for key in client.scan_iter(match=get_key(prefix, '*'), count=batch_size):
+        if parse_key(key, prefix) is None:
+            continue
+
+        keys.append(key)
+
+        if len(keys) >= batch_size:
+            removed += flush(keys)
+            keys = []
+
+    if keys:
+        removed += flush(keys)
+
+    return removed
@@ -0,0 +1,144 @@
+import time
+
+from django.conf import settings as django_settings
+
+from sequere.backends.redis.utils import get_key
+
+
+# the actions stored within the same millisecond are ordered by the last
+# digits of their uids, kept below the precision of a double
+TIEBREAK = 1000
+
+# replaces the read marker ``KEYS[1]``, or its field ``ARGV[3]``, with
+# ``ARGV[2]`` unless it has been marked as read since it was read
+RESCALE_MARKER_SCRIPT = """
+local value
+
+if ARGV[3] then
+    value = redis.call('HGET', KEYS[1], ARGV[3])
+else
+    value = redis.call('GET', KEYS[1])
+end
+
+if value ~= ARGV[1] then
+    return 0
+end
+
+if ARGV[3] then
+    redis.call('HSET', KEYS[1], ARGV[3], ARGV[2])
+else
+    redis.call('SET', KEYS[1], ARGV[2])
+end
+
+return 1
+"""
+
+
+def get_score(timestamp, uid):
+    """
+    Returns the score of the action ``uid`` stored at ``timestamp``, its
+    timestamp to the millisecond with the last digits of its uid as
+    microseconds so two actions never share a score within a millisecond.
+    """
+    return round(float(timestamp), 3) + (int(uid) % TIEBREAK) / (TIEBREAK * 1000.0)
+
+
+def get_max_score(timestamp):
+    """
+    Returns the highest score of an action stored at ``timestamp``, the
+    bound including all the actions of its millisecond.
+    """
+    return get_score(timestamp, TIEBREAK - 1)
+
+
+def is_rescaled(score):
+    return float(score) != int(float(score))
+
+
+def to_utc(timestamp):
+    """
+    Returns the UTC timestamp of ``timestamp`` stored before the aware
+    datetimes were converted to UTC, their wall clock was read in the
+    standard time of the local timezone.
+    """
+    if not django_settings.USE_TZ:
+        return timestamp
+
+    return timestamp - time.timezone
+
+
+def rescale_timeline(connection, key, batch_size):
+    pipe = connection.pipeline(transaction=False)
+
+    count = 0
+
+    for uid, score in connection.zscan_iter(key, count=batch_size):
+        if is_rescaled(score):
+            continue
+
+        # the entries removed meanwhile are not added back
+        pipe.execute_command('ZADD', key, 'XX', get_score(to_utc(score), uid), uid)
+
+        count += 1
+
+        if len(pipe) >= batch_size:
+            pipe.execute()
+
+    pipe.execute()
+
+    return count
+
+
+def rescale_markers(connection, script, key):
+    count = 0
+
+    if key.endswith('read_at'):
+        markers = {None: connection.get(key)}
+    else:
+        markers = connection.hgetall(key)
+
+    for field, value in markers.items():
+        if not value or is_rescaled(value):
+            continue
+
+        args = [value, repr(get_max_score(to_utc(float(value))))]
+
+        if field is not None:
+            args.append(field)
+
+        count += script(keys=[key], args=args)
+
+    return count
+
+
+def rescale(batch_size=500):
+    """
+    Rewrites the scores of the timelines and the read markers stored with
+    a precision of a second, ``batch_size`` entries per round trip, and
+    returns the number of entries rescaled.
+
+    An entry stored on an exact millisecond by an action whose uid ends
+    with zeros cannot be told apart from an old one, its score is kept
+    unless it has to be converted to UTC.
+    """
+    from .connection import storage, client
+    from .retention import parse_key
+
+    prefix = storage.add_prefix('uid')
+
+    count = 0
+
+    # every key is rescaled on the connection storing it, which keeps the
+    # script single key on a cluster
+    for connection in client.connections():
+        script = connection.register_script(RESCALE_MARKER_SCRIPT)
+
+        for key in connection.scan_iter(match=get_key(prefix, '*'), count=batch_size):
+            segments = key[len(prefix):].strip(':').split(':')
+
+            if len(segments) > 1 and segments[1] == 'read_at':
+                count += rescale_markers(connection, script, key)
+            elif parse_key(key, prefix) is not None and connection.type(key) in ('zset', b'zset'):
+                count += rescale_timeline(connection, key, batch_size)
+
+    return count
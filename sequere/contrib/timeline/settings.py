@@ -12,3 +12,61 @@ TIMELINE_PREFIX = getattr(settings,
                           '%stimeline:' % getattr(settings, 'SEQUERE_REDIS_PREFIX', 'sequere:'))
 
 TIMELINE_NYDUS_CONNECTION = getattr(settings, 'SEQUERE_TIMELINE_NYDUS_CONNECTION', None)
+
+TIMELINE_FANOUT_BATCH_SIZE = getattr(settings, 'SEQUERE_TIMELINE_FANOUT_BATCH_SIZE', 500)
+
+TIMELINE_FANOUT_PARTITION_THRESHOLD = getattr(settings, 'SEQUERE_TIMELINE_FANOUT_PARTITION_THRESHOLD', 10000)
+
+TIMELINE_FANOUT_PARTITION_SIZE = getattr(settings, 'SEQUERE_TIMELINE_FANOUT_PARTITION_SIZE', 5000)
+
+TIMELINE_FANOUT_MAX_RETRIES = getattr(settings, 'SEQUERE_TIMELINE_FANOUT_MAX_RETRIES', 3)
+
+TIMELINE_FANOUT_COALESCE_WINDOW = getattr(settings, 'SEQUERE_TIMELINE_FANOUT_COALESCE_WINDOW', None)
+
+TIMELINE_FANOUT_QUEUES = getattr(settings, 'SEQUERE_TIMELINE_FANOUT_QUEUES', None)
+
+TIMELINE_FANOUT_TIME_SLICE = getattr(settings, 'SEQUERE_TIMELINE_FANOUT_TIME_SLICE', None)
+
+TIMELINE_FANOUT_MAX_LAG = getattr(settings, 'SEQUERE_TIMELINE_FANOUT_MAX_LAG', None)
+
+TIMELINE_FANOUT_STREAM = getattr(settings, 'SEQUERE_TIMELINE_FANOUT_STREAM', False)
+
+TIMELINE_STREAM_MAX_LENGTH = getattr(settings, 'SEQUERE_TIMELINE_STREAM_MAX_LENGTH', 100000)
+
+TIMELINE_STREAM_CONCURRENCY = getattr(settings, 'SEQUERE_TIMELINE_STREAM_CONCURRENCY', 10)
+
+TIMELINE_STREAM_CLAIM_TIMEOUT = getattr(settings, 'SEQUERE_TIMELINE_STREAM_CLAIM_TIMEOUT', 60)
+
+TIMELINE_STREAM_MAX_DELIVERIES = getattr(settings, 'SEQUERE_TIMELINE_STREAM_MAX_DELIVERIES', 5)
+
+TIMELINE_DORMANT_AFTER = getattr(settings, 'SEQUERE_TIMELINE_DORMANT_AFTER', None)
+
+TIMELINE_PULL_THRESHOLD = getattr(settings, 'SEQUERE_TIMELINE_PULL_THRESHOLD', None)
+
+TIMELINE_PULL_CACHE_TIMEOUT = getattr(settings, 'SEQUERE_TIMELINE_PULL_CACHE_TIMEOUT', 30)
+
+TIMELINE_PULL_LIMIT = getattr(settings, 'SEQUERE_TIMELINE_PULL_LIMIT', 1000)
+
+TIMELINE_MAX_LENGTH = getattr(settings, 'SEQUERE_TIMELINE_MAX_LENGTH', None)
+
+TIMELINE_MAX_AGE = getattr(settings, 'SEQUERE_TIMELINE_MAX_AGE', None)
+
+TIMELINE_COLLECT_BATCH_SIZE = getattr(settings, 'SEQUERE_TIMELINE_COLLECT_BATCH_SIZE', 500)
+
+TIMELINE_COLLECT_INTERVAL = getattr(settings, 'SEQUERE_TIMELINE_COLLECT_INTERVAL', 0)
+
+TIMELINE_PAYLOAD_FORMAT = getattr(settings, 'SEQUERE_TIMELINE_PAYLOAD_FORMAT', 'hash')
+
+TIMELINE_INDEXES = getattr(settings, 'SEQUERE_TIMELINE_INDEXES', ('target', 'verb', 'public', 'counts', ))
+
+TIMELINE_FILTER_CACHE_TIMEOUT = getattr(settings, 'SEQUERE_TIMELINE_FILTER_CACHE_TIMEOUT', 30)
+
+TIMELINE_FILTER_LIMIT = getattr(settings, 'SEQUERE_TIMELINE_FILTER_LIMIT', 1000)
+
+TIMELINE_UNION_CACHE_TIMEOUT = getattr(settings, 'SEQUERE_TIMELINE_UNION_CACHE_TIMEOUT', 60)
+
+TIMELINE_UNION_LIMIT = getattr(settings, 'SEQUERE_TIMELINE_UNION_LIMIT', 1000)
+
+TIMELINE_BACKFILL_LIMIT = getattr(settings, 'SEQUERE_TIMELINE_BACKFILL_LIMIT', 1000)
+
+TIMELINE_READ_BATCH_SIZE = getattr(settings, 'SEQUERE_TIMELINE_READ_BATCH_SIZE', 200)
@@ -0,0 +1,286 @@
+import logging
+import os
+import socket
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from django.db import connections
+from django.utils.encoding import force_text
+
+from redis.exceptions import ResponseError
+
+from sequere.http import json
+from sequere.backends.redis.utils import get_key
+
+from . import settings
+
+
+logger = logging.getLogger('sequere')
+
+GROUP = 'fanout'
+
+
+def get_stream_key(*segments):
+    from .connection import storage
+
+    return storage.add_prefix(get_key('stream', 'fanout', *segments))
+
+
+def get_connection(key):
+    from .connection import client
+
+    # streams are not supported by the cluster routers, every command of a
+    # stream goes to the connection storing it
+    return client.connection_for(key)
+
+
+def publish(uid, data, dispatch=True):
+    """
+    Appends the fan-out of the stored action ``data`` of the resource
+    ``uid`` to the stream consumed by ``StreamWorker``.
+    """
+    key = get_stream_key()
+
+    return get_connection(key).execute_command('XADD', key,
+                                               'MAXLEN', '~', settings.TIMELINE_STREAM_MAX_LENGTH,
+                                               '*',
+                                               'uid', uid,
+                                               'data', json.dumps(data),
+                                               'dispatch', int(dispatch))
+
+
+def get_next_id(entry_id):
+    """
+    Returns the smallest stream id following ``entry_id``, the exclusive
+    ranges of ``XPENDING`` require Redis 6.2.
+    """
+    ms, sequence = entry_id.split('-')
+
+    return '%s-%d' % (ms, int(sequence) + 1)
+
+
+def parse_entries(entries):
+    """
+    Returns the ``(id, fields)`` of the raw stream ``entries``, the entries
+    deleted since they were read are skipped.
+    """
+    results = []
+
+    for entry in entries or []:
+        if not entry or entry[1] is None:
+            continue
+
+        entry_id, values = entry
+
+        values = [force_text(value) for value in values]
+
+        results.append((force_text(entry_id), dict(zip(values[::2], values[1::2]))))
+
+    return results
+
+
+class StreamWorker(object):
+    """
+    Consumes the fan-outs published to the stream as the consumer
+    ``consumer`` of its group, ``concurrency`` fan-outs at a time.
+
+    A fan-out is acknowledged once written, a failed one stays pending and
+    is claimed again by any consumer after ``claim_timeout`` seconds, up to
+    ``max_deliveries`` times before being moved to the dead letter stream.
+    """
+    def __init__(self, consumer=None, concurrency=None, count=None, block=None,
+                 claim_timeout=None, max_deliveries=None):
+        self.key = get_stream_key()
+        self.dead_key = get_stream_key('dead')
+        self.connection = get_connection(self.key)
+
+        self.consumer = consumer or '%s-%s' % (socket.gethostname(), os.getpid())
+        self.concurrency = concurrency or settings.TIMELINE_STREAM_CONCURRENCY
+        self.count = count or self.concurrency
+        self.block = block
+        self.claim_timeout = settings.TIMELINE_STREAM_CLAIM_TIMEOUT if claim_timeout is None else claim_timeout
+        self.max_deliveries = max_deliveries or settings.TIMELINE_STREAM_MAX_DELIVERIES
+
+        self.pool = ThreadPool(self.concurrency)
+
+        self.started_at = time.time()
+        self.metrics = {
+            'processed': 0,
+            'failed': 0,
+            'claimed': 0,
+            'dead': 0,
+        }
+
+        self.create_group()
+
+    def create_group(self):
+        try:
+            self.connection.execute_command('XGROUP', 'CREATE', self.key, GROUP, '0', 'MKSTREAM')
+        except ResponseError as e:
+            if 'BUSYGROUP' not in '%s' % e:
+                raise
+
+    def read(self):
+        options = ['COUNT', self.count]
+
+        # waits up to ``block`` milliseconds for new fan-outs
+        if self.block:
+            options += ['BLOCK', self.block]
+
+        result = self.connection.execute_command('XREADGROUP', 'GROUP', GROUP, self.consumer, *(options + [
+            'STREAMS', self.key, '>'
+        ]))
+
+        if not result:
+            return []
+
+        return parse_entries(result[0][1])
+
+    def claim(self):
+        """
+        Claims up to ``count`` fan-outs left pending by a failure or by a
+        consumer gone for longer than ``claim_timeout`` seconds.
+        """
+        min_idle_time = int(self.claim_timeout * 1000)
+
+        ids = []
+        dead = []
+
+        start = '-'
+
+        # the entries of the consumers still alive come first, the pending
+        # list is paged through past them
+        while len(ids) < self.count:
+            pending = self.connection.execute_command('XPENDING', self.key, GROUP, start, '+', self.count)
+
+            for entry_id, consumer, idle, deliveries in pending or []:
+                if idle < min_idle_time:
+                    continue
+
+                if deliveries >= self.max_deliveries:
+                    dead.append(force_text(entry_id))
+                elif len(ids) < self.count:
+                    ids.append(force_text(entry_id))
+
+            if not pending or len(pending) < self.count:
+                break
+
+            start = get_next_id(force_text(pending[-1][0]))
+
+        if dead:
+            self.bury(dead)
+
+        if not ids:
+            return []
+
+        entries = parse_entries(self.connection.execute_command('XCLAIM', self.key, GROUP, self.consumer,
+                                                                min_idle_time, *ids))
+
+        self.metrics['claimed'] += len(entries)
+
+        return entries
+
+    def bury(self, ids):
+        """
+        Moves the fan-outs ``ids`` which failed too many times to the dead
+        letter stream.
+        """
+        entries = parse_entries(self.connection.execute_command('XCLAIM', self.key, GROUP, self.consumer,
+                                                                0, *ids))
+
+        pipe = self.connection.pipeline()
+
+        for entry_id, fields in entries:
+            values = ['id', entry_id]
+
+            for item in fields.items():
+                values += item
+
+            pipe.execute_command('XADD', self.dead_key, '*', *values)
+
+        pipe.execute_command('XACK', self.key, GROUP, *ids)
+        pipe.execute()
+
+        self.metrics['dead'] += len(ids)
+
+        logger.error('%d fan-outs moved to %s after %d deliveries' % (len(ids), self.dead_key, self.max_deliveries))
+
+    def handle(self, entry):
+        from .tasks import dispatch_action
+
+        entry_id, fields = entry
+
+        try:
+            dispatch_action(fields['uid'], json.loads(fields['data']), dispatch=bool(int(fields['dispatch'])))
+        except Exception:
+            logger.exception('Fan-out %s failed' % entry_id)
+
+            return None
+        finally:
+            # the threads of the pool open their own database connections
+            for connection in connections.all():
+                connection.close()
+
+        return entry_id
+
+    def process(self, entries):
+        """
+        Runs the fan-outs of ``entries`` concurrently and acknowledges the
+        ones written.
+        """
+        if not entries:
+            return 0
+
+        ids = [entry_id for entry_id in self.pool.map(self.handle, entries) if entry_id is not None]
+
+        if ids:
+            self.connection.execute_command('XACK', self.key, GROUP, *ids)
+
+        self.metrics['processed'] += len(ids)
+        self.metrics['failed'] += len(entries) - len(ids)
+
+        return len(ids)
+
+    def run_once(self):
+        return self.process(self.claim() + self.read())
+
+    def run(self, iterations=None, interval=60):
+        """
+        Consumes the stream for ``iterations`` rounds, forever by default,
+        and logs the metrics every ``interval`` seconds.
+        """
+        logged_at = time.time()
+
+        try:
+            while iterations is None or iterations > 0:
+                self.run_once()
+
+                if iterations is not None:
+                    iterations -= 1
+
+                if time.time() - logged_at >= interval:
+                    logger.info(self.format_metrics())
+
+                    logged_at = time.time()
+        finally:
+            self.close()
+
+    def close(self):
+        self.pool.close()
+
+    def get_metrics(self):
+        metrics = dict(self.metrics)
+
+        elapsed = time.time() - self.started_at
+
+        metrics['throughput'] = metrics['processed'] / elapsed if elapsed else 0
+        metrics['length'] = self.connection.execute_command('XLEN', self.key)
+        metrics['pending'] = self.connection.execute_command('XPENDING', self.key, GROUP)[0]
+
+        return metrics
+
+    def format_metrics(self):
+        return ('%(processed)d fan-outs processed (%(throughput).1f/s), %(failed)d failed, '
+                '%(claimed)d claimed, %(dead)d dead, %(pending)d pending, %(length)d in the stream'
+                % self.get_metrics())
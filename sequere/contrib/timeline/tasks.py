@@ -1,17 +1,54 @@
+from collections import OrderedDict
+
 from django.core.paginator import Paginator
 
+from celery import group
 from celery.task import task
 
+from . import settings
+
+
+def enqueue_partitions(task, uid, data, partitions):
+    """
+    Enqueues ``task`` for each of ``partitions`` in the queue of their
+    fan-out tier, delayed while the queue lags behind.
+    """
+    from .fanout import get_fanout_queue, FanoutQueue
+
+    queue = FanoutQueue(get_fanout_queue(sum(stop - start for identifier, start, stop in partitions)))
+
+    countdown = queue.get_countdown()
+
+    return group(queue.signature(task, (uid, data, identifier, start, stop), countdown=countdown)
+                 for identifier, start, stop in partitions).apply_async()
+
 
 @task
-def dispatch_action(uid, data, dispatch=True):
+def dispatch_action(uid, data, dispatch=True, queue=None):
     from sequere.backends.redis.connection import manager
     from sequere.models import get_followers
 
-    from . import Timeline, Action
+    from . import Timeline, Action, get_actions
+    from .activity import is_enabled, filter_active
+    from .connection import client
+    from .fanout import fanout, get_partitions, FanoutQueue
+    from .signals import pre_save, post_save
+
+    FanoutQueue(queue).untrack(dispatch_action.request.id)
 
     logger = dispatch_action.get_logger()
 
+    action_class = get_actions().get(data['verb'])
+
+    # per follower signals need hydrated instances, skip them when nobody listens
+    if not dispatch or not (pre_save.has_listeners(action_class) or post_save.has_listeners(action_class)):
+        partitions = get_partitions(uid, settings.TIMELINE_FANOUT_PARTITION_SIZE)
+
+        if sum(stop - start for identifier, start, stop in partitions) < settings.TIMELINE_FANOUT_PARTITION_THRESHOLD:
+            return fanout(uid, data)
+
+        return enqueue_partitions(dispatch_action_partition, uid, data, partitions)
+
     instance = manager.get_from_uid(uid)
 
     if not instance:
@@ -21,6 +58,148 @@ def dispatch_action(uid, data, dispatch=True):
 
         action = Action.from_data(data)
 
+        for num_page in paginator.page_range:
+            page = paginator.page(num_page)
+
+            followers = [(obj, manager.make_uid(obj)) for obj, timestamp in page.object_list
+                         if action.actor != obj]
+
+            if is_enabled():
+                followers = filter_active(client, followers)
+
+            for obj, follower_uid in followers:
+                timeline = Timeline(obj)
+                timeline.save(action, dispatch=dispatch)
+
+
+@task(max_retries=settings.TIMELINE_FANOUT_MAX_RETRIES)
+def dispatch_action_partition(uid, data, identifier, start, stop, queue=None):
+    from .fanout import fanout_slice, FanoutProgress, FanoutQueue
+
+    FanoutQueue(queue).untrack(dispatch_action_partition.request.id)
+
+    progress = FanoutProgress(data['uid'], identifier, start)
+
+    offset = progress.get() or start
+
+    try:
+        offset = fanout_slice(uid, [data], identifier, offset, stop, progress=progress)
+    except Exception as exc:
+        raise dispatch_action_partition.retry(exc=exc)
+
+    # the next slice waits behind the tasks enqueued meanwhile
+    if offset < stop:
+        return FanoutQueue(queue).signature(dispatch_action_partition, (uid, data, identifier, start, stop)).apply_async()
+
+    progress.clear()
+
+
+def coalesce_action(uid, data, dispatch=True, queue=None):
+    """
+    Buffers the stored action ``data`` of the resource ``uid`` so the
+    actions it saves within ``SEQUERE_TIMELINE_FANOUT_COALESCE_WINDOW``
+    seconds are fanned out together.
+    """
+    from .fanout import FanoutBuffer, FanoutQueue
+
+    if FanoutBuffer(uid).push(data, dispatch=dispatch):
+        FanoutQueue(queue).signature(dispatch_buffered_actions, (uid, ),
+                                     countdown=settings.TIMELINE_FANOUT_COALESCE_WINDOW).apply_async()
+
+
+@task
+def dispatch_buffered_actions(uid, queue=None):
+    from . import get_actions
+    from .fanout import fanout_many, get_partitions, FanoutBuffer, FanoutQueue
+    from .signals import pre_save, post_save
+
+    FanoutQueue(queue).untrack(dispatch_buffered_actions.request.id)
+
+    data_list = []
+
+    for data, dispatch in FanoutBuffer(uid).pop_all():
+        action_class = get_actions().get(data['verb'])
+
+        if dispatch and (pre_save.has_listeners(action_class) or post_save.has_listeners(action_class)):
+            dispatch_action(uid, data, dispatch=dispatch)
+        else:
+            data_list.append(data)
+
+    # an aggregate updated several times is fanned out once
+    data_list = list(OrderedDict(('%s' % data['uid'], data) for data in data_list).values())
+
+    if not data_list:
+        return 0
+
+    partitions = get_partitions(uid, settings.TIMELINE_FANOUT_PARTITION_SIZE)
+
+    if sum(stop - start for identifier, start, stop in partitions) < settings.TIMELINE_FANOUT_PARTITION_THRESHOLD:
+        return fanout_many(uid, data_list)
+
+    return enqueue_partitions(dispatch_actions_partition, uid, data_list, partitions)
+
+
+@task(max_retries=settings.TIMELINE_FANOUT_MAX_RETRIES)
+def dispatch_actions_partition(uid, data_list, identifier, start, stop, queue=None):
+    from .fanout import fanout_slice, FanoutProgress, FanoutQueue
+
+    FanoutQueue(queue).untrack(dispatch_actions_partition.request.id)
+
+    progress = FanoutProgress(data_list[0]['uid'], identifier, start, name='buffer')
+
+    offset = progress.get() or start
+
+    try:
+        offset = fanout_slice(uid, data_list, identifier, offset, stop, progress=progress)
+    except Exception as exc:
+        raise dispatch_actions_partition.retry(exc=exc)
+
+    if offset < stop:
+        return FanoutQueue(queue).signature(dispatch_actions_partition,
+                                            (uid, data_list, identifier, start, stop)).apply_async()
+
+    progress.clear()
+
+
+@task
+def retract_action(uid, data, dispatch=True, queue=None):
+    from sequere.backends.redis.connection import manager
+    from sequere.models import get_followers
+
+    from . import Timeline, Action, get_actions
+    from .collector import delete_action
+    from .fanout import fanout, get_partitions, FanoutCountdown, FanoutQueue
+    from .signals import pre_delete, post_delete
+
+    FanoutQueue(queue).untrack(retract_action.request.id)
+
+    logger = retract_action.get_logger()
+
+    action_class = get_actions().get(data['verb'])
+
+    # per follower signals need hydrated instances, skip them when nobody listens
+    if not dispatch or not (pre_delete.has_listeners(action_class) or post_delete.has_listeners(action_class)):
+        partitions = get_partitions(uid, settings.TIMELINE_FANOUT_PARTITION_SIZE)
+
+        if sum(stop - start for identifier, start, stop in partitions) < settings.TIMELINE_FANOUT_PARTITION_THRESHOLD:
+            fanout(uid, data, remove=True)
+
+            return delete_action(data['uid'])
+
+        # the last partition done deletes the action
+        FanoutCountdown(data['uid'], name='retract').start(len(partitions))
+
+        return enqueue_partitions(retract_action_partition, uid, data, partitions)
+
+    instance = manager.get_from_uid(uid)
+
+    if not instance:
+        logger.error('No instance found for uid: %s' % uid)
+    else:
+        paginator = Paginator(get_followers(instance), 10)
+
+        action = Action.from_data(dict(data))
+
         for num_page in paginator.page_range:
             page = paginator.page(num_page)
 
@@ -29,27 +208,53 @@ def dispatch_action(uid, data, dispatch=True):
                     continue
 
                 timeline = Timeline(obj)
-                timeline.save(action, dispatch=dispatch)
+                timeline.delete(action, dispatch=dispatch)
 
+    delete_action(data['uid'])
 
-def populate_actions(from_uid, to_uid, method):
-    from sequere.backends.redis.connection import manager
 
-    from . import Timeline
+@task(max_retries=settings.TIMELINE_FANOUT_MAX_RETRIES)
+def retract_action_partition(uid, data, identifier, start, stop, queue=None):
+    from .collector import delete_action
+    from .fanout import fanout_slice, FanoutProgress, FanoutCountdown, FanoutQueue
 
-    from_instance = manager.get_from_uid(from_uid)
+    FanoutQueue(queue).untrack(retract_action_partition.request.id)
 
-    to_instance = manager.get_from_uid(to_uid)
+    progress = FanoutProgress(data['uid'], identifier, start, name='retract')
 
-    paginator = Paginator(Timeline(from_instance).get_public(), 10)
+    offset = progress.get() or start
 
-    timeline = Timeline(to_instance)
+    try:
+        offset = fanout_slice(uid, [data], identifier, offset, stop, progress=progress, remove=True)
+    except Exception as exc:
+        raise retract_action_partition.retry(exc=exc)
+
+    if offset < stop:
+        return FanoutQueue(queue).signature(retract_action_partition,
+                                            (uid, data, identifier, start, stop)).apply_async()
+
+    progress.clear()
+
+    if FanoutCountdown(data['uid'], name='retract').done():
+        delete_action(data['uid'])
+
+
+@task
+def sweep_timelines():
+    from .retention import sweep
+
+    return sweep()
+
+
+def populate_actions(from_uid, to_uid, method):
+    from .fanout import populate
+    from .timeline import is_pull_uid, invalidate_pull_followings
 
-    for num_page in paginator.page_range:
-        page = paginator.page(num_page)
+    # actions of pull mode actors are merged at read time
+    if is_pull_uid(from_uid):
+        return invalidate_pull_followings(to_uid)
 
-        for action in page.object_list:
-            getattr(timeline, method)(action, dispatch=False)
+    populate(from_uid, to_uid, remove=method == 'delete')
 
 
 @task
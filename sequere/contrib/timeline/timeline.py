@@ -1,78 +1,485 @@
+from collections import OrderedDict
+from itertools import islice
+
 import six
 
+from django.core.paginator import Paginator
 from django.db import models
 from django.utils import timezone as datetime
 
 from sequere.utils import to_timestamp, from_timestamp
+from sequere.http import json
 from sequere.registry import registry
 from sequere.backends.redis.connection import manager
 from sequere.backends.redis.utils import get_key
 
-from . import signals
-from .tasks import dispatch_action
-from .action import Action
+from . import signals, settings
+from .tasks import dispatch_action, retract_action, coalesce_action
+from .action import Action, get_actions
+from .retention import get_retention, trim_keys
+from .references import add_references, add_many_references, remove_references, apply_changes
+from .wrappers import Batch
+from .payloads import store_action, is_packed, unpack
+from .aggregation import is_aggregated, aggregate, remove_actor
+from .activity import is_enabled, is_dormant, get_seen_at, get_many_seen_at, touch
+from .collector import delete_action
+from .query import to_bound
+from .streams import publish
+from .scores import get_score, get_max_score
+
+
+def get_timeline_keys(prefix, uid, identifier, actor_uid, target_uid=None, target_identifier=None,
+                      indexes=None):
+    """
+    Returns the keys of the timeline of the resource ``uid`` an action
+    must be stored in, computed from uids only and restricted to the
+    materialized ``indexes``.
+    """
+    if indexes is None:
+        indexes = settings.TIMELINE_INDEXES
+
+    is_actor = '%s' % actor_uid == '%s' % uid
+
+    is_public = is_actor and 'public' in indexes
+    is_target = 'target' in indexes
+
+    keys = [
+        get_key(prefix, uid, 'private'),
+    ]
+
+    if is_target:
+        keys.append(get_key(prefix, uid, 'private', 'target', identifier))
+
+    if is_public:
+        keys.append(get_key(prefix, uid, 'public'))
+
+        if is_target:
+            keys.append(get_key(prefix, uid, 'public', 'target', identifier))
+
+    if is_target and target_uid is not None and '%s' % target_uid != '%s' % actor_uid:
+        keys.append(get_key(prefix, uid, 'private', 'target', target_identifier))
+
+        if is_public:
+            keys.append(get_key(prefix, uid, 'public', 'target', target_identifier))
+
+    # the target may share the identifier of the timeline owner
+    return sorted(set(keys), key=keys.index)
+
+
+def get_version_key(key):
+    """
+    Returns the key versioning the timelines of the owner of the private
+    timeline ``key``, bumped on every write to invalidate the cached unions.
+    """
+    return get_key(key, 'version')
+
+
+def add_to_keys(batch, keys, uid, verb, score, max_length=None, max_age=None, indexes=None):
+    """
+    Records in ``batch`` the commands adding the action ``uid`` with the
+    ``score`` given by ``get_score`` to ``keys``, then the retention
+    commands, and returns the ``(references, trims)`` to give to
+    ``apply_changes`` once the batch has been executed.
+    """
+    if indexes is None:
+        indexes = settings.TIMELINE_INDEXES
+
+    counts = 'counts' in indexes
+
+    verb_keys = []
+
+    if 'verb' in indexes:
+        verb_keys = [get_key(key, 'verb', verb) for key in keys]
+
+    added = []
+    count_keys = []
+
+    # the private timeline of the owner always comes first
+    batch.incr(get_version_key(keys[0]))
+
+    for key in keys + verb_keys:
+        count_key = get_key(key, 'count') if counts else None
+
+        if count_key:
+            batch.incr(count_key)
+
+        added.append(batch.zadd(key, **{
+            '%s' % uid: score
+        }))
+
+        count_keys.append(count_key)
+
+    references = [add_references(batch, uid, added, count_keys=count_keys)]
+
+    trims = trim_keys(batch,
+                      keys + verb_keys,
+                      max_length=max_length,
+                      max_age=max_age,
+                      counts=counts)
+
+    return references, trims
+
+
+def add_many_to_keys(batch, entries, max_length=None, max_age=None):
+    """
+    Records in ``batch`` the commands adding several actions to the
+    timelines of one resource with the retention applied once per key,
+    ``entries`` are the ``(keys, uid, verb, score, indexes)`` of the
+    actions, and returns the ``(references, trims)`` to give to
+    ``apply_changes``.
+    """
+    members = OrderedDict()
+
+    for keys, uid, verb, score, indexes in entries:
+        counts = 'counts' in indexes
+
+        verb_keys = []
+
+        if 'verb' in indexes:
+            verb_keys = [get_key(key, 'verb', verb) for key in keys]
+
+        for key in keys + verb_keys:
+            members.setdefault((key, counts), OrderedDict())['%s' % uid] = score
+
+    for key in set(keys[0] for keys, uid, verb, score, indexes in entries):
+        batch.incr(get_version_key(key))
+
+    added = []
+
+    for (key, counts), scores in members.items():
+        count_key = get_key(key, 'count') if counts else None
+
+        if count_key:
+            batch.incr(count_key, len(scores))
+
+        # a member each so only the members already stored are taken back
+        for uid, score in scores.items():
+            added.append((uid, batch.zadd(key, **{uid: score}), count_key))
+
+    references = add_many_references(batch, added)
+
+    trims = []
+
+    for counts in (True, False):
+        trims += trim_keys(batch,
+                           [key for key, key_counts in members if key_counts == counts],
+                           max_length=max_length,
+                           max_age=max_age,
+                           counts=counts)
+
+    return references, trims
+
+
+def remove_from_keys(batch, keys, uid, verb, indexes=None):
+    """
+    Records in ``batch`` the commands removing the action ``uid`` from
+    ``keys`` and returns the references to give to ``apply_changes``.
+    """
+    if indexes is None:
+        indexes = settings.TIMELINE_INDEXES
+
+    counts = 'counts' in indexes
+
+    verb_keys = []
+
+    if 'verb' in indexes:
+        verb_keys = [get_key(key, 'verb', verb) for key in keys]
+
+    removed = []
+    count_keys = []
+
+    batch.incr(get_version_key(keys[0]))
+
+    for key in keys + verb_keys:
+        count_key = get_key(key, 'count') if counts else None
+
+        if count_key:
+            batch.decr(count_key)
+
+        removed.append(batch.zrem(key, '%s' % uid))
+
+        count_keys.append(count_key)
+
+    return [remove_references(uid, removed, count_keys=count_keys)]
+
+
+def load_summaries(client, prefix, uids):
+    """
+    Returns the ``(verb, actor uid, target uid, target identifier)`` of
+    the actions ``uids`` without hydrating them, ``None`` for the missing
+    ones.
+    """
+    keys = [get_key(prefix, 'uid', uid) for uid in uids]
+
+    summaries = dict.fromkeys(keys)
+
+    if is_packed():
+        for key, value in zip(keys, client.get_many(keys)):
+            if value:
+                payload = unpack(key, value)
+
+                target = payload['target'] or (None, None, None)
+
+                summaries[key] = (payload['verb'], payload['actor'][0], target[0], target[1])
+
+    # hashes, including the ones not migrated to packed payloads yet
+    missing = [key for key in keys if summaries[key] is None]
+
+    if missing:
+        batch = Batch()
+
+        indexes = [batch.hmget(key, 'verb', 'actor', 'target') for key in missing]
+
+        results = client.execute_batch(batch)
+
+        targets = []
+
+        for key, index in zip(missing, indexes):
+            verb, actor, target = results[index]
+
+            if verb:
+                summaries[key] = (verb, actor, target, None)
+
+                if target:
+                    targets.append(target)
+
+        if targets:
+            with manager.client.pipeline() as pipe:
+                for target in targets:
+                    pipe.hget(manager.add_prefix(get_key('uid', target)), 'identifier')
+
+                identifiers = dict(zip(targets, pipe.execute()))
+
+            for key in missing:
+                if summaries[key] and summaries[key][2]:
+                    summaries[key] = summaries[key][:3] + (identifiers[summaries[key][2]], )
+
+    return [summaries[key] for key in keys]
+
+
+def get_pull_key():
+    from .connection import storage
+
+    return storage.add_prefix('pull')
+
+
+def get_pull_followings_key(uid):
+    """
+    Returns the key caching the pull mode actors followed by the resource
+    ``uid``.
+    """
+    from .connection import storage
+
+    return storage.add_prefix(get_key('uid', uid, 'private', 'followings', 'pull'))
+
+
+def invalidate_pull_followings(uid):
+    """
+    Drops the pull mode actors followed by the resource ``uid`` and its
+    merged timelines once it follows or unfollows one of them.
+    """
+    from .connection import storage, client
+
+    with client.map() as pipe:
+        pipe.delete(get_pull_followings_key(uid))
+        pipe.incr(get_version_key(storage.add_prefix(get_key('uid', uid, 'private'))))
+
+
+def is_pull_uid(uid):
+    """
+    Tells whether the actions of the resource ``uid`` are kept in its
+    public timeline only and merged in the private timelines at read time.
+    """
+    from .connection import client
+
+    if not settings.TIMELINE_PULL_THRESHOLD:
+        return False
+
+    return bool(client.sismember(get_pull_key(), '%s' % uid))
 
 
 class Timeline(object):
-    def __init__(self, instance, *args, **kwargs):
+    def __init__(self, instance, max_length=None, max_age=None, *args, **kwargs):
         from .connection import storage, client
 
         self.instance = instance
         self.storage = storage
         self.client = client
 
+        default_max_length, default_max_age = get_retention(registry.get_identifier(instance))
+
+        self.max_length = max_length or default_max_length
+        self.max_age = max_age or default_max_age
+
     def _get_keys(self, action):
-        identifier = registry.get_identifier(self.instance)
+        target_identifier = None
 
-        prefix = self.storage.add_prefix('uid')
+        if action.target is not None:
+            target_identifier = registry.get_identifier(action.target)
 
-        uid = manager.make_uid(self.instance)
+        return get_timeline_keys(self.storage.add_prefix('uid'),
+                                 manager.make_uid(self.instance),
+                                 registry.get_identifier(self.instance),
+                                 action.actor_uid,
+                                 target_uid=action.target_uid,
+                                 target_identifier=target_identifier,
+                                 indexes=action.get_indexes())
 
-        keys = [
-            get_key(prefix, uid, 'private'),
-            get_key(prefix, uid, 'private', 'target', identifier)
+    def _make_key(self, name, action=None, target=None, uid=None):
+        segments = [
+            self.storage.add_prefix('uid'),
+            uid or manager.make_uid(self.instance),
+            name,
         ]
 
-        if action.actor == self.instance:
-            keys.append(get_key(prefix, uid, 'public'))
-            keys.append(get_key(prefix, uid, 'public', 'target', identifier))
+        target_identifier = self._get_target_identifier(target)
 
-        if action.target is not None and action.target != action.actor:
-            identifier = registry.get_identifier(action.target)
+        if target_identifier:
+            segments += ['target', target_identifier]
 
-            keys.append(get_key(prefix, uid, 'private', 'target', identifier))
+        verb = self._get_verb(action)
 
-            if action.actor == self.instance:
-                keys.append(get_key(prefix, uid, 'public', 'target', identifier))
+        if verb:
+            segments += ['verb', verb]
 
-        return keys
+        key = get_key(*segments)
 
-    def _make_key(self, name, action=None, target=None):
-        segments = [
-            self.storage.add_prefix('uid'),
-            manager.make_uid(self.instance),
-            name,
-        ]
+        return key
 
+    def _get_target_identifier(self, target):
         if target:
             if isinstance(target, six.string_types):
-                segments += ['target', target]
+                return target
 
-            else:
-                if isinstance(target, models.Model) or issubclass(target, models.Model):
-                    segments += ['target', registry.get_identifier(target)]
+            if isinstance(target, models.Model) or issubclass(target, models.Model):
+                return registry.get_identifier(target)
+
+        return None
 
+    def _get_verb(self, action):
         if action:
             if isinstance(action, six.string_types):
-                segments += ['verb', action]
-            elif issubclass(action, Action):
-                segments += ['verb', action.verb]
+                return action
 
-        key = get_key(*segments)
+            if issubclass(action, Action):
+                return action.verb
 
-        return key
+        return None
+
+    def _get_missing_indexes(self, name, action=None, target=None, counts=False):
+        """
+        Returns the indexes needed to read ``name`` filtered by ``action``
+        and ``target`` which are not materialized by every action concerned.
+        """
+        needed = set()
+
+        if name == 'public':
+            needed.add('public')
+
+        if action:
+            needed.add('verb')
+
+        if target:
+            needed.add('target')
+
+        if counts:
+            needed.add('counts')
+
+        verb = self._get_verb(action)
+
+        if verb:
+            action_classes = [get_actions().get(verb)]
+        else:
+            action_classes = get_actions().values()
+
+        missing = set()
+
+        for action_class in action_classes:
+            if action_class is not None:
+                missing |= needed - set(action_class.get_indexes())
+
+        return missing
+
+    def _resolve_key(self, name, action=None, target=None, uid=None):
+        """
+        Returns the key to read ``name`` filtered by ``action`` and
+        ``target`` from, a cached key filtered on read when the indexes it
+        needs are not materialized, cached until the next write.
+        """
+        key = self._make_key(name, action=action, target=target, uid=uid)
+
+        missing = self._get_missing_indexes(name, action=action, target=target)
+
+        if not missing:
+            return key
+
+        version = self.client.get(get_version_key(self._make_key('private', uid=uid))) or 0
+
+        filtered_key = get_key(key, version, 'filtered')
+
+        if not self.client.exists(filtered_key):
+            # read the most specific materialized key and filter the rest
+            base_key = self._make_key('private' if 'public' in missing else name,
+                                      action=None if 'verb' in missing else action,
+                                      target=None if 'target' in missing else target,
+                                      uid=uid)
+
+            self._filter(base_key, filtered_key,
+                         uid=uid or manager.make_uid(self.instance),
+                         verb=self._get_verb(action) if 'verb' in missing else None,
+                         target_identifier=self._get_target_identifier(target) if 'target' in missing else None,
+                         public='public' in missing)
+
+        return filtered_key
+
+    def _filter(self, base_key, filtered_key, uid, verb=None, target_identifier=None, public=False):
+        members = self.client.zrevrange(base_key, 0, settings.TIMELINE_FILTER_LIMIT - 1, withscores=True)
+
+        summaries = load_summaries(self.client, self.storage.prefix, [member for member, score in members])
+
+        owner_identifier = None
+
+        if target_identifier:
+            if uid == manager.make_uid(self.instance):
+                owner_identifier = registry.get_identifier(self.instance)
+            else:
+                owner_identifier = manager.get_data_from_uid(uid).get('identifier')
+
+        matches = {}
+
+        for (member, score), summary in zip(members, summaries):
+            if summary is None:
+                continue
+
+            action_verb, actor_uid, target_uid, action_target_identifier = summary
+
+            if verb and action_verb != verb:
+                continue
+
+            if public and '%s' % actor_uid != '%s' % uid:
+                continue
+
+            # the timeline keys by target include the identifier of the owner
+            if target_identifier and target_identifier != owner_identifier:
+                if not target_uid or '%s' % target_uid == '%s' % actor_uid:
+                    continue
+
+                if action_target_identifier != target_identifier:
+                    continue
+
+            matches[member] = score
+
+        with self.client.map() as pipe:
+            pipe.delete(filtered_key)
+
+            if matches:
+                pipe.zadd(filtered_key, **matches)
+                pipe.expire(filtered_key, settings.TIMELINE_FILTER_CACHE_TIMEOUT)
 
     def _get_count(self, name, action=None, target=None):
+        if self._get_missing_indexes(name, action=action, target=target, counts=True):
+            return self.client.zcard(self._resolve_key(name, action=action, target=target))
+
         key = get_key(self._make_key(name, action=action, target=target), 'count')
 
         result = self.client.get(key)
@@ -82,12 +489,14 @@ class Timeline(object):
 
         return 0
 
-    def retrieve_instances(self, key, count, desc):
+    def retrieve_instances(self, key, count, desc, since=None, until=None, cursor=None):
         transformer = self.client.queryset_class(self.client,
                                                  count,
                                                  key=key,
                                                  prefix=self.storage.prefix)
         transformer.order_by(desc)
+        transformer.between(since=since, until=until)
+        transformer.after(cursor)
 
         return transformer
 
@@ -100,40 +509,360 @@ class Timeline(object):
 
         return get_key(*segments)
 
-    def mark_as_read(self, timestamp=None):
+    def _get_read_markers_key(self):
+        return get_key(self._get_read_key(), 'verbs')
+
+    def mark_as_read(self, timestamp=None, actions=None):
+        """
+        Marks the private timeline as read up to ``timestamp``, only for
+        ``actions`` when given.
+        """
+        self._wake()
+
         if timestamp is None:
             timestamp = datetime.now()
 
-        self.client.set(self._get_read_key(), to_timestamp(timestamp))
+        # the actions of the same millisecond are read along
+        timestamp = repr(get_max_score(to_timestamp(timestamp)))
+
+        if actions:
+            self.client.hmset(self._get_read_markers_key(),
+                              dict((self._get_verb(action), timestamp) for action in actions))
+        else:
+            self.client.set(self._get_read_key(), timestamp)
+
+    def _get_unread_counts(self, combinations):
+        keys = []
+        verbs = []
+
+        for verb, target in combinations:
+            key, merged = self._get_private_key(action=verb, target=target)
+
+            keys.append(key)
+            verbs.append(verb)
+
+        return self.client.unread_counts(self._get_read_key(),
+                                         self._get_read_markers_key(),
+                                         keys,
+                                         verbs,
+                                         repr(get_max_score(to_timestamp(datetime.now()))))
 
     def get_unread_count(self, action=None, target=None):
-        read_at = self.read_at or 0
+        return self._get_unread_counts([(self._get_verb(action), self._get_target_identifier(target))])[0]
+
+    def get_unread_counts(self, actions=None, targets=None):
+        """
+        Returns the unread counts of each of ``actions`` and ``targets`` in
+        one round trip, keyed by verb, by target identifier or by both.
+
+        The read markers of an action only apply to the counts by verb.
+        """
+        verbs = [self._get_verb(action) for action in actions or []]
+        target_identifiers = [self._get_target_identifier(target) for target in targets or []]
 
-        if read_at:
-            read_at = to_timestamp(read_at)
+        combinations = [(verb, target_identifier)
+                        for verb in verbs or [None]
+                        for target_identifier in target_identifiers or [None]]
 
-        key = self._make_key('private', action=action, target=target)
+        counts = self._get_unread_counts(combinations)
 
-        return self.client.zcount(key, read_at, to_timestamp(datetime.now()))
+        if not verbs:
+            return dict((target_identifier, count) for (verb, target_identifier), count in zip(combinations, counts))
+
+        if not target_identifiers:
+            return dict((verb, count) for (verb, target_identifier), count in zip(combinations, counts))
+
+        return dict(zip(combinations, counts))
 
     @property
     def read_at(self):
         result = self.client.get(self._get_read_key())
 
         if result:
-            return from_timestamp(float(result))
+            return from_timestamp(round(float(result), 3))
 
         return None
 
-    def get_private(self, action=None, target=None, desc=True):
-        key = self._make_key('private', action=action, target=target)
+    def _get_followed_pull_uids(self):
+        """
+        Returns the uids of the pull mode actors followed by the owner of
+        the timeline, cached as long as the merged private timelines, and
+        the version of its timelines.
+        """
+        from sequere.backends import get_backend
+        from sequere.backends.redis import RedisBackend
+
+        key = get_pull_followings_key(manager.make_uid(self.instance))
+
+        batch = Batch()
+
+        cached = batch.get(key)
+        count = batch.scard(get_pull_key())
+        version = batch.get(get_version_key(self._make_key('private')))
+
+        results = self.client.execute_batch(batch)
+
+        version = results[version] or 0
+
+        if not int(results[count] or 0):
+            return [], version
+
+        # the actors never leave pull mode, a new one changes the count
+        if results[cached]:
+            pull_count, uids = json.loads('%s' % results[cached])
+
+            if pull_count == int(results[count]):
+                return uids, version
+
+        uids = self.client.smembers(get_pull_key())
+
+        pull_count = len(uids)
+
+        uid = manager.make_uid(self.instance)
+
+        backend = get_backend()()
+
+        if isinstance(backend, RedisBackend):
+            uids = backend.filter_followings_uids(uid, uids)
+        else:
+            instances = [(pull_uid, manager.get_from_uid(pull_uid)) for pull_uid in uids]
+
+            uids = [pull_uid for pull_uid, instance in instances
+                    if instance is not None and backend.is_following(self.instance, instance)]
+
+        uids = ['%s' % pull_uid for pull_uid in uids]
+
+        with self.client.map() as pipe:
+            pipe.set(key, json.dumps([pull_count, uids]))
+            pipe.expire(key, settings.TIMELINE_PULL_CACHE_TIMEOUT)
+
+        return uids, version
+
+    def _get_followings_uids(self):
+        from sequere.backends import get_backend
+        from sequere.backends.redis import RedisBackend
+
+        backend = get_backend()()
+
+        if isinstance(backend, RedisBackend):
+            return backend.get_followings_uids(manager.make_uid(self.instance))
+
+        paginator = Paginator(backend.get_followings(self.instance), 100)
+
+        uids = []
+
+        for num_page in paginator.page_range:
+            uids += [manager.make_uid(obj) for obj, timestamp in paginator.page(num_page).object_list]
+
+        return uids
+
+    def rebuild(self, since=None):
+        """
+        Merges the recent actions of the public timelines of the followed
+        resources, newer than the timestamp ``since`` when given, in the
+        private timeline and returns the number of actions merged.
+        """
+        from .fanout import populate
+
+        uid = manager.make_uid(self.instance)
+
+        pull_uids = set()
+
+        # the actions of the pull mode actors are merged at read time
+        if settings.TIMELINE_PULL_THRESHOLD:
+            pull_uids = set('%s' % pull_uid for pull_uid in self.client.smembers(get_pull_key()))
+
+        return sum(populate(following_uid, uid, since=since)
+                   for following_uid in self._get_followings_uids()
+                   if '%s' % following_uid not in pull_uids)
+
+    def _wake(self):
+        """
+        Records the activity of the owner of the timeline and rebuilds the
+        private timeline of a dormant owner, whose followed resources have
+        skipped it meanwhile.
+        """
+        if not is_enabled():
+            return
+
+        self._wake_seen(get_seen_at(self.client, manager.make_uid(self.instance)))
+
+    def _wake_seen(self, seen_at):
+        if is_dormant(seen_at):
+            self.rebuild(since=seen_at)
+
+        touch(self.client, manager.make_uid(self.instance), seen_at=seen_at)
+
+    def _get_private_key(self, action=None, target=None):
+        """
+        Returns the key to read the private timeline from and whether it
+        merges the public timelines of the followed pull mode actors.
+        """
+        key = self._resolve_key('private', action=action, target=target)
+
+        if not settings.TIMELINE_PULL_THRESHOLD:
+            return key, False
+
+        uids, version = self._get_followed_pull_uids()
+
+        if not uids:
+            return key, False
+
+        # merged again after a write or a change of the followed actors
+        merged_key = get_key(key, 'pull', version)
+
+        if not self.client.exists(merged_key):
+            keys = [key] + [self._resolve_key('public', action=action, target=target, uid=uid)
+                            for uid in uids]
+
+            self.client.union(merged_key,
+                              keys,
+                              settings.TIMELINE_PULL_LIMIT,
+                              settings.TIMELINE_PULL_CACHE_TIMEOUT)
+
+        return merged_key, True
+
+    def _get_union_key(self, name, actions=None, targets=None):
+        """
+        Returns the key of the union of the timelines ``name`` filtered by
+        each of ``actions`` and ``targets``, cached until the next write.
+        """
+        verbs = sorted(set(self._get_verb(action) for action in actions or []))
+
+        target_identifiers = sorted(set(self._get_target_identifier(target) for target in targets or []))
 
-        return self.retrieve_instances(key, self.get_private_count(action=action, target=target), desc=desc)
+        version = self.client.get(get_version_key(self._make_key('private'))) or 0
 
-    def get_public(self, action=None, target=None, desc=True):
-        key = self._make_key('public', action=action, target=target)
+        segments = [self._make_key(name), 'union', version]
 
-        return self.retrieve_instances(key, self.get_public_count(action=action, target=target), desc=desc)
+        if verbs:
+            segments += ['verb', '+'.join(verbs)]
+
+        if target_identifiers:
+            segments += ['target', '+'.join(target_identifiers)]
+
+        union_key = get_key(*segments)
+
+        if not self.client.exists(union_key):
+            keys = []
+
+            for verb in verbs or [None]:
+                for target_identifier in target_identifiers or [None]:
+                    if name == 'private':
+                        key, merged = self._get_private_key(action=verb, target=target_identifier)
+                    else:
+                        key = self._resolve_key(name, action=verb, target=target_identifier)
+
+                    keys.append(key)
+
+            self.client.union(union_key,
+                              keys,
+                              settings.TIMELINE_UNION_LIMIT,
+                              settings.TIMELINE_UNION_CACHE_TIMEOUT)
+
+        return union_key
+
+    def get_private(self, action=None, target=None, desc=True, since=None, until=None, cursor=None,
+                    actions=None, targets=None):
+        self._wake()
+
+        if actions or targets:
+            key = self._get_union_key('private', actions=actions, targets=targets)
+
+            return self.retrieve_instances(key, self.client.zcard(key),
+                                           desc=desc,
+                                           since=since,
+                                           until=until,
+                                           cursor=cursor)
+
+        key, merged = self._get_private_key(action=action, target=target)
+
+        if merged:
+            count = self.client.zcard(key)
+        else:
+            count = self.get_private_count(action=action, target=target)
+
+        return self.retrieve_instances(key, count,
+                                       desc=desc,
+                                       since=since,
+                                       until=until,
+                                       cursor=cursor)
+
+    def get_public(self, action=None, target=None, desc=True, since=None, until=None, cursor=None,
+                   actions=None, targets=None):
+        if actions or targets:
+            key = self._get_union_key('public', actions=actions, targets=targets)
+
+            return self.retrieve_instances(key, self.client.zcard(key),
+                                           desc=desc,
+                                           since=since,
+                                           until=until,
+                                           cursor=cursor)
+
+        key = self._resolve_key('public', action=action, target=target)
+
+        return self.retrieve_instances(key, self.get_public_count(action=action, target=target),
+                                       desc=desc,
+                                       since=since,
+                                       until=until,
+                                       cursor=cursor)
+
+    @classmethod
+    def get_many(cls, instances, since=None, limit=20, batch_size=None):
+        """
+        Yields the ``(instance, actions)`` of the ``limit`` most recent
+        actions of the private timelines of ``instances`` newer than
+        ``since``, ``batch_size`` timelines per pipeline with the actions
+        shared by several timelines hydrated once per batch.
+        """
+        from .connection import storage, client
+
+        batch_size = batch_size or settings.TIMELINE_READ_BATCH_SIZE
+
+        minimum = '-inf'
+
+        if since is not None:
+            minimum = '(%r' % to_bound(since)[0]
+
+        instances = iter(instances)
+
+        while True:
+            chunk = list(islice(instances, batch_size))
+
+            if not chunk:
+                return
+
+            # the dormant owners have been skipped by the fan-outs meanwhile
+            if is_enabled():
+                seen_ats = get_many_seen_at(client, [manager.make_uid(instance) for instance in chunk])
+
+                for instance, seen_at in zip(chunk, seen_ats):
+                    cls(instance)._wake_seen(seen_at)
+
+            batch = Batch()
+
+            indexes = [batch.zrevrangebyscore(cls(instance)._get_private_key()[0], '+inf', minimum,
+                                              start=0,
+                                              num=limit,
+                                              withscores=True)
+                       for instance in chunk]
+
+            results = client.execute_batch(batch)
+
+            scores = {}
+
+            for index in indexes:
+                for uid, score in results[index]:
+                    scores.setdefault('%s' % uid, score)
+
+            transformer = client.queryset_class(client, len(scores), key=None, prefix=storage.prefix)
+
+            actions = dict(('%s' % action.uid, action)
+                           for action in transformer._transform(list(scores.items())))
+
+            for instance, index in zip(chunk, indexes):
+                yield instance, [actions['%s' % uid] for uid, score in results[index]
+                                 if '%s' % uid in actions]
 
     def get_private_count(self, action=None, target=None, desc=True):
         return self._get_count('private', action=action, target=target)
@@ -142,27 +871,23 @@ class Timeline(object):
         return self._get_count('public', action=action, target=target)
 
     def _save(self, action):
-        with self.client.map() as pipe:
-            for key in self._get_keys(action):
-                pipe.incr(get_key(key, 'count'))
-                pipe.incr(get_key(key, 'verb', action.verb, 'count'))
+        batch = Batch()
 
-                pipe.zadd(key, **{
-                    '%s' % action.uid: action.timestamp
-                })
+        references, trims = add_to_keys(batch, self._get_keys(action), action.uid, action.verb,
+                                        get_score(action.timestamp, action.uid),
+                                        max_length=self.max_length,
+                                        max_age=self.max_age,
+                                        indexes=action.get_indexes())
 
-                pipe.zadd(get_key(key, 'verb', action.verb), **{
-                    '%s' % action.uid: action.timestamp
-                })
+        apply_changes(self.client, self.client.execute_batch(batch), trims=trims, references=references)
 
     def _delete(self, action):
-        with self.client.map() as pipe:
-            for key in self._get_keys(action):
-                pipe.decr(get_key(key, 'count'))
-                pipe.decr(get_key(key, 'verb', action.verb, 'count'))
+        batch = Batch()
+
+        references = remove_from_keys(batch, self._get_keys(action), action.uid, action.verb,
+                                      indexes=action.get_indexes())
 
-                pipe.zrem(key, '%s' % action.uid)
-                pipe.zrem(get_key(key, 'verb', action.verb), '%s' % action.uid)
+        apply_changes(self.client, self.client.execute_batch(batch), references=references)
 
     def delete(self, action, dispatch=True):
         origin = action.__class__
@@ -179,9 +904,63 @@ class Timeline(object):
                                      instance=self.instance,
                                      action=action)
 
+    def retract(self, action, dispatch=True):
+        """
+        Deletes ``action`` from the timeline and from the private timelines
+        of the followers of its actor in a background job, then deletes the
+        stored action.
+
+        An aggregated action only leaves the aggregate of its group while
+        the group is open, the aggregate is retracted with its last actor.
+        """
+        from sequere.models import get_followers_count
+
+        from .fanout import get_fanout_queue, FanoutQueue
+
+        self.delete(action, dispatch=dispatch)
+
+        data = action.format_data()
+        data['uid'] = action.uid
+
+        if is_aggregated(action):
+            uid = remove_actor(self.storage, self.client, action)
+
+            delete_action(action.uid)
+
+            if uid is None:
+                return
+
+            data['uid'] = uid
+
+        queue = FanoutQueue(get_fanout_queue(get_followers_count(self.instance)))
+
+        queue.signature(retract_action, (action.actor_uid, data), {'dispatch': dispatch}).apply_async()
+
+    def _use_pull_mode(self, followers_count):
+        threshold = settings.TIMELINE_PULL_THRESHOLD
+
+        if not threshold:
+            return False
+
+        uid = manager.make_uid(self.instance)
+
+        if is_pull_uid(uid):
+            return True
+
+        if followers_count < threshold:
+            return False
+
+        # once pulled, the older actions are missing from the private
+        # timelines of the followers so the actor never goes back to push
+        self.client.sadd(get_pull_key(), '%s' % uid)
+
+        return True
+
     def save(self, action, dispatch=True):
         from sequere.models import get_followers_count
 
+        from .fanout import get_fanout_queue, FanoutQueue
+
         origin = action.__class__
 
         if dispatch:
@@ -192,14 +971,28 @@ class Timeline(object):
         data = action.format_data()
 
         if action.uid is None:
-            uid = self.storage.make_uid(data)
+            uid = store_action(self.storage, action, data)
 
             action.uid = uid
 
         self._save(action)
 
-        if action.actor == self.instance and get_followers_count(self.instance) > 0:
-            dispatch_action.delay(action.actor_uid, data, dispatch=dispatch)
+        if action.actor == self.instance:
+            count = get_followers_count(self.instance)
+
+            if count > 0 and not self._use_pull_mode(count):
+                if is_aggregated(action):
+                    data = aggregate(self.storage, self.client, action)
+
+                queue = get_fanout_queue(count)
+
+                if settings.TIMELINE_FANOUT_COALESCE_WINDOW:
+                    coalesce_action(action.actor_uid, data, dispatch=dispatch, queue=queue)
+                elif settings.TIMELINE_FANOUT_STREAM:
+                    publish(action.actor_uid, data, dispatch=dispatch)
+                else:
+                    FanoutQueue(queue).signature(dispatch_action, (action.actor_uid, data),
+                                                 {'dispatch': dispatch}).apply_async()
 
         if dispatch:
             signals.post_save.send(sender=origin,
@@ -1,3 +1,7 @@
+import heapq
+from collections import defaultdict
+from itertools import chain
+
 from .query import RedisTimelineQuerySetTransformer, NydusTimelineQuerySetTransformer
 
 
@@ -24,6 +28,53 @@ class Wrapper(object):
         return CallProxy(self.client, name)
 
 
+# counts the members of the sorted sets KEYS[3:] more recent than the
+# read marker KEYS[1], or the marker of their verb in the hash KEYS[2], the
+# scores are kept as strings to keep their precision
+UNREAD_COUNTS_SCRIPT = """
+local read_at = redis.call('GET', KEYS[1]) or '0'
+local now = ARGV[1]
+local counts = {}
+
+for i = 3, #KEYS do
+    local since = read_at
+    local verb = ARGV[i - 1]
+
+    if verb ~= '' then
+        local marker = redis.call('HGET', KEYS[2], verb)
+
+        if marker and tonumber(marker) > tonumber(since) then
+            since = marker
+        end
+    end
+
+    counts[#counts + 1] = redis.call('ZCOUNT', KEYS[i], '(' .. since, now)
+end
+
+return counts
+"""
+
+
+class Batch(object):
+    """
+    Records commands to send them in a single round trip with
+    ``execute_batch``, each call returns the index of its result.
+    """
+    def __init__(self):
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+
+            return len(self.commands) - 1
+
+        return command
+
+    def __len__(self):
+        return len(self.commands)
+
+
 class PipelineContextManager(object):
     def __init__(self, pipeline, *args, **kwargs):
         self.pipeline = pipeline
@@ -41,6 +92,111 @@ class RedisWrapper(Wrapper):
     def map(self, *args, **kwargs):
         return PipelineContextManager(self.client.pipeline(), *args, **kwargs)
 
+    def execute_batch(self, batch):
+        pipe = self.client.pipeline()
+
+        for name, args, kwargs in batch.commands:
+            getattr(pipe, name)(*args, **kwargs)
+
+        return pipe.execute()
+
+    def connections(self):
+        return [self.client]
+
+    def connection_for(self, key):
+        return self.client
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+
+        return self.client.mget(keys)
+
+    def scan_iter(self, match, count=None):
+        return self.client.scan_iter(match=match, count=count)
+
+    def unread_counts(self, read_key, markers_key, keys, verbs, now):
+        script = self.client.register_script(UNREAD_COUNTS_SCRIPT)
+
+        return script(keys=[read_key, markers_key] + keys,
+                      args=[now] + [verb or '' for verb in verbs])
+
+    def union(self, dest, keys, limit, timeout):
+        """
+        Stores in ``dest`` the ``limit`` most recent members of the sorted
+        sets ``keys`` and expires it after ``timeout`` seconds.
+        """
+        with self.map() as pipe:
+            pipe.zunionstore(dest, keys, aggregate='MAX')
+            pipe.zremrangebyrank(dest, 0, -(limit + 1))
+            pipe.expire(dest, timeout)
+
 
 class NydusWrapper(Wrapper):
     queryset_class = NydusTimelineQuerySetTransformer
+
+    def execute_batch(self, batch):
+        with self.map() as conn:
+            results = [getattr(conn, name)(*args, **kwargs)
+                       for name, args, kwargs in batch.commands]
+
+        return results
+
+    def connections(self):
+        return [host.connection for host in self.client.hosts.values()]
+
+    def connection_for(self, key):
+        return self.client.get_conn(key).connection
+
+    def get_many(self, keys):
+        # MGET cannot be routed, send one per host
+        host_keys = defaultdict(list)
+
+        for key in keys:
+            host_keys[self.client.get_conn(key)].append(key)
+
+        values = {}
+
+        for host, keys_for_host in host_keys.items():
+            values.update(zip(keys_for_host, host.connection.mget(keys_for_host)))
+
+        return [values[key] for key in keys]
+
+    def scan_iter(self, match, count=None):
+        for connection in self.connections():
+            for key in connection.scan_iter(match=match, count=count):
+                yield key
+
+    def unread_counts(self, read_key, markers_key, keys, verbs, now):
+        # keys are spread across the cluster, read the markers first
+        with self.map() as pipe:
+            read_at = pipe.get(read_key)
+            markers = pipe.hgetall(markers_key)
+
+        read_at = float(read_at or 0)
+
+        with self.map() as pipe:
+            results = [pipe.zcount(key, '(%r' % max(read_at, float(markers.get(verb) or 0) if verb else 0), now)
+                       for key, verb in zip(keys, verbs)]
+
+        return [int(result) for result in results]
+
+    def union(self, dest, keys, limit, timeout):
+        # keys are spread across the cluster, merge them client side
+        with self.map() as pipe:
+            results = [pipe.zrevrange(key, 0, limit - 1, withscores=True)
+                       for key in keys]
+
+        members = {}
+
+        for member, score in chain(*results):
+            members[member] = max(score, members.get(member, score))
+
+        members = heapq.nlargest(limit, members.items(), key=lambda item: item[1])
+
+        with self.map() as pipe:
+            pipe.delete(dest)
+
+            if members:
+                pipe.zadd(dest, **dict(members))
+                pipe.expire(dest, timeout)
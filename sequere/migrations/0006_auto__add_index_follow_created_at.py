@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding index on 'Follow', fields ['from_identifier', 'from_object_id', 'created_at']
+        db.create_index(u'sequere_follow', ['from_identifier', 'from_object_id', 'created_at'])
+
+        # Adding index on 'Follow', fields ['to_identifier', 'to_object_id', 'created_at']
+        db.create_index(u'sequere_follow', ['to_identifier', 'to_object_id', 'created_at'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'Follow', fields ['to_identifier', 'to_object_id', 'created_at']
+        db.delete_index(u'sequere_follow', ['to_identifier', 'to_object_id', 'created_at'])
+
+        # Removing index on 'Follow', fields ['from_identifier', 'from_object_id', 'created_at']
+        db.delete_index(u'sequere_follow', ['from_identifier', 'from_object_id', 'created_at'])
+
+
+    models = {
+        'sequere.follow': {
+            'Meta': {'ordering': "['-created_at']", 'object_name': 'Follow', 'index_together': "[['from_identifier', 'from_object_id', 'created_at'], ['to_identifier', 'to_object_id', 'created_at']]"},
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'from_identifier': ('django.db.models.fields.CharField', [], {'max_length': '50', 'db_index': 'True'}),
+            'from_object_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_mutual': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'to_identifier': ('django.db.models.fields.CharField', [], {'max_length': '50', 'db_index': 'True'}),
+            'to_object_id': ('django.db.models.fields.PositiveIntegerField', [], {})
+        }
+    }
+
+    complete_apps = ['sequere']
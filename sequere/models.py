@@ -27,6 +27,14 @@ def get_followers_count(instance, *args, **kwargs):
     return get_backend()().get_followers_count(instance, *args, **kwargs)
 
 
+def get_followings_counts(instances, *args, **kwargs):
+    return get_backend()().get_followings_counts(instances, *args, **kwargs)
+
+
+def get_followers_counts(instances, *args, **kwargs):
+    return get_backend()().get_followers_counts(instances, *args, **kwargs)
+
+
 def get_followers(instance, *args, **kwargs):
     return get_backend()().get_followers(instance, *args, **kwargs)
 
@@ -39,6 +47,14 @@ def get_friends(instance, *args, **kwargs):
     return get_backend()().get_friends(instance, *args, **kwargs)
 
 
+def annotate_follow_state(qs, *args, **kwargs):
+    return get_backend()().annotate_follow_state(qs, *args, **kwargs)
+
+
+def annotate_counts(qs, *args, **kwargs):
+    return get_backend()().annotate_counts(qs, *args, **kwargs)
+
+
 if django.VERSION < (1, 7):
     from . import autodiscover
     autodiscover()
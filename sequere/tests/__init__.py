@@ -38,6 +38,21 @@ class FixturesMixin(Exam):
     def project(self):
         return Project.objects.create(name='My super project')
 
+    @fixture
+    def followers(self):
+        from ..compat import User
+        from ..models import follow
+
+        followers = [User.objects.create_user(username='follower%d' % i,
+                                              email='follower%d@ulule.com' % i,
+                                              password='$ecret')
+                     for i in range(3)]
+
+        for follower in followers:
+            follow(follower, self.user)
+
+        return followers
+
 
 class BaseBackendTests(FixturesMixin):
     def test_follow(self):
@@ -119,6 +134,22 @@ class BaseBackendTests(FixturesMixin):
 
         self.assertIn(self.user, dict(qs.all()))
 
+    def test_get_followers_counts(self):
+        from ..models import follow, get_followers_counts, get_followings_counts
+
+        follow(self.user, self.project)
+        follow(self.newbie, self.project)
+
+        self.assertEqual(get_followers_counts([self.project, self.user]), {
+            self.project: 2,
+            self.user: 0,
+        })
+
+        self.assertEqual(get_followings_counts([self.user, self.newbie], identifier=registry.get_identifier(self.project)), {
+            self.user: 1,
+            self.newbie: 1,
+        })
+
     def test_get_followings(self):
         from ..models import follow, get_followings
 
@@ -190,8 +221,35 @@ class BaseBackendTests(FixturesMixin):
         self.assertEqual(content['%s_followings_count' % identifier], 0)
 
 
+class AnnotateTestsMixin(object):
+    def test_annotate(self):
+        from ..compat import User
+        from ..models import follow
+        from .. import annotate_follow_state, annotate_counts
+
+        follow(self.newbie, self.user)
+        follow(self.newbie, self.project)
+        follow(self.user, self.newbie)
+        follow(self.project, self.newbie)
+
+        qs = annotate_counts(annotate_follow_state(User.objects.order_by('pk'), self.newbie),
+                             kinds=('followers', 'followings', 'friends'))
+
+        results = dict((user, (user.is_followed_by_viewer, user.followers_count,
+                               user.followings_count, user.friends_count))
+                       for user in qs)
+
+        self.assertEqual(results[self.user], (1, 1, 1, 1))
+        self.assertEqual(results[self.newbie], (0, 2, 2, 2))
+
+        qs = annotate_counts(Project.objects.all(), kinds=('followers', ),
+                             identifier=registry.get_identifier(self.user))
+
+        self.assertEqual(qs.get().followers_count, 1)
+
+
 @override_settings(SEQUERE_BACKEND_CLASS='sequere.backends.database.DatabaseBackend')
-class DatabaseBackendTests(BaseBackendTests, TestCase):
+class DatabaseBackendTests(AnnotateTestsMixin, BaseBackendTests, TestCase):
     def setUp(self):
         super(DatabaseBackendTests, self).setUp()
 
@@ -207,6 +265,233 @@ class DatabaseBackendTests(BaseBackendTests, TestCase):
         self.assertEqual(instance.to_instance, self.project)
         self.assertEqual(instance.from_instance, self.user)
 
+    def test_prefetch_instances(self):
+        from ..models import follow
+
+        follow(self.user, self.project)
+        follow(self.newbie, self.project)
+        follow(self.user, self.newbie)
+
+        with self.assertNumQueries(3):
+            follows = list(Follow.objects.prefetch_instances())
+
+            self.assertEqual(set((f.from_instance, f.to_instance) for f in follows),
+                             set([(self.user, self.project),
+                                  (self.newbie, self.project),
+                                  (self.user, self.newbie)]))
+
+        # one query per identifier for each chunk of rows
+        with self.assertNumQueries(5):
+            follows = list(Follow.objects.prefetch_instances(chunk_size=2))
+
+            self.assertEqual(len([f.to_instance for f in follows]), 3)
+
+        # the prefetch is kept by the querysets chained afterwards
+        with self.assertNumQueries(3):
+            follows = list(Follow.objects.prefetch_instances().to_instance(self.project))
+
+            self.assertEqual(set((f.from_instance, f.to_instance) for f in follows),
+                             set([(self.user, self.project),
+                                  (self.newbie, self.project)]))
+
+    def test_get_followers_keyset(self):
+        from ..compat import User
+        from ..models import follow, get_followers
+
+        users = [User.objects.create_user(username='user%d' % i,
+                                          email='user%d@ulule.com' % i,
+                                          password='$ecret')
+                 for i in range(5)]
+
+        now = datetime.now()
+
+        for i, user in enumerate(users):
+            follow(user, self.project)
+
+            # same date for the first two follows to exercise the id tiebreak
+            Follow.objects.from_instance(user).update(created_at=now + timedelta(minutes=max(i, 1)))
+
+        qs = get_followers(self.project)
+
+        self.assertEqual([user for user, created_at in qs[0:3]], users[::-1][:3])
+
+        cursor = qs.last_cursor
+
+        qs = get_followers(self.project).after(cursor)
+
+        self.assertEqual([user for user, created_at in qs[0:3]], users[::-1][3:])
+
+        qs = get_followers(self.project, desc=False)
+
+        self.assertEqual([user for user, created_at in qs.all()], users)
+
+    def test_follow_signals(self):
+        from django.db.models.signals import post_save, post_delete
+
+        from ..models import follow, unfollow
+
+        sent = []
+
+        def receiver(sender, instance, signal, **kwargs):
+            sent.append((signal, instance.from_instance, instance.to_instance))
+
+        post_save.connect(receiver, sender=Follow)
+        post_delete.connect(receiver, sender=Follow)
+
+        try:
+            follow(self.user, self.project)
+            unfollow(self.user, self.project)
+        finally:
+            post_save.disconnect(receiver, sender=Follow)
+            post_delete.disconnect(receiver, sender=Follow)
+
+        self.assertEqual(sent, [(post_save, self.user, self.project),
+                                (post_delete, self.user, self.project)])
+
+    def test_follow_mutual(self):
+        from ..models import follow, unfollow
+
+        follow(self.user, self.project)
+        follow(self.user, self.project)
+
+        self.assertEqual(Follow.objects.from_instance(self.user).count(), 1)
+        self.assertFalse(Follow.objects.filter(is_mutual=True).exists())
+
+        follow(self.project, self.user)
+
+        self.assertEqual(Follow.objects.filter(is_mutual=True).count(), 2)
+
+        unfollow(self.user, self.project)
+
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertFalse(Follow.objects.filter(is_mutual=True).exists())
+
+
+@override_settings(SEQUERE_BACKEND_CLASS='sequere.backends.database.sharding.ShardedDatabaseBackend',
+                   SEQUERE_DATABASE_SHARDS=['default', 'shard'],
+                   SEQUERE_DATABASE_SHARD_WORKERS=1)
+class ShardedDatabaseBackendTests(AnnotateTestsMixin, BaseBackendTests, TestCase):
+    multi_db = True
+
+    def setUp(self):
+        super(ShardedDatabaseBackendTests, self).setUp()
+
+        from sequere.backends.database import settings as database_settings
+
+        reload(settings)
+        reload(database_settings)
+
+    def test_edges_per_shard(self):
+        from ..models import follow, get_followers_counts
+        from ..backends.database.sharding import ShardedDatabaseBackend
+
+        backend = ShardedDatabaseBackend()
+
+        follow(self.user, self.project)
+        follow(self.newbie, self.project)
+        follow(self.user, self.newbie)
+
+        for from_instance, to_instance in ((self.user, self.project),
+                                           (self.newbie, self.project),
+                                           (self.user, self.newbie)):
+            shards = set([backend.get_shard(from_instance), backend.get_shard(to_instance)])
+
+            for using in ('default', 'shard'):
+                qs = Follow.objects.using(using).from_instance(from_instance).to_instance(to_instance)
+
+                self.assertEqual(qs.count(), int(using in shards))
+
+        self.assertEqual(get_followers_counts([self.project, self.user, self.newbie]), {
+            self.project: 2,
+            self.user: 0,
+            self.newbie: 1,
+        })
+
+    def test_one_sided_edges(self):
+        from mock import patch
+
+        from django.db import DatabaseError
+
+        from ..models import follow, unfollow, is_following
+        from ..backends.database.models import FollowManager
+        from ..backends.database.sharding import ShardedDatabaseBackend
+
+        backend = ShardedDatabaseBackend()
+
+        from_instance, to_instance = [(from_instance, to_instance)
+                                      for from_instance, to_instance in ((self.user, self.project),
+                                                                         (self.newbie, self.project),
+                                                                         (self.user, self.newbie))
+                                      if len(backend.get_edge_shards(from_instance, to_instance)) > 1][0]
+
+        using = backend.get_edge_shards(from_instance, to_instance)[1]
+
+        def failing(method):
+            def wrapper(manager, *args, **kwargs):
+                if manager._db == using:
+                    raise DatabaseError('%s is down' % using)
+
+                return method(manager, *args, **kwargs)
+
+            return wrapper
+
+        # the first shard written is rolled back when the second one fails
+        with patch.object(FollowManager, 'create_follow', failing(FollowManager.create_follow.__func__)):
+            self.assertRaises(DatabaseError, follow, from_instance, to_instance)
+
+        self.assertEqual(Follow.objects.using('default').count() + Follow.objects.using('shard').count(), 0)
+
+        follow(from_instance, to_instance)
+
+        with patch.object(FollowManager, 'delete_follow', failing(FollowManager.delete_follow.__func__)):
+            self.assertRaises(DatabaseError, unfollow, from_instance, to_instance)
+
+        self.assertTrue(is_following(from_instance, to_instance))
+        self.assertEqual(Follow.objects.using(using).from_instance(from_instance).count(), 1)
+
+    def test_concurrent_shards(self):
+        from mock import patch
+        from multiprocessing.pool import ThreadPool
+
+        from django.db import connections
+
+        from ..models import follow, get_followers_counts
+        from ..backends.database import settings as database_settings
+        from ..backends.database import sharding
+
+        follow(self.user, self.project)
+        follow(self.newbie, self.project)
+        follow(self.user, self.newbie)
+
+        # the in memory test databases are only reachable by the threads
+        # sharing the connections of the test case
+        shared = dict((using, connections[using]) for using in ('default', 'shard'))
+
+        def share():
+            for using, connection in shared.items():
+                connection.allow_thread_sharing = True
+                connections[using] = connection
+
+        class SharedThreadPool(ThreadPool):
+            def __init__(self, processes):
+                super(SharedThreadPool, self).__init__(processes, initializer=share)
+
+        try:
+            with patch.object(database_settings, 'SHARD_WORKERS', 2), \
+                    patch.object(sharding, 'ThreadPool', SharedThreadPool), \
+                    patch.object(sharding, '_run', side_effect=sharding._run) as run:
+                self.assertEqual(get_followers_counts([self.project, self.user, self.newbie]), {
+                    self.project: 2,
+                    self.user: 0,
+                    self.newbie: 1,
+                })
+
+            self.assertEqual(sorted(args[0][1] for args, kwargs in run.call_args_list),
+                             ['default', 'shard'])
+        finally:
+            for connection in shared.values():
+                connection.allow_thread_sharing = False
+
 
 @override_settings(SEQUERE_BACKEND_CLASS='sequere.backends.redis.RedisBackend')
 class RedisBackendTests(BaseBackendTests, TestCase):
@@ -219,6 +504,13 @@ class RedisBackendTests(BaseBackendTests, TestCase):
 
         client.flushdb()
 
+    def test_annotate(self):
+        from ..compat import User
+        from .. import annotate_follow_state, annotate_counts
+
+        self.assertRaises(NotImplementedError, annotate_follow_state, User.objects.all(), self.newbie)
+        self.assertRaises(NotImplementedError, annotate_counts, User.objects.all(), kinds=('followers', ))
+
 
 @override_settings(SEQUERE_BACKEND_CLASS='sequere.backends.redis.RedisBackend')
 class TimelineTests(FixturesMixin, TestCase):
@@ -278,6 +570,36 @@ class TimelineTests(FixturesMixin, TestCase):
 
         self.assertTrue(timeline.read_at is not None)
 
+    def test_unread_counts(self):
+        from ..models import follow
+        from .sequere_registry import JoinAction, LikeAction, Project, User
+        from sequere.contrib.timeline import Timeline
+
+        follow(self.newbie, self.user)
+
+        date = datetime.now() - timedelta(days=2)
+
+        timeline = Timeline(self.user)
+        timeline.save(JoinAction(self.user, date=date))
+        timeline.save(LikeAction(actor=self.user, target=self.project, date=date))
+
+        timeline = Timeline(self.newbie)
+
+        self.assertEqual(timeline.get_unread_counts(actions=[JoinAction, 'like']), {'join': 1, 'like': 1})
+
+        timeline.mark_as_read(timestamp=datetime.now() - timedelta(days=1), actions=[LikeAction])
+
+        self.assertEqual(timeline.get_unread_counts(actions=['join', 'like']), {'join': 1, 'like': 0})
+        self.assertEqual(timeline.get_unread_count(action='like'), 0)
+        self.assertEqual(timeline.get_unread_count(), 2)
+
+        self.assertEqual(timeline.get_unread_counts(targets=[Project, User]), {'projet': 1, 'user': 2})
+        self.assertEqual(timeline.get_unread_counts(actions=['like'], targets=[Project]), {('like', 'projet'): 0})
+
+        timeline.mark_as_read()
+
+        self.assertEqual(timeline.get_unread_counts(actions=['join', 'like']), {'join': 0, 'like': 0})
+
     def test_dispatch_action(self):
         from ..models import (follow, unfollow)
         from .sequere_registry import JoinAction, LikeAction, Project
@@ -320,16 +642,1081 @@ class TimelineTests(FixturesMixin, TestCase):
 
         self.assertEqual(timeline.get_public_count(), 0)
 
-    def test_get_actions(self):
+    def test_fanout(self):
+        from ..models import follow
+        from .sequere_registry import LikeAction, Project
+        from sequere.contrib.timeline import Timeline
+        from sequere.contrib.timeline.fanout import fanout
+
+        followers = self.followers
+
+        follow(self.project, self.user)
+
+        action = LikeAction(actor=self.user, target=self.project)
+
+        Timeline(self.user).save(action)
+
+        for follower in followers + [self.project]:
+            timeline = Timeline(follower)
+
+            self.assertEqual(timeline.get_private_count(), 1)
+            self.assertEqual(timeline.get_private_count(target=Project), 1)
+            self.assertEqual(timeline.get_public_count(), 0)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(fanout(action.actor_uid, action.data, batch_size=2), 4)
+
+    def test_partitioned_fanout(self):
+        from mock import patch
+
+        from .sequere_registry import JoinAction
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.fanout import get_partitions, FanoutProgress
+
+        followers = self.followers
+
+        from sequere.backends.redis.connection import manager
+
+        uid = manager.make_uid(self.user)
+
+        self.assertEqual(get_partitions(uid, 2), [('user', 0, 2), ('user', 2, 3)])
+
+        action = JoinAction(self.user)
+
+        with patch.multiple(timeline_settings,
+                            TIMELINE_FANOUT_PARTITION_THRESHOLD=2,
+                            TIMELINE_FANOUT_PARTITION_SIZE=2):
+            with patch.object(FanoutProgress, 'clear', autospec=True, side_effect=FanoutProgress.clear) as clear:
+                Timeline(self.user).save(action)
+
+            self.assertEqual(clear.call_count, 2)
+
+        for follower in followers:
+            self.assertEqual(Timeline(follower).get_private_count(), 1)
+
+        for identifier, start, stop in get_partitions(uid, 2):
+            self.assertEqual(FanoutProgress(action.uid, identifier, start).get(), None)
+
+    def test_coalesced_fanout(self):
+        from mock import patch
+
+        from ..models import follow
         from .sequere_registry import JoinAction, LikeAction
-        from sequere.contrib.timeline import get_actions
+        from sequere.backends.redis.connection import manager
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.collector import collect
+        from sequere.contrib.timeline.fanout import FanoutQueue, FanoutBuffer
+        from sequere.contrib.timeline.references import get_action_key
+        from sequere.contrib.timeline.tasks import dispatch_buffered_actions
 
-        actions = get_actions()
+        follow(self.newbie, self.user)
 
-        self.assertEqual(dict(actions), {
-            'join': JoinAction,
-            'like': LikeAction
-        })
+        timeline = Timeline(self.user)
+
+        with patch.object(timeline_settings, 'TIMELINE_FANOUT_COALESCE_WINDOW', 5):
+            with patch.object(FanoutQueue, 'signature') as signature:
+                timeline.save(JoinAction(self.user))
+                timeline.save(LikeAction(actor=self.user, target=self.project))
+                timeline.save(LikeAction(actor=self.user, target=self.newbie))
+
+            # one fan-out is scheduled for the whole window
+            self.assertEqual(signature.call_count, 1)
+            self.assertEqual(signature.call_args[1], {'countdown': 5})
+
+        newbie_timeline = Timeline(self.newbie)
+
+        self.assertEqual(newbie_timeline.get_private_count(), 0)
+
+        with patch.object(timeline.client, 'execute_batch', wraps=timeline.client.execute_batch) as execute_batch:
+            self.assertEqual(dispatch_buffered_actions(manager.make_uid(self.user)), 1)
+
+            self.assertEqual(execute_batch.call_count, 1)
+
+        self.assertEqual(newbie_timeline.get_private_count(), 3)
+        self.assertEqual(newbie_timeline.get_private_count(action=LikeAction), 2)
+        self.assertEqual([action.verb for action in newbie_timeline.get_private().all()],
+                         [action.verb for action in timeline.get_public().all()])
+
+        # the buffer is empty
+        self.assertEqual(dispatch_buffered_actions(manager.make_uid(self.user)), 0)
+
+        join = newbie_timeline.get_private(action=JoinAction).all()[0]
+
+        refs = int(timeline.client.hget(get_action_key(join.uid), 'refs'))
+
+        like = LikeAction(actor=self.user, target=self.project)
+
+        with patch.object(timeline_settings, 'TIMELINE_FANOUT_COALESCE_WINDOW', 5):
+            with patch.object(FanoutQueue, 'signature'):
+                timeline.save(like)
+
+        data = join.format_data()
+        data['uid'] = join.uid
+
+        FanoutBuffer(manager.make_uid(self.user)).push(data)
+
+        # an action already stored is coalesced with a new one
+        self.assertEqual(dispatch_buffered_actions(manager.make_uid(self.user)), 1)
+
+        self.assertEqual(int(timeline.client.hget(get_action_key(join.uid), 'refs')), refs)
+
+        for action in (join, like):
+            timeline.delete(action)
+            newbie_timeline.delete(action)
+
+            self.assertEqual(int(timeline.client.hget(get_action_key(action.uid), 'refs')), 0)
+
+        count, size = collect()
+
+        self.assertEqual(count, 2)
+
+        self.assertFalse(timeline.client.exists(get_action_key(join.uid)))
+        self.assertFalse(timeline.client.exists(get_action_key(like.uid)))
+
+    def test_fanout_queues(self):
+        import time
+
+        from mock import patch
+
+        from .sequere_registry import JoinAction
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.fanout import get_fanout_queue, FanoutQueue
+
+        followers = self.followers
+
+        with patch.multiple(timeline_settings,
+                            TIMELINE_FANOUT_QUEUES=((0, 'timeline'), (3, 'timeline_large')),
+                            TIMELINE_FANOUT_PARTITION_THRESHOLD=2,
+                            TIMELINE_FANOUT_PARTITION_SIZE=3,
+                            TIMELINE_FANOUT_BATCH_SIZE=1,
+                            TIMELINE_FANOUT_TIME_SLICE=0.000001,
+                            TIMELINE_FANOUT_MAX_LAG=10):
+            self.assertEqual(get_fanout_queue(2), 'timeline')
+            self.assertEqual(get_fanout_queue(3), 'timeline_large')
+
+            queue = FanoutQueue('timeline_large')
+
+            # a task enqueued a minute ago is still waiting
+            queue.client.zadd(queue.key, waiting=time.time() - 60)
+
+            self.assertTrue(queue.get_lag() >= 60)
+
+            with patch.object(FanoutQueue, 'signature', autospec=True, side_effect=FanoutQueue.signature) as signature:
+                Timeline(self.user).save(JoinAction(self.user))
+
+            queues = [call[0][0].name for call in signature.call_args_list]
+
+            # the partition is cut in slices of one batch re-enqueued after each other
+            self.assertEqual(queues, ['timeline_large'] * 4)
+
+            # the new large fan-out is delayed by the lag of its queue
+            self.assertTrue(signature.call_args_list[1][1]['countdown'] >= 60)
+
+            # the tasks are not waiting anymore
+            self.assertEqual(queue.client.zrange(queue.key, 0, -1), ['waiting'])
+
+        for follower in followers:
+            self.assertEqual(Timeline(follower).get_private_count(), 1)
+
+    def test_stream_worker(self):
+        from mock import patch
+
+        from ..models import follow
+        from .sequere_registry import JoinAction, LikeAction
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.streams import StreamWorker
+
+        follow(self.newbie, self.user)
+
+        timeline = Timeline(self.user)
+
+        with patch.object(timeline_settings, 'TIMELINE_FANOUT_STREAM', True):
+            worker = StreamWorker('test', concurrency=2, claim_timeout=0, max_deliveries=2)
+
+            timeline.save(JoinAction(self.user))
+            timeline.save(LikeAction(actor=self.user, target=self.project))
+
+            newbie_timeline = Timeline(self.newbie)
+
+            self.assertEqual(newbie_timeline.get_private_count(), 0)
+
+            with patch('sequere.contrib.timeline.fanout.fanout_many', side_effect=ValueError):
+                self.assertEqual(worker.run_once(), 0)
+
+            closed = []
+
+            class Connection(object):
+                def close(self):
+                    closed.append(self)
+
+            class Connections(object):
+                def all(self):
+                    return [Connection()]
+
+            # the failed fan-outs are claimed again
+            with patch('sequere.contrib.timeline.streams.connections', Connections()):
+                self.assertEqual(worker.run_once(), 2)
+
+            # and the connections opened by their threads closed
+            self.assertEqual(len(closed), 2)
+
+            self.assertEqual(newbie_timeline.get_private_count(), 2)
+
+            timeline.save(LikeAction(actor=self.user, target=self.newbie))
+
+            with patch('sequere.contrib.timeline.fanout.fanout_many', side_effect=ValueError):
+                worker.run_once()
+                worker.run_once()
+
+            # until they are given up
+            self.assertEqual(worker.run_once(), 0)
+
+            metrics = worker.get_metrics()
+
+            worker.close()
+
+        self.assertEqual(metrics['processed'], 2)
+        self.assertEqual(metrics['failed'], 4)
+        self.assertEqual(metrics['claimed'], 3)
+        self.assertEqual(metrics['dead'], 1)
+        self.assertEqual(metrics['pending'], 0)
+
+        self.assertEqual(worker.connection.execute_command('XLEN', worker.dead_key), 1)
+
+    def test_stream_claim(self):
+        import time
+
+        from django.utils.encoding import force_text
+
+        from sequere.contrib.timeline.streams import StreamWorker, GROUP, publish
+
+        workers = [StreamWorker(consumer, concurrency=1, count=4) for consumer in ('gone', 'alive')]
+
+        ids = [publish(self.user.pk, {'verb': 'join'}) for i in range(4)]
+
+        self.assertEqual(len(workers[0].read()), 4)
+
+        time.sleep(0.2)
+
+        # the oldest fan-outs are taken over by a consumer still alive
+        workers[1].connection.execute_command('XCLAIM', workers[1].key, GROUP, 'alive', 0, *ids[:2])
+
+        workers.append(StreamWorker('test', concurrency=1, count=2, claim_timeout=0.1))
+
+        # the stale fan-outs after them are still claimed
+        self.assertEqual([entry_id for entry_id, fields in workers[2].claim()],
+                         [force_text(entry_id) for entry_id in ids[2:]])
+
+        for worker in workers:
+            worker.close()
+
+    def test_dormant_followers(self):
+        import time
+
+        from mock import patch
+
+        from ..models import follow
+        from .sequere_registry import JoinAction, LikeAction
+        from sequere.backends.redis.connection import manager
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.activity import get_seen_key, get_seen_at, filter_active
+        from sequere.contrib.timeline.fanout import fanout
+        from sequere.contrib.timeline.signals import post_delete
+
+        follow(self.newbie, self.user)
+        follow(self.project, self.user)
+
+        timeline = Timeline(self.user)
+        newbie_timeline = Timeline(self.newbie)
+        project_timeline = Timeline(self.project)
+
+        timeline.save(JoinAction(self.user, date=datetime.now() - timedelta(days=3)))
+
+        with patch.object(timeline_settings, 'TIMELINE_DORMANT_AFTER', 60 * 60 * 24):
+            # the project was last seen two days ago
+            timeline.client.zadd(get_seen_key(), **{
+                '%s' % manager.make_uid(self.project): time.time() - 60 * 60 * 48
+            })
+
+            self.assertEqual(newbie_timeline.get_private().count(), 1)
+            self.assertIsNotNone(get_seen_at(timeline.client, manager.make_uid(self.newbie)))
+
+            # the resources never seen are dormant
+            self.assertEqual(filter_active(timeline.client, [(self.newbie, manager.make_uid(self.newbie)),
+                                                             (self.project, manager.make_uid(self.project)),
+                                                             (self.user, 'never:seen')]),
+                             [(self.newbie, manager.make_uid(self.newbie))])
+
+            action = LikeAction(actor=self.user, target=self.project)
+
+            timeline.save(action)
+
+            self.assertEqual(newbie_timeline.get_private_count(), 2)
+            self.assertEqual(project_timeline.get_private_count(), 1)
+
+            self.assertEqual(fanout(action.actor_uid, action.data), 1)
+
+            # the actions missed since the project was last seen are merged
+            self.assertEqual([entry.uid for entry in project_timeline.get_private().all()],
+                             [entry.uid for entry in newbie_timeline.get_private().all()])
+
+            self.assertEqual(project_timeline.get_private_count(action=LikeAction), 1)
+
+            timeline.save(LikeAction(actor=self.user, target=self.newbie))
+
+        self.assertEqual(project_timeline.get_private_count(), 3)
+
+        like = project_timeline.get_private().all()[0]
+
+        deleted = []
+
+        def receiver(sender, instance, action, **kwargs):
+            deleted.append(instance)
+
+        # the per follower signals retract the action one timeline at a time
+        post_delete.connect(receiver, sender=LikeAction)
+
+        try:
+            with patch.object(timeline_settings, 'TIMELINE_DORMANT_AFTER', 60 * 60 * 24):
+                timeline.client.zadd(get_seen_key(), **{
+                    '%s' % manager.make_uid(self.project): time.time() - 60 * 60 * 48
+                })
+
+                timeline.retract(like)
+        finally:
+            post_delete.disconnect(receiver, sender=LikeAction)
+
+        # the removals still reach the dormant followers
+        self.assertEqual(len(deleted), 3)
+        self.assertEqual(set(deleted), set([self.user, self.newbie, self.project]))
+
+        self.assertEqual(project_timeline.get_private_count(), 2)
+        self.assertEqual(newbie_timeline.get_private_count(), 2)
+
+    def test_dormant_followers_database(self):
+        import time
+
+        from mock import patch
+
+        from ..models import follow
+        from .sequere_registry import JoinAction, LikeAction
+        from sequere.backends.redis.connection import manager
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.activity import get_seen_key
+
+        timeline = Timeline(self.user)
+        project_timeline = Timeline(self.project)
+
+        with patch.object(settings, 'BACKEND_CLASS', 'sequere.backends.database.DatabaseBackend'), \
+                patch.object(timeline_settings, 'TIMELINE_DORMANT_AFTER', 60 * 60 * 24):
+            follow(self.project, self.user)
+            follow(self.project, self.newbie)
+
+            timeline.save(JoinAction(self.user))
+
+            # the project was last seen two days ago
+            timeline.client.zadd(get_seen_key(), **{
+                '%s' % manager.make_uid(self.project): time.time() - 60 * 60 * 48
+            })
+
+            timeline.save(LikeAction(actor=self.user, target=self.newbie))
+
+            self.assertEqual(project_timeline.rebuild(), 2)
+
+            Timeline(self.newbie).save(JoinAction(self.newbie))
+
+            timeline.client.zadd(get_seen_key(), **{
+                '%s' % manager.make_uid(self.project): time.time() - 60 * 60 * 48
+            })
+
+            # the followings are read from the database on wake up
+            self.assertEqual(project_timeline.get_private_count(), 2)
+            self.assertEqual(len(project_timeline.get_private().all()), 3)
+
+    def test_retract(self):
+        from mock import patch
+
+        from ..models import follow
+        from .sequere_registry import JoinAction, LikeAction
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.references import get_action_key
+
+        followers = self.followers
+
+        timeline = Timeline(self.user)
+        timeline.save(JoinAction(self.user))
+
+        like = LikeAction(actor=self.user, target=self.project)
+
+        timeline.save(like)
+
+        timeline.retract(like)
+
+        self.assertEqual(timeline.get_public_count(), 1)
+        self.assertFalse(timeline.client.exists(get_action_key(like.uid)))
+
+        for follower in followers:
+            self.assertEqual(Timeline(follower).get_private_count(), 1)
+            self.assertEqual(Timeline(follower).get_private_count(action=LikeAction), 0)
+
+        join = timeline.get_public().all()[0]
+
+        with patch.multiple(timeline_settings,
+                            TIMELINE_FANOUT_PARTITION_THRESHOLD=2,
+                            TIMELINE_FANOUT_PARTITION_SIZE=2):
+            timeline.retract(join)
+
+        self.assertFalse(timeline.client.exists(get_action_key(join.uid)))
+
+        for follower in followers:
+            self.assertEqual(Timeline(follower).get_private_count(), 0)
+
+        with patch.object(LikeAction, 'aggregate_interval', 60 * 60):
+            likes = [LikeAction(actor=actor, target=self.project) for actor in (self.user, self.newbie)]
+
+            follow(followers[0], self.newbie)
+
+            for like in likes:
+                Timeline(like.actor).save(like)
+
+            action = Timeline(followers[0]).get_private().all()[0]
+
+            self.assertEqual(action.actors_count, 2)
+
+            # the aggregate stays as long as an actor is left
+            timeline.retract(likes[0])
+
+            action = Timeline(followers[0]).get_private().all()[0]
+
+            self.assertEqual(action.actors, [self.newbie])
+            self.assertEqual(action.actors_count, 1)
+
+            Timeline(self.newbie).retract(likes[1])
+
+            self.assertEqual(Timeline(followers[0]).get_private_count(), 0)
+
+    def test_retract_aggregated_actors(self):
+        from mock import patch
+
+        from ..compat import User
+        from ..models import follow
+        from .sequere_registry import LikeAction
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+
+        other = User.objects.create_user(username='other',
+                                         email='other@ulule.com',
+                                         password='$ecret')
+
+        follow(self.project, self.user)
+        follow(self.project, self.newbie)
+        follow(self.project, other)
+
+        timeline = Timeline(self.project)
+
+        for payload_format in ('hash', 'msgpack'):
+            with patch.multiple(LikeAction, aggregate_interval=60 * 60, aggregate_actors=2), \
+                    patch.object(timeline_settings, 'TIMELINE_PAYLOAD_FORMAT', payload_format):
+                likes = [LikeAction(actor=actor, target=self.project,
+                                    date=datetime.now() - timedelta(seconds=len(payload_format) + index))
+                         for index, actor in enumerate((other, self.newbie, self.user))]
+
+                # the user is pushed out of the recent actors
+                for like in reversed(likes):
+                    Timeline(like.actor).save(like)
+
+                # the aggregate shows the most recent actor left
+                Timeline(other).retract(likes[0])
+
+                action = timeline.get_private().all()[0]
+
+                self.assertEqual(action.actor, self.newbie)
+                self.assertEqual(action.actors, [self.newbie])
+                self.assertEqual(action.actors_count, 2)
+
+                # and the actors no longer recent are still counted
+                Timeline(self.user).retract(likes[2])
+
+                self.assertEqual(timeline.get_private().all()[0].actors_count, 1)
+
+                Timeline(self.newbie).retract(likes[1])
+
+                self.assertEqual(timeline.get_private_count(), 0)
+
+    def test_retention(self):
+        from mock import patch
+
+        from ..models import follow
+        from .sequere_registry import JoinAction, LikeAction
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.retention import sweep
+
+        follow(self.newbie, self.user)
+
+        with patch.object(timeline_settings, 'TIMELINE_MAX_LENGTH', 1):
+            Timeline(self.user).save(JoinAction(self.user))
+            Timeline(self.user).save(LikeAction(actor=self.user, target=self.project))
+
+            timeline = Timeline(self.newbie)
+
+            self.assertEqual(timeline.get_private_count(), 1)
+            self.assertEqual(timeline.get_private().count(), 1)
+            self.assertEqual(timeline.get_private_count(action=JoinAction), 1)
+
+        Timeline(self.user, max_length=5).save(JoinAction(self.user))
+
+        self.assertEqual(Timeline(self.user).get_public_count(), 2)
+
+        with patch.object(timeline_settings, 'TIMELINE_MAX_LENGTH', 1):
+            self.assertTrue(sweep(batch_size=2) > 0)
+
+            self.assertEqual(Timeline(self.user).get_public_count(), 1)
+            self.assertEqual(Timeline(self.user).get_public().count(), 1)
+            self.assertEqual(Timeline(self.newbie).get_private_count(), 1)
+
+    def test_collect_actions(self):
+        from datetime import timedelta
+
+        from mock import patch
+
+        from django.core.management import call_command
+        from django.utils import timezone
+
+        from .sequere_registry import JoinAction
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.collector import collect
+        from sequere.contrib.timeline.connection import client
+        from sequere.contrib.timeline.references import get_action_key
+
+        timeline = Timeline(self.user)
+
+        action = JoinAction(self.user)
+        timeline.save(action)
+
+        # private and public timelines, by target and by verb
+        self.assertEqual(int(client.hget(get_action_key(action.uid), 'refs')), 8)
+
+        # saving twice does not count twice
+        timeline.save(action)
+
+        self.assertEqual(int(client.hget(get_action_key(action.uid), 'refs')), 8)
+
+        self.assertEqual(collect(), (0, 0))
+
+        timeline.delete(action)
+
+        self.assertEqual(int(client.hget(get_action_key(action.uid), 'refs')), 0)
+
+        older = JoinAction(self.user, date=timezone.now() - timedelta(days=1))
+        timeline.save(older)
+
+        with patch.object(timeline_settings, 'TIMELINE_MAX_LENGTH', 1):
+            Timeline(self.user).save(JoinAction(self.user))
+
+        self.assertEqual(int(client.hget(get_action_key(older.uid), 'refs')), 0)
+
+        count, size = collect(batch_size=1)
+
+        self.assertEqual(count, 2)
+        self.assertTrue(size > 0)
+
+        self.assertFalse(client.exists(get_action_key(action.uid)))
+        self.assertFalse(client.exists(get_action_key(older.uid)))
+
+        self.assertEqual(client.zcard(timeline._make_key('public')), 1)
+
+        # a late reference change recreates the hash of a collected action
+        client.hincrby(get_action_key(older.uid), 'refs', -1)
+        score = client.zrange(timeline._make_key('public'), 0, 0, withscores=True)[0][1]
+
+        client.zadd(timeline._make_key('public'), **{'%s' % older.uid: score - 1})
+
+        self.assertEqual(len(timeline.get_public()[0:2]), 1)
+
+        self.assertEqual(collect()[0], 1)
+
+        call_command('collect_actions', interval=0)
+
+    def test_pull_mode(self):
+        from mock import patch
+
+        from ..compat import User
+        from ..models import follow, unfollow
+        from .sequere_registry import JoinAction
+        from sequere.backends.redis import RedisBackend
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.timeline import is_pull_uid
+
+        follow(self.newbie, self.user)
+        follow(self.project, self.user)
+
+        with patch.object(timeline_settings, 'TIMELINE_PULL_THRESHOLD', 2):
+            action = JoinAction(self.user)
+
+            Timeline(self.user).save(action)
+
+            self.assertTrue(is_pull_uid(action.actor_uid))
+
+            timeline = Timeline(self.newbie)
+
+            # nothing has been pushed, the action is merged at read time
+            self.assertEqual(timeline.get_private_count(), 0)
+            self.assertEqual([a.uid for a in timeline.get_private().all()], ['%s' % action.uid])
+            self.assertEqual(timeline.get_unread_count(), 1)
+
+            # the followed pull mode actors are not resolved on every read
+            with patch.object(RedisBackend, 'filter_followings_uids') as filter_followings_uids:
+                self.assertEqual(timeline.get_private().count(), 1)
+                self.assertEqual(timeline.get_unread_count(), 1)
+
+            self.assertEqual(filter_followings_uids.call_count, 0)
+
+            latecomer = User.objects.create_user(username='latecomer',
+                                                 email='latecomer@ulule.com',
+                                                 password='$ecret')
+
+            follow(latecomer, self.user)
+
+            self.assertEqual(Timeline(latecomer).get_private().count(), 1)
+
+            unfollow(latecomer, self.user)
+
+            self.assertEqual(Timeline(latecomer).get_private().count(), 0)
+
+    def test_get_actions(self):
+        from .sequere_registry import JoinAction, LikeAction
+        from sequere.contrib.timeline import get_actions
+
+        actions = get_actions()
+
+        self.assertEqual(dict(actions), {
+            'join': JoinAction,
+            'like': LikeAction
+        })
+
+    def test_hydrate_actions(self):
+        from ..models import follow
+        from .sequere_registry import JoinAction, LikeAction
+        from sequere.contrib.timeline import Timeline
+
+        follow(self.user, self.newbie)
+
+        Timeline(self.newbie).save(JoinAction(self.newbie))
+        Timeline(self.newbie).save(LikeAction(actor=self.newbie, target=self.project))
+
+        timeline = Timeline(self.user)
+
+        timeline.save(JoinAction(self.user))
+        timeline.save(LikeAction(actor=self.user, target=self.project))
+
+        qs = timeline.get_private()
+
+        self.assertEqual(qs.count(), 4)
+
+        # one query per identifier for the whole page
+        with self.assertNumQueries(2):
+            actions = qs.all()[:]
+
+        self.assertEqual(set((action.actor, action.verb, action.target) for action in actions),
+                         set([(self.user, 'join', None),
+                              (self.user, 'like', self.project),
+                              (self.newbie, 'join', None),
+                              (self.newbie, 'like', self.project)]))
+
+    def test_packed_payloads(self):
+        from mock import patch
+
+        from .sequere_registry import JoinAction, LikeAction
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.collector import collect
+        from sequere.contrib.timeline.connection import client
+        from sequere.contrib.timeline.references import get_action_key
+        from sequere.backends.redis.utils import get_key
+
+        timeline = Timeline(self.user)
+
+        legacy = JoinAction(self.user)
+        timeline.save(legacy)
+
+        with patch.object(timeline_settings, 'TIMELINE_PAYLOAD_FORMAT', 'msgpack'):
+            action = LikeAction(actor=self.user, target=self.project, kwargs={'lang': 'fr'})
+            timeline.save(action)
+
+            self.assertEqual(client.type(get_action_key(action.uid)), 'string')
+            self.assertEqual(int(client.get(get_key(get_action_key(action.uid), 'refs'))), 12)
+
+            # the legacy hash is hydrated apart and migrated when read
+            with self.assertNumQueries(3):
+                actions = timeline.get_public().all()[:]
+
+            self.assertEqual([(a.verb, a.actor, a.target) for a in actions],
+                             [('like', self.user, self.project), ('join', self.user, None)])
+            self.assertEqual(actions[0].kwargs, {'lang': 'fr'})
+            self.assertEqual(actions[0].target_uid, '%s' % action.target_uid)
+
+            self.assertEqual(client.type(get_action_key(legacy.uid)), 'string')
+            self.assertEqual(int(client.get(get_key(get_action_key(legacy.uid), 'refs'))), 8)
+
+            # actors and targets are hydrated from the payloads only
+            with self.assertNumQueries(2):
+                self.assertEqual([a.uid for a in timeline.get_public().all()[:]],
+                                 ['%s' % action.uid, '%s' % legacy.uid])
+
+            timeline.delete(action)
+
+            count, size = collect()
+
+            self.assertEqual(count, 1)
+            self.assertTrue(size > 0)
+
+            self.assertFalse(client.exists(get_action_key(action.uid)))
+            self.assertTrue(client.exists(get_action_key(legacy.uid)))
+
+    def test_indexes(self):
+        from mock import patch
+
+        from ..models import follow
+        from .sequere_registry import JoinAction, LikeAction, Project, User
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.connection import client
+        from sequere.backends.redis.utils import get_key
+
+        follow(self.newbie, self.user)
+
+        timeline = Timeline(self.user)
+
+        with patch.object(timeline_settings, 'TIMELINE_INDEXES', ()):
+            timeline.save(JoinAction(self.user))
+            timeline.save(LikeAction(actor=self.user, target=self.project))
+
+            # only the private timelines are written
+            self.assertTrue(client.exists(timeline._make_key('private')))
+            self.assertFalse(client.exists(timeline._make_key('public')))
+            self.assertFalse(client.exists(timeline._make_key('private', action=JoinAction)))
+            self.assertFalse(client.exists(get_key(timeline._make_key('private'), 'count')))
+
+            # and the other indexes are filtered on read
+            self.assertEqual(timeline.get_private_count(), 2)
+            self.assertEqual(timeline.get_public_count(), 2)
+            self.assertEqual(timeline.get_public_count(action=JoinAction), 1)
+            self.assertEqual(timeline.get_private_count(target=Project), 1)
+            self.assertEqual(timeline.get_private_count(target=User), 2)
+            self.assertEqual([action.verb for action in timeline.get_public(action='like').all()], ['like'])
+            self.assertEqual(timeline.get_unread_count(action=JoinAction), 1)
+
+            newbie_timeline = Timeline(self.newbie)
+
+            self.assertEqual(newbie_timeline.get_private_count(), 2)
+            self.assertEqual(newbie_timeline.get_private_count(target=Project), 1)
+            self.assertEqual(newbie_timeline.get_public_count(), 0)
+
+            # the filtered reads are cached until the next write
+            timeline.save(LikeAction(actor=self.user, target=self.project))
+
+            self.assertEqual(timeline.get_public_count(), 3)
+            self.assertEqual(timeline.get_private_count(target=Project), 2)
+            self.assertEqual(newbie_timeline.get_private_count(target=Project), 2)
+
+        with patch.object(LikeAction, 'indexes', ('verb', 'counts', )):
+            timeline.save(LikeAction(actor=self.user, target=self.user))
+
+            self.assertEqual(client.get(get_key(timeline._make_key('private', action=LikeAction), 'count')), '1')
+            self.assertFalse(client.exists(timeline._make_key('private', target=User)))
+
+        with patch.multiple(timeline_settings, TIMELINE_INDEXES=(), TIMELINE_PAYLOAD_FORMAT='msgpack'):
+            Timeline(self.newbie).save(LikeAction(actor=self.newbie, target=self.project))
+
+            self.assertEqual(Timeline(self.newbie).get_public_count(target=Project), 1)
+
+    def test_cursor(self):
+        from django.utils import timezone
+
+        from .sequere_registry import JoinAction
+        from sequere.contrib.timeline import Timeline
+
+        timeline = Timeline(self.user)
+
+        now = timezone.now()
+
+        for date in [now - timedelta(days=2), now - timedelta(days=1), now, now, now]:
+            timeline.save(JoinAction(self.user, date=date))
+
+        expected = [action.uid for action in timeline.get_public().all()]
+
+        for desc in (True, False):
+            uids = []
+            cursor = None
+
+            while True:
+                qs = timeline.get_public(desc=desc, cursor=cursor)
+
+                # every entry past the cursor is counted, not the page
+                self.assertEqual(qs.count(), len(expected) - len(uids))
+
+                page = qs[0:2]
+
+                if not page:
+                    break
+
+                uids += [action.uid for action in page]
+                cursor = qs.last_cursor
+
+            self.assertEqual(uids, expected if desc else expected[::-1])
+
+        qs = timeline.get_public()
+        qs[0:2]
+
+        newest = qs.first_cursor
+
+        self.assertEqual(timeline.get_public(since=newest).count(), 0)
+
+        action = JoinAction(self.user, date=now)
+        timeline.save(action)
+
+        qs = timeline.get_public(since=newest)
+
+        self.assertEqual(qs.count(), 1)
+        self.assertEqual([a.uid for a in qs.all()], ['%s' % action.uid])
+
+        self.assertEqual(timeline.get_public(until=now - timedelta(hours=1)).count(), 2)
+        self.assertEqual(timeline.get_public(since=now - timedelta(days=1, hours=1),
+                                             until=now - timedelta(hours=1)).count(), 1)
+
+    def test_scores(self):
+        import pytz
+
+        from django.core.management import call_command
+
+        from .sequere_registry import JoinAction
+        from sequere.utils import to_timestamp, from_timestamp
+        from sequere.contrib.timeline import Timeline
+        from sequere.contrib.timeline.scores import get_score, get_max_score, rescale
+
+        date = datetime(2015, 6, 1, 12, 30, 15, 123456, tzinfo=pytz.utc)
+
+        self.assertEqual(to_timestamp(date), 1433161815.123)
+        self.assertEqual(to_timestamp(date.astimezone(pytz.timezone('Europe/Paris'))), 1433161815.123)
+
+        with override_settings(USE_TZ=True, TIME_ZONE='Europe/Paris'):
+            self.assertEqual(from_timestamp(1433161815.123), date.replace(microsecond=123000))
+            self.assertEqual(from_timestamp(1433161815.123).utcoffset(), timedelta(hours=2))
+
+        timeline = Timeline(self.user)
+
+        now = datetime.now()
+
+        actions = [JoinAction(self.user, date=now) for i in range(3)]
+
+        for action in actions:
+            timeline.save(action)
+
+        # the actions of the same millisecond are ordered by uid
+        self.assertEqual([action.uid for action in timeline.get_public().all()],
+                         ['%s' % action.uid for action in reversed(actions)])
+
+        self.assertEqual(timeline.get_public(until=now).count(), 3)
+        self.assertEqual(timeline.get_public(since=now).count(), 0)
+
+        timeline.mark_as_read(timestamp=now)
+
+        self.assertEqual(timeline.get_unread_count(), 0)
+
+        # entries and read markers stored with a precision of a second
+        key = timeline._make_key('public')
+        timestamp = int(to_timestamp(now))
+
+        timeline.client.zadd(key, **{'%s' % actions[0].uid: timestamp})
+        timeline.client.set(timeline._get_read_key(), timestamp)
+
+        call_command('rescale_scores', batch_size=1)
+
+        self.assertEqual(timeline.client.zscore(key, '%s' % actions[0].uid), get_score(timestamp, actions[0].uid))
+        self.assertEqual(timeline.client.get(timeline._get_read_key()), repr(get_max_score(timestamp)))
+
+        self.assertEqual(rescale(), 0)
+
+    def test_union(self):
+        from mock import patch
+
+        from .sequere_registry import JoinAction, LikeAction, Project
+        from sequere.contrib.timeline import Timeline
+
+        timeline = Timeline(self.user)
+
+        timeline.save(JoinAction(self.user))
+        timeline.save(LikeAction(actor=self.user, target=self.project))
+        timeline.save(LikeAction(actor=self.user, target=self.newbie))
+
+        with patch.object(timeline.client, 'union', wraps=timeline.client.union) as union:
+            qs = timeline.get_private(actions=[JoinAction, 'like'])
+
+            self.assertEqual(qs.count(), 3)
+            self.assertEqual(len(qs[0:2]), 2)
+
+            # the union is cached across pages
+            self.assertEqual(len(timeline.get_private(actions=[JoinAction, 'like'], cursor=qs.last_cursor)[0:2]), 1)
+
+            self.assertEqual(union.call_count, 1)
+
+            timeline.save(JoinAction(self.user))
+
+            # and invalidated by writes
+            self.assertEqual(timeline.get_private(actions=[JoinAction, 'like']).count(), 4)
+
+            self.assertEqual(union.call_count, 2)
+
+        self.assertEqual(timeline.get_private(actions=['join'], targets=[Project]).count(), 0)
+        self.assertEqual([action.target for action in timeline.get_private(actions=['join', 'like'],
+                                                                           targets=[Project]).all()],
+                         [self.project])
+        self.assertEqual(timeline.get_public(targets=['project', Project]).count(), 1)
+
+    def test_populate(self):
+        from ..models import follow, unfollow
+        from .sequere_registry import JoinAction, LikeAction, Project
+        from sequere.backends.redis.connection import manager
+        from sequere.contrib.timeline import Timeline
+        from sequere.contrib.timeline.fanout import populate
+
+        timeline = Timeline(self.user)
+
+        timeline.save(JoinAction(self.user, date=datetime.now() - timedelta(days=1)))
+        timeline.save(LikeAction(actor=self.user, target=self.project))
+        timeline.save(LikeAction(actor=self.user, target=self.newbie))
+
+        uids = [action.uid for action in timeline.get_public().all()]
+
+        follow(self.newbie, self.user)
+
+        newbie_timeline = Timeline(self.newbie)
+
+        self.assertEqual([action.uid for action in newbie_timeline.get_private().all()], uids)
+        self.assertEqual(newbie_timeline.get_private_count(action=LikeAction), 2)
+        self.assertEqual(newbie_timeline.get_private_count(target=Project), 1)
+
+        from_uid = manager.make_uid(self.user)
+        to_uid = manager.make_uid(self.newbie)
+
+        # the actions are neither hydrated nor counted twice
+        with self.assertNumQueries(1):
+            self.assertEqual(populate(from_uid, to_uid), 3)
+
+        self.assertEqual(newbie_timeline.get_private_count(), 3)
+        self.assertEqual(newbie_timeline.get_private_count(action=LikeAction), 2)
+
+        unfollow(self.newbie, self.user)
+
+        self.assertEqual(newbie_timeline.get_private_count(), 0)
+        self.assertEqual(newbie_timeline.get_private_count(action=LikeAction), 0)
+        self.assertEqual(newbie_timeline.get_private_count(target=Project), 0)
+
+        self.assertEqual(populate(from_uid, to_uid, limit=2), 2)
+
+        self.assertEqual([action.uid for action in newbie_timeline.get_private().all()], uids[:2])
+
+    def test_aggregate_actions(self):
+        from mock import patch
+
+        from ..compat import User
+        from ..models import follow
+        from .sequere_registry import LikeAction
+        from sequere.contrib.timeline import Timeline
+
+        other = User.objects.create_user(username='other',
+                                         email='other@ulule.com',
+                                         password='$ecret')
+
+        follow(self.newbie, self.user)
+        follow(self.newbie, other)
+
+        timeline = Timeline(self.newbie)
+
+        with patch.object(LikeAction, 'aggregate_interval', 60 * 60):
+            Timeline(self.user).save(LikeAction(actor=self.user, target=self.project))
+            Timeline(other).save(LikeAction(actor=other, target=self.project))
+            Timeline(other).save(LikeAction(actor=other, target=self.project))
+
+            # the followers get one entry per target
+            self.assertEqual(timeline.get_private_count(), 1)
+            self.assertEqual(timeline.get_private_count(action=LikeAction), 1)
+
+            action = timeline.get_private().all()[0]
+
+            self.assertEqual(action.actor, other)
+            self.assertEqual(action.actors, [other, self.user])
+            self.assertEqual(action.actors_count, 2)
+
+            Timeline(self.user).save(LikeAction(actor=self.user, target=self.newbie))
+
+            self.assertEqual(timeline.get_private_count(), 2)
+
+            # the actors keep their own actions
+            self.assertEqual(Timeline(other).get_public_count(), 2)
+
+            action = Timeline(other).get_public().all()[0]
+
+            self.assertEqual(action.actors, [other])
+            self.assertEqual(action.actors_count, 1)
+
+    def test_get_many(self):
+        from ..compat import User
+        from ..models import follow
+        from .sequere_registry import JoinAction, LikeAction
+        from sequere.contrib.timeline import Timeline
+
+        other = User.objects.create_user(username='other',
+                                         email='other@ulule.com',
+                                         password='$ecret')
+
+        follow(self.newbie, self.user)
+        follow(other, self.user)
+
+        timeline = Timeline(self.user)
+        timeline.save(JoinAction(self.user, date=datetime.now() - timedelta(days=2)))
+        timeline.save(LikeAction(actor=self.user, target=self.project))
+
+        Timeline(other).save(JoinAction(other))
+
+        # the actions shared by the timelines are hydrated once
+        with self.assertNumQueries(2):
+            results = list(Timeline.get_many([self.newbie, other]))
+
+        self.assertEqual([(instance, [action.verb for action in actions]) for instance, actions in results],
+                         [(self.newbie, ['like', 'join']), (other, ['join', 'like', 'join'])])
+
+        results = Timeline.get_many(iter([self.newbie, other]), since=datetime.now() - timedelta(days=1), limit=1)
+
+        self.assertEqual([(instance, [action.actor for action in actions]) for instance, actions in results],
+                         [(self.newbie, [self.user]), (other, [other])])
+
+    def test_get_many_dormant(self):
+        from mock import patch
+
+        from ..models import follow
+        from .sequere_registry import JoinAction, LikeAction
+        from sequere.backends.redis.connection import manager
+        from sequere.contrib.timeline import Timeline, settings as timeline_settings
+        from sequere.contrib.timeline.activity import get_seen_at
+
+        follow(self.newbie, self.user)
+        follow(self.project, self.user)
+
+        timeline = Timeline(self.user)
+
+        with patch.object(timeline_settings, 'TIMELINE_DORMANT_AFTER', 60 * 60 * 24):
+            Timeline(self.project).get_private()
+
+            # the newbie has never been seen and is skipped by the fan-out
+            timeline.save(JoinAction(self.user))
+            timeline.save(LikeAction(actor=self.user, target=self.project))
+
+            self.assertEqual(Timeline(self.newbie).get_private_count(), 0)
+
+            results = list(Timeline.get_many([self.newbie, self.project]))
+
+            self.assertEqual([(instance, [action.verb for action in actions]) for instance, actions in results],
+                             [(self.newbie, ['like', 'join']), (self.project, ['like', 'join'])])
+
+            self.assertIsNotNone(get_seen_at(timeline.client, manager.make_uid(self.newbie)))
 
     def test_signals_actions(self):
         from ..models import follow, unfollow
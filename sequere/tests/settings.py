@@ -6,6 +6,10 @@ DATABASES = {
         'PASSWORD': '',
         'HOST': '',
         'PORT': '',
+    },
+    'shard': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'shard',
     }
 }
 
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import calendar
 from datetime import datetime
 
 import six
@@ -72,19 +73,24 @@ def load_class(class_path, setting_name=None):
 
 def from_timestamp(timestamp):
     if settings.USE_TZ:
-        import pytz
-
-        local_tz = timezone.get_default_timezone()
-
-        utc_dt = datetime.utcfromtimestamp(timestamp).replace(tzinfo=pytz.utc)
-
-        return local_tz.normalize(utc_dt.astimezone(local_tz))
+        # the default timezone is cached by django, converting from UTC
+        # with it does not need to normalize the result
+        return datetime.fromtimestamp(timestamp, timezone.get_default_timezone())
 
     return datetime.fromtimestamp(timestamp)
 
 
 def to_timestamp(dt):
-    return int(time.mktime(dt.timetuple()))
+    """
+    Returns the UTC timestamp of ``dt`` with a millisecond precision, a
+    naive ``dt`` is in the local time.
+    """
+    if timezone.is_aware(dt):
+        timestamp = calendar.timegm(dt.utctimetuple())
+    else:
+        timestamp = time.mktime(dt.timetuple())
+
+    return round(timestamp + dt.microsecond / 1000000.0, 3)
 
 
 def get_client(connection, connection_class=None):
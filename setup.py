@@ -34,8 +34,9 @@ setup(
     extras_require={
         'redis': ['redis'],
         'nydus': ['nydus'],
+        'msgpack': ['msgpack-python'],
     },
     install_requires=['six'],
-    tests_require=['coverage', 'exam', 'celery', 'nydus'],
+    tests_require=['coverage', 'exam', 'celery', 'nydus', 'msgpack-python'],
     packages=find_packages(exclude=['tests']),
 )